@@ -0,0 +1,75 @@
+"""Run one csutil script in this process and print its timing and memory as JSON.
+
+Used by run_benchmarks.py, which starts one fresh process per measurement so that the peak RSS
+belongs to a single run.
+"""
+
+import sys
+import os
+import io
+import json
+import time
+import runpy
+import resource
+import contextlib
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.path.join(os.path.dirname(HERE), 'scripts')
+
+
+def rss_mb(ru_maxrss: int) -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return ru_maxrss / (1024 * 1024) if sys.platform == 'darwin' else ru_maxrss / 1024
+
+
+def setup_standin(mode: str) -> bool:
+    if mode == 'always':
+        sys.path.insert(0, os.path.join(HERE, 'standin'))
+        return True
+    try:
+        import cryosparc_compute.dataset  # noqa: F401
+        return False
+    except ImportError:
+        if mode == 'never':
+            raise
+        sys.path.insert(0, os.path.join(HERE, 'standin'))
+        return True
+
+
+def main() -> None:
+    script, script_args, use_tracemalloc, standin_mode = sys.argv[1], json.loads(sys.argv[2]), sys.argv[3] == '1', sys.argv[4]
+    sys.path.insert(0, SCRIPTS_DIR)
+    standin = setup_standin(standin_mode)
+
+    rss_before = rss_mb(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    if use_tracemalloc:
+        tracemalloc.start()
+    sys.argv = [script] + script_args
+    error = None
+    log = io.StringIO()
+    t0 = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(log):
+            runpy.run_path(os.path.join(SCRIPTS_DIR, script), run_name='__main__')
+    except SystemExit as err:
+        if err.code not in (None, 0):
+            error = str(err.code)
+    except Exception as err:
+        error = f'{type(err).__name__}: {err}'
+    wall = time.perf_counter() - t0
+    tracemalloc_peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024) if use_tracemalloc else None
+    print(json.dumps({
+        'wall_s': wall,
+        'peak_rss_mb': rss_mb(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss),
+        'rss_before_mb': rss_before,
+        'tracemalloc_peak_mb': tracemalloc_peak,
+        'standin': standin,
+        'ok': error is None,
+        'error': error,
+        'log_tail': log.getvalue()[-2000:] if error is not None else None,
+    }))
+
+
+if __name__ == '__main__':
+    main()
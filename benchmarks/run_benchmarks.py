@@ -0,0 +1,231 @@
+"""Benchmarks of the csutil scripts on synthetic particle datasets.
+
+Synthetic .cs/.csg/passthrough files are written for every size, every script is run in a
+fresh process, and wall time, peak RSS and the tracemalloc peak are written to a JSON report.
+Reports of different commits can be compared with --compare.
+
+The cold start of every subcommand of scripts/csutil.py ("--help" in a new interpreter) is measured
+as well, together with the heavy modules it imported, which should be none.
+
+If cryosparc_compute is not importable, a local stand-in (benchmarks/standin) is used.
+
+Example:
+    python benchmarks/run_benchmarks.py --sizes 10000 100000 --output bench_report.json
+"""
+
+import sys
+import os
+import argparse
+import datetime
+import json
+import platform
+import shutil
+import subprocess
+import time
+from typing import Dict, List
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Modules which must not be imported before the code path that needs them.
+HEAVY_MODULES = ('cryosparc_compute', 'matplotlib', 'pandas', 'scipy', 'pyarrow', 'yaml')
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'scripts'))
+
+from csutil_lib import csio, synthetic  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description=__doc__
+    )
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10000, 100000, 1000000, 5000000], help='Numbers of particles.')
+    parser.add_argument('--particles-per-micrograph', type=int, default=300, help='Average number of particles per micrograph.')
+    parser.add_argument('--num-uuid', type=int, default=1, help='Number of UUID prefixes of the original blob paths.')
+    parser.add_argument('--imported-num-uuid', type=int, default=1, help='Number of UUID prefixes added to the imported blob paths.')
+    parser.add_argument('--num-extra-fields', type=int, default=0, help='Number of additional float32 fields of the particles.')
+    parser.add_argument('--scripts', nargs='+', help='Run only the cases of these scripts (e.g. csutil_stat.py). Default is all scripts.')
+    parser.add_argument('--workdir', type=str, default='bench_data', help='Directory for synthetic datasets and outputs.')
+    parser.add_argument('--output', type=str, default='bench_report.json', help='Output JSON report.')
+    parser.add_argument('--compare', type=str, help='Previous JSON report to compare with.')
+    parser.add_argument('--repeat', type=int, default=1, help='Number of runs per case. The fastest run is reported.')
+    parser.add_argument('--no-tracemalloc', action='store_true', help='Do not trace Python allocations (tracemalloc slows down the runs).')
+    parser.add_argument('--standin', choices=['auto', 'always', 'never'], default='auto', help='When to use the local stand-in for cryosparc_compute.')
+    parser.add_argument('--keep-data', action='store_true', help='Keep the synthetic datasets after the run.')
+    parser.add_argument('--no-startup', action='store_true', help='Do not measure the cold start of the csutil.py subcommands.')
+    return parser.parse_args()
+
+
+def write_inputs(datadir: str, num_particles: int, args) -> Dict[str, str]:
+    extra_fields = [f'extra/f{i}' for i in range(args.num_extra_fields)]
+    paths = synthetic.write_transfer_set(
+        datadir, num_particles,
+        num_micrographs=max(1, num_particles // args.particles_per_micrograph),
+        orig_num_uuid=args.num_uuid, imported_num_uuid=args.imported_num_uuid,
+        extra_fields=extra_fields,
+    )
+    paths['particles'] = os.path.join(datadir, 'particles.cs')
+    csio.save_cs(paths['particles'], synthetic.make_particles(
+        num_particles, max(1, num_particles // args.particles_per_micrograph), args.num_uuid, extra_fields=extra_fields
+    ))
+    return paths
+
+
+def cases(paths: Dict[str, str], outdir: str, args) -> List[dict]:
+    out = lambda name: os.path.join(outdir, name)
+    transfer_args = [
+        '--orig_cs_file', paths['orig_cs_file'], '--orig_csg_file', paths['orig_csg_file'],
+        '--orig_passthrough_file', paths['orig_passthrough_file'], '--imported_cs_file', paths['imported_cs_file'],
+        '--orig_num_remove_blobpath_uuid', str(args.num_uuid),
+        '--imported_num_remove_blobpath_uuid', str(args.num_uuid + args.imported_num_uuid),
+        '--overwrite',
+    ]
+    return [
+        {'script': 'csutil_stat.py', 'case': 'stat_4targets', 'args': [
+            '--infile', paths['particles'], '--outfile-rootname', out('stat'), '--overwrite',
+            '--targets', 'alignments3D/error', 'ctf/df1_A', 'ctf/cross_corr_ctffind4', 'alignments2D/alpha']},
+        {'script': 'csutil_stat.py', 'case': 'stat_group_micrograph', 'args': [
+            '--infile', paths['particles'], '--outfile-rootname', out('group'), '--overwrite', '--group-by', 'micrograph',
+            '--targets', 'alignments3D/error', 'ctf/df1_A', '--outlier-threshold', '3.5']},
+        {'script': 'csutil_stat.py', 'case': 'stat_density', 'args': [
+            '--infile', paths['particles'], '--outfile-rootname', out('density'), '--overwrite', '--targets', 'alignments3D/error',
+            '--density', 'ctf/df1_A:alignments3D/error', '--viewing-directions']},
+        {'script': 'csutil_particle_filtering.py', 'case': 'filter_sigma', 'args': [
+            '--infile', paths['particles'], '--outfile-rootname', out('filter_sigma'), '--overwrite',
+            '--target', 'alignments3D/error', '--sigma', '2']},
+        {'script': 'csutil_particle_filtering.py', 'case': 'filter_passthrough', 'args': [
+            '--infile', paths['orig_cs_file'], '--infile-passthrough', paths['orig_passthrough_file'],
+            '--outfile-rootname', out('filter_passthrough'), '--overwrite', '--target', 'alignments3D/error', '--sigma', '2']},
+        {'script': 'csutil_cs_to_csv.py', 'case': 'to_csv', 'args': [
+            '--infile', paths['particles'], '--outfile', out('particles.csv'), '--overwrite']},
+        {'script': 'csutil_replace_metafile.py', 'case': 'replace_metafile', 'args': [
+            '--infile', paths['orig_csg_file'], '--outfile', out('replaced.csg'), '--metafile', paths['orig_cs_file'], '--overwrite']},
+        {'script': 'csutil_particle_sets.py', 'case': 'sets_difference_blob', 'args': [
+            '--operation', 'difference', '--infile', paths['orig_cs_file'], paths['imported_cs_file'], '--match-by', 'blob',
+            '--num-remove-blobpath-uuid', str(args.num_uuid), str(args.num_uuid + args.imported_num_uuid),
+            '--outfile', out('difference.cs'), '--no-index-cache', '--overwrite']},
+        {'script': 'csutil_particle_sets.py', 'case': 'sets_union_uid', 'args': [
+            '--operation', 'union', '--infile', paths['orig_cs_file'], paths['particles'], '--outfile', out('union.cs'), '--overwrite']},
+        {'script': 'csutil_transfer_alignments3d.py', 'case': 'transfer_nocache', 'args': transfer_args + [
+            '--output_cs_file', out('transferred.cs'), '--no_index_cache']},
+        {'script': 'csutil_transfer_alignments3d.py', 'case': 'transfer_cached', 'args': transfer_args + [
+            '--output_cs_file', out('transferred.cs'), '--index_cache_dir', out('index_cache')], 'warmup': True},
+        {'script': 'csutil_transfer_alignments3d.py', 'case': 'transfer_plan', 'args': transfer_args + [
+            '--output_cs_file', out('transferred.cs'), '--index_cache_dir', out('index_cache'), '--plan']},
+        # The warmup writes the output and its row mapping; the measured runs only scatter the alignments3D columns.
+        {'script': 'csutil_transfer_alignments3d.py', 'case': 'transfer_incremental', 'args': transfer_args + [
+            '--output_cs_file', out('incremental.cs'), '--index_cache_dir', out('index_cache'), '--incremental'], 'warmup': True},
+    ]
+
+
+def run_case(case: dict, args) -> dict:
+    cmd = [sys.executable, os.path.join(HERE, '_runner.py'), case['script'], json.dumps(case['args']),
+           '0' if args.no_tracemalloc else '1', args.standin]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    try:
+        return json.loads(proc.stdout.strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        return {'ok': False, 'error': proc.stderr[-2000:]}
+
+
+def run_startup(subcommand: str, repeat: int) -> dict:
+    """Wall time of "csutil.py <subcommand> --help" in a new interpreter (best of ``repeat``) and the heavy modules it imported."""
+    cmd = [sys.executable, os.path.join(os.path.dirname(HERE), 'scripts', 'csutil.py'), subcommand, '--help']
+    walls = []
+    for _ in range(max(1, repeat)):
+        t0 = time.perf_counter()
+        proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+        walls.append(time.perf_counter() - t0)
+        if proc.returncode != 0:
+            return {'ok': False, 'error': proc.stderr[-2000:]}
+    proc = subprocess.run([sys.executable, '-X', 'importtime'] + cmd[1:], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    imported = [line.rsplit('|', 1)[-1].strip() for line in proc.stderr.splitlines() if line.startswith('import time:')]
+    heavy = sorted({name.split('.')[0] for name in imported if name.split('.')[0] in HEAVY_MODULES})
+    return {'ok': True, 'wall_s': min(walls), 'peak_rss_mb': None, 'heavy_imports': heavy}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=HERE, stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def compare(report: dict, baseline: dict) -> None:
+    base = {(r['case'], r['num_particles']): r for r in baseline['results']}
+    print(f'##### Comparison with {baseline["meta"].get("commit", "")[:10]} #####')
+    print(f'{"case":<30}{"particles":>12}{"wall_s":>12}{"ratio":>8}{"rss_mb":>12}{"ratio":>8}')
+    for r in report['results']:
+        b = base.get((r['case'], r['num_particles']))
+        if b is None or not r.get('ok') or not b.get('ok'):
+            continue
+        line = f'{r["case"]:<30}{r["num_particles"]:>12}{r["wall_s"]:>12.3f}{r["wall_s"] / b["wall_s"]:>8.2f}'
+        if r['peak_rss_mb'] is not None and b['peak_rss_mb'] is not None:
+            line += f'{r["peak_rss_mb"]:>12.1f}{r["peak_rss_mb"] / b["peak_rss_mb"]:>8.2f}'
+        print(line)
+
+
+def main() -> None:
+    args = parse_args()
+    import numpy as np
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'created': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'params': vars(args),
+        },
+        'results': [],
+    }
+    if not args.no_startup:
+        from csutil import SUBCOMMANDS
+        print('Cold start of csutil.py subcommands ...')
+        for subcommand, (module, _) in SUBCOMMANDS.items():
+            if args.scripts is not None and f'{module}.py' not in args.scripts:
+                continue
+            result = run_startup(subcommand, args.repeat)
+            result.update({'script': f'{module}.py', 'case': f'startup_{subcommand}', 'num_particles': 0})
+            report['results'].append(result)
+            if result['ok']:
+                heavy = ', '.join(result['heavy_imports']) or 'none'
+                print(f'\t{result["case"]:<30} {result["wall_s"]:9.3f} s  heavy imports: {heavy}')
+            else:
+                print(f'\t{result["case"]:<30} FAILED: {result.get("error")}')
+
+    for num_particles in args.sizes:
+        datadir = os.path.join(args.workdir, f'n{num_particles}')
+        outdir = os.path.join(datadir, 'out')
+        os.makedirs(outdir, exist_ok=True)
+        print(f'Writing synthetic datasets of {num_particles} particles to {datadir} ...')
+        paths = write_inputs(datadir, num_particles, args)
+        for case in cases(paths, outdir, args):
+            if args.scripts is not None and case['script'] not in args.scripts:
+                continue
+            if case.get('warmup'):
+                run_case(case, args)
+            best = None
+            for _ in range(args.repeat):
+                result = run_case(case, args)
+                if best is None or (result.get('ok') and result['wall_s'] < best.get('wall_s', float('inf'))):
+                    best = result
+            best.update({'script': case['script'], 'case': case['case'], 'num_particles': num_particles})
+            report['results'].append(best)
+            if best.get('ok'):
+                print(f'\t{case["case"]:<30} {best["wall_s"]:9.3f} s  peak RSS {best["peak_rss_mb"]:9.1f} MB')
+            else:
+                print(f'\t{case["case"]:<30} FAILED: {best.get("error")}')
+        if not args.keep_data:
+            shutil.rmtree(datadir)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Report saved as {args.output}')
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1 @@
+"""Local stand-in for the cryosparc_compute package, used by the benchmarks when cryoSPARC is not installed."""
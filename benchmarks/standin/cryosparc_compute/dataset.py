@@ -0,0 +1,50 @@
+"""Minimal stand-in for cryosparc_compute.dataset.
+
+Implements only what the csutil scripts use (load, save, innerjoin, to_records, len and
+to_dataframe) on plain numpy structured arrays. Timings measured with it exclude the cost
+of cryoSPARC's own Dataset implementation.
+"""
+
+import numpy as np
+
+
+class Dataset:
+    def __init__(self, data=None):
+        if isinstance(data, Dataset):
+            data = data._data
+        self._data = None if data is None else np.array(data)
+
+    def load(self, path):
+        self._data = np.load(path)
+        return self
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            np.save(f, self._data)
+
+    def __len__(self):
+        return 0 if self._data is None else len(self._data)
+
+    def to_records(self):
+        return self._data
+
+    def innerjoin(self, other):
+        a, b = self._data, other._data
+        _, ia, ib = np.intersect1d(a['uid'], b['uid'], assume_unique=True, return_indices=True)
+        names = list(a.dtype.names) + [name for name in b.dtype.names if name not in a.dtype.names]
+        out = np.empty(len(ia), dtype=[(name, (a if name in a.dtype.names else b).dtype.fields[name][0]) for name in names])
+        for name in names:
+            out[name] = a[name][ia] if name in a.dtype.names else b[name][ib]
+        return Dataset(out)
+
+
+def to_dataframe(dset):
+    import pandas as pd
+    arr = dset.to_records()
+    columns = {}
+    for name in arr.dtype.names:
+        col = arr[name]
+        if col.dtype.kind == 'S':
+            col = np.char.decode(col)
+        columns[name] = list(col) if col.ndim > 1 else col
+    return pd.DataFrame(columns)
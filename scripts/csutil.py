@@ -0,0 +1,46 @@
+"""Single entry point of the csutil scripts.
+
+    python csutil.py <subcommand> [options]
+
+is the same as ``python csutil_<script>.py [options]``. Only the module of the subcommand is imported,
+and heavy dependencies (cryosparc_compute, matplotlib, pyarrow, ...) are imported by the code paths that use them,
+so that "--help" and light subcommands start quickly.
+"""
+
+import sys
+import runpy
+
+SUBCOMMANDS = {
+    'stat': ('csutil_stat', 'Statistics and histograms of particle features.'),
+    'filter': ('csutil_particle_filtering', 'Filter particles by thresholds of particle features.'),
+    'to-csv': ('csutil_cs_to_csv', 'Convert cs files to CSV, Parquet or Feather.'),
+    'sets': ('csutil_particle_sets', 'Union, intersection and difference of particle sets.'),
+    'replace-metafile': ('csutil_replace_metafile', 'Replace the metafile of csg files.'),
+    'transfer-alignments3d': ('csutil_transfer_alignments3d', 'Transfer 3D alignments of particles re-imported from RELION.'),
+}
+
+
+def usage() -> str:
+    lines = [__doc__.strip().splitlines()[0], '', 'usage: csutil.py <subcommand> [options]', '', 'subcommands:']
+    for name, (_, description) in SUBCOMMANDS.items():
+        lines.append(f'  {name:<24}{description}')
+    lines.append('')
+    lines.append('"csutil.py <subcommand> --help" shows the options of a subcommand.')
+    return '\n'.join(lines)
+
+
+def main() -> None:
+    if len(sys.argv) < 2 or sys.argv[1] in ('-h', '--help'):
+        print(usage())
+        return
+    name = sys.argv[1]
+    if name not in SUBCOMMANDS:
+        sys.exit(f'Unknown subcommand: {name}\n\n{usage()}')
+    module = SUBCOMMANDS[name][0]
+    sys.argv = [f'{module}.py'] + sys.argv[2:]
+    # alter_sys makes the module __main__ while it runs, so that its functions can be pickled for worker processes.
+    runpy.run_module(module, run_name='__main__', alter_sys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,13 @@
 import sys
 import os
 import argparse
-import pandas as pd
-from cryosparc_compute import dataset
+import itertools
+from typing import Iterable, List, Optional, Union
+import numpy as np
+from csutil_lib import csio, fanin, metrics
+
+
+FORMATS = ('csv', 'parquet', 'feather')
 
 
 def parse_args():
@@ -10,9 +15,15 @@ def parse_args():
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
         description=__doc__
     )
-    parser.add_argument('--infile', type=str, required=True, help='Input cs file.')
-    parser.add_argument('--outfile', type=str, help='Output csv file. Default is the input file with its extension changed to .csv')
+    parser.add_argument('--infile', nargs='+', type=str, required=True, help='Input cs file(s). Glob patterns and directories (all *.cs files in them) are accepted.')
+    parser.add_argument('--outfile', type=str, help='Output file. Several input files are concatenated into this file. Default is each input file with its extension changed to that of --format')
     parser.add_argument('--overwrite', action='store_true', help='Allow overwriting output file.')
+    parser.add_argument('--format', type=str, choices=FORMATS, default='csv', help='Output file format. parquet and feather require pyarrow.')
+    parser.add_argument('--columns', nargs='+', type=str, help='Columns to export. Multiple columns can be specified via whitespace separated list. Default is all columns.')
+    parser.add_argument('--chunk-size', type=int, default=100000, help='Number of rows read and written at once.')
+    parser.add_argument('--metrics-json', type=str, help='Write timing, throughput and memory of each processing phase to this JSON file.')
+    parser.add_argument('--num-workers', type=int, help='Number of processes for converting several input files one by one. Default is the number of CPUs.')
+    parser.add_argument('--compression', type=str, help='Compression codec for parquet/feather output (e.g. snappy, zstd, lz4).')
 
     args = parser.parse_args()
 
@@ -24,18 +35,89 @@ def parse_args():
     return args
 
 
-def main(infile: str, outfile: str, overwrite: bool) -> None:
-    assert os.path.exists(infile), f'Input file {infile} not exist'
+def write_csv(chunks: Iterable[np.ndarray], outfile: str) -> None:
+    from cryosparc_compute import dataset
+    with open(outfile, 'w', newline='') as f:
+        for i, chunk in enumerate(chunks):
+            df = dataset.to_dataframe(dataset.Dataset(chunk))
+            df.to_csv(f, index=False, header=(i == 0))
+
+
+def write_arrow(chunks: Iterable[np.ndarray], outfile: str, fmt: str, compression: Optional[str]) -> None:
+    from csutil_lib import arrow
+    pa = arrow.import_pyarrow()
+    writer = None
+    try:
+        for chunk in chunks:
+            table = arrow.to_arrow_table(chunk)
+            if writer is None:
+                if fmt == 'parquet':
+                    import pyarrow.parquet
+                    writer = pyarrow.parquet.ParquetWriter(outfile, table.schema, compression=compression or 'snappy')
+                else:
+                    options = pa.ipc.IpcWriteOptions(compression=compression)
+                    writer = pa.ipc.new_file(outfile, table.schema, options=options)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def write_chunks(chunks: Iterable[np.ndarray], outfile: str, fmt: str, compression: Optional[str]) -> None:
+    if fmt == 'csv':
+        write_csv(chunks, outfile)
+    else:
+        write_arrow(chunks, outfile, fmt, compression)
 
-    if outfile is None:
-        outfile = os.path.splitext(infile)[0] + '.csv'
+
+def export_file(infile: str, outfile: str, fmt: str, columns: Optional[List[str]], chunk_size: int, compression: Optional[str]) -> str:
+    """Convert one input file. Runs in a worker process when several files are converted one by one."""
+    write_chunks(csio.iter_chunks(infile, chunk_size, columns), outfile, fmt, compression)
+    return outfile
+
+
+def main(
+    infile: Union[str, List[str]], outfile: str, overwrite: bool, fmt: str = 'csv', columns: Optional[List[str]] = None, chunk_size: int = 100000,
+    compression: Optional[str] = None, metrics_json: Optional[str] = None, num_workers: Optional[int] = None
+) -> None:
+    infiles = csio.expand_paths([infile] if isinstance(infile, str) else infile)
+    if len(infiles) == 0:
+        sys.exit(f'No input files match {infile}')
+    for path in infiles:
+        assert os.path.exists(path), f'Input file {path} not exist'
+
+    # Several input files are concatenated into --outfile if given, otherwise converted one by one.
+    concatenate = len(infiles) > 1 and outfile is not None
+    if outfile is not None:
+        outfiles = [outfile]
+    else:
+        outfiles = [os.path.splitext(path)[0] + '.' + fmt for path in infiles]
 
     if not overwrite:
-        assert not os.path.exists(outfile), f'Output file {outfile} already exists. Use --overwrite to overwrite the file.'
+        for path in outfiles:
+            assert not os.path.exists(path), f'Output file {path} already exists. Use --overwrite to overwrite the file.'
+
+    headers = [csio.read_header(path) for path in infiles]
+    for path, header in zip(infiles, headers):
+        if columns is not None:
+            csio.check_fields(header.names, columns, path)
+        elif concatenate and header.names != headers[0].names:
+            sys.exit(f'{path} has different fields from {infiles[0]}. Select common fields with --columns to concatenate them.')
+    num_rows = sum(header.num_items for header in headers)
 
-    indata = dataset.Dataset().load(infile)
-    df = dataset.to_dataframe(indata)
-    df.to_csv(outfile, index=False)
+    run_metrics = metrics.Metrics('csutil_cs_to_csv.py', metrics_json)
+    with run_metrics.phase('export', rows=num_rows):
+        if len(outfiles) == 1:
+            num_chunks = sum(max(1, -(-header.num_items // chunk_size)) for header in headers)
+            chunks = itertools.chain.from_iterable(csio.iter_chunks(path, chunk_size, columns) for path in infiles)
+            write_chunks(run_metrics.progress(chunks, num_chunks, 'Chunks'), outfiles[0], fmt, compression)
+        else:
+            jobs = [(path, out, fmt, columns, chunk_size, compression) for path, out in zip(infiles, outfiles)]
+            for _ in run_metrics.progress(fanin.imap(export_file, jobs, num_workers), len(jobs), 'Files'):
+                pass
+    for path in outfiles:
+        print(f'Output file saved as {path}')
+    run_metrics.finish()
 
 
 if __name__ == '__main__':
@@ -43,5 +125,11 @@ if __name__ == '__main__':
     main(
         args.infile,
         args.outfile,
-        args.overwrite
+        args.overwrite,
+        args.format,
+        args.columns,
+        args.chunk_size,
+        args.compression,
+        args.metrics_json,
+        args.num_workers
     )
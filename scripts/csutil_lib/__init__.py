@@ -0,0 +1,5 @@
+"""Shared helpers for the csutil_*.py scripts.
+
+Python puts the directory of the executed script on sys.path, so this package is importable
+from ``python <path to cryosparc_utils>/scripts/csutil_xxx.py`` without installation.
+"""
@@ -0,0 +1,34 @@
+"""Conversion of particle record arrays to Apache Arrow tables (requires pyarrow)."""
+
+import numpy as np
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError as err:
+        raise ImportError('pyarrow is required for Parquet/Feather output. Install it with "pip install pyarrow".') from err
+    return pyarrow
+
+
+def to_arrow_table(arr: np.ndarray):
+    """Arrow table of a structured array.
+
+    Fixed-width byte strings become UTF-8 strings, and sub-array fields such as
+    alignments3D/pose become fixed-size list columns.
+    """
+    pa = import_pyarrow()
+    columns = []
+    for name in arr.dtype.names:
+        col = arr[name]
+        if col.dtype.kind == 'S':
+            columns.append(pa.array(np.char.decode(col), type=pa.string()))
+        elif col.dtype.kind in ('U', 'O'):
+            columns.append(pa.array(col.astype(str), type=pa.string()))
+        elif col.ndim > 1:
+            width = int(np.prod(col.shape[1:]))
+            flat = pa.array(np.ascontiguousarray(col).reshape(-1))
+            columns.append(pa.FixedSizeListArray.from_arrays(flat, width))
+        else:
+            columns.append(pa.array(np.ascontiguousarray(col)))
+    return pa.Table.from_arrays(columns, names=list(arr.dtype.names))
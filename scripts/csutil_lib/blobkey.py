@@ -0,0 +1,235 @@
+"""Matching of particles between datasets by (blob path basename, blob/idx).
+
+Particles exported from cryoSPARC to RELION and imported back keep the basename of
+their particle stack (after stripping the preceding UUID strings) and their index in
+the stack. This pair is used as a composite key to match particles of two datasets.
+
+The key index of a .cs file can be cached in an .npz sidecar file, keyed by the path,
+mtime and size of the .cs file, so that repeated matches against the same dataset only
+need to prepare the other side.
+"""
+
+import os
+import hashlib
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+import numpy as np
+from csutil_lib import csio, records
+
+INDEX_VERSION = 1
+
+
+def get_blobpath_basename(arr, num_remove_uuid):
+    """Blob path basenames without extension and without the first ``num_remove_uuid`` '_'-separated tokens.
+
+    Equivalent to '_'.join(splitext(basename(s))[0].split('_')[num_remove_uuid:]) for every path,
+    computed with numpy string operations on the unique paths only.
+    """
+    assert num_remove_uuid >= 0, 'num_remove_uuid must not be negative.'
+    arr = records.as_str_array(np.asarray(arr))
+    if len(arr) == 0:
+        return arr
+    uniq, inverse = np.unique(arr, return_inverse=True)
+    # Filename
+    s = np.char.rpartition(uniq, '/')[:, 2]
+    # Remove file extension (leading dots do not start an extension, as in os.path.splitext)
+    parts = np.char.rpartition(s, '.')
+    has_ext = (parts[:, 1] == '.') & (np.char.strip(parts[:, 0], '.') != '')
+    s = np.where(has_ext, parts[:, 0], s)
+    for _ in range(num_remove_uuid):
+        parts = np.char.partition(s, '_')
+        s = np.where(parts[:, 1] == '_', parts[:, 2], '')
+    return s[inverse.ravel()]
+
+
+def find_duplicates(sorted_keys: np.ndarray) -> np.ndarray:
+    """Unique values which appear more than once in the sorted key array."""
+    dup = sorted_keys[1:] == sorted_keys[:-1]
+    return np.unique(sorted_keys[1:][dup])
+
+
+class KeyIndex:
+    """Sorted (basename, blob/idx) keys of one dataset.
+
+    ``basenames`` are the sorted unique normalized basenames and ``codes`` the per-row position
+    in it. The integer key ``code * stride + blob/idx`` sorts in (basename, blob/idx) order.
+    """
+
+    def __init__(self, basenames: np.ndarray, codes: np.ndarray, blobidxs: np.ndarray):
+        self.basenames = basenames
+        self.codes = codes.astype(np.int64)
+        self.blobidxs = blobidxs.astype(np.int64)
+        assert len(self.blobidxs) == 0 or int(self.blobidxs.min()) >= 0, 'Negative blob/idx found.'
+        self.stride = int(self.blobidxs.max()) + 1 if len(self.blobidxs) > 0 else 1
+        assert len(self.basenames) <= np.iinfo(np.int64).max // self.stride, 'Too many blobs to encode keys.'
+        self.keys = self.codes * self.stride + self.blobidxs
+        self.order = np.argsort(self.keys, kind='stable')
+        self.sorted_keys = self.keys[self.order]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @classmethod
+    def from_basenames(cls, basenames: np.ndarray, blobidxs: np.ndarray) -> 'KeyIndex':
+        uniq, codes = np.unique(basenames, return_inverse=True)
+        return cls(uniq, codes.ravel(), np.asarray(blobidxs))
+
+    @classmethod
+    def from_blobpaths(cls, blobpaths: np.ndarray, blobidxs: np.ndarray, num_remove_uuid: int) -> 'KeyIndex':
+        return cls.from_basenames(get_blobpath_basename(blobpaths, num_remove_uuid), blobidxs)
+
+    def lookup(self, basenames: np.ndarray, blobidxs: np.ndarray) -> np.ndarray:
+        """Keys of other particles in this index's encoding. -1 where the basename or blob/idx is unknown."""
+        blobidxs = np.asarray(blobidxs).astype(np.int64)
+        keys = np.full(len(basenames), -1, dtype=np.int64)
+        if len(self.basenames) == 0:
+            return keys
+        pos = np.minimum(np.searchsorted(self.basenames, basenames), len(self.basenames) - 1)
+        known = (self.basenames[pos] == basenames) & (blobidxs >= 0) & (blobidxs < self.stride)
+        keys[known] = pos[known] * self.stride + blobidxs[known]
+        return keys
+
+    def describe(self, keys: np.ndarray) -> List[Tuple[str, int]]:
+        return [(str(self.basenames[key // self.stride]), int(key % self.stride)) for key in keys]
+
+    def save(self, path: str, source: Optional[dict] = None) -> None:
+        source = source or {}
+        with open(path, 'wb') as f:
+            np.savez(
+                f, version=INDEX_VERSION, basenames=self.basenames, codes=self.codes, blobidxs=self.blobidxs,
+                **{f'source_{k}': v for k, v in source.items()}
+            )
+
+    @classmethod
+    def load(cls, path: str, source: Optional[dict] = None) -> Optional['KeyIndex']:
+        """Load a cached index. None if it does not exist or does not match ``source``."""
+        try:
+            with np.load(path, allow_pickle=False) as npz:
+                if int(npz['version']) != INDEX_VERSION:
+                    return None
+                for k, v in (source or {}).items():
+                    if f'source_{k}' not in npz or npz[f'source_{k}'].item() != v:
+                        return None
+                return cls(npz['basenames'], npz['codes'], npz['blobidxs'])
+        except (OSError, KeyError, ValueError):
+            return None
+
+
+def index_source(cs_path: str, num_remove_uuid: int) -> dict:
+    st = os.stat(cs_path)
+    return {'path': os.path.abspath(cs_path), 'mtime_ns': st.st_mtime_ns, 'size': st.st_size, 'num_remove_uuid': num_remove_uuid}
+
+
+def index_cache_path(cs_path: str, num_remove_uuid: int, cache_dir: Optional[str] = None) -> str:
+    """Sidecar file of a .cs file, next to it or in ``cache_dir``."""
+    if cache_dir is None:
+        return f'{cs_path}.blobkey{num_remove_uuid}.npz'
+    digest = hashlib.sha1(os.path.abspath(cs_path).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f'{os.path.basename(cs_path)}.{digest}.blobkey{num_remove_uuid}.npz')
+
+
+def load_key_index(cs_path: str, num_remove_uuid: int, cache_dir: Optional[str] = None, use_cache: bool = True) -> Tuple[KeyIndex, bool]:
+    """Key index of a .cs file, from the sidecar cache if it is up to date.
+
+    Returns the index and whether it was loaded from the cache. A rebuilt index is written to the
+    cache if possible.
+    """
+    source = index_source(cs_path, num_remove_uuid)
+    cache_path = index_cache_path(cs_path, num_remove_uuid, cache_dir)
+    if use_cache:
+        index = KeyIndex.load(cache_path, source)
+        if index is not None:
+            return index, True
+    arr = csio.load_fields(cs_path, ['blob/path', 'blob/idx'])
+    index = KeyIndex.from_blobpaths(arr['blob/path'], arr['blob/idx'], num_remove_uuid)
+    if use_cache:
+        try:
+            if cache_dir is not None:
+                os.makedirs(cache_dir, exist_ok=True)
+            index.save(cache_path, source)
+        except OSError as err:
+            print(f'Could not write the blob key index cache {cache_path}: {err}')
+    return index, False
+
+
+def shared_keys(indexes: List[KeyIndex]) -> List[np.ndarray]:
+    """Per-row keys of several datasets in one shared encoding, so that keys can be compared across datasets.
+
+    Only the (small) unique basename tables are merged; the per-row codes are remapped with one take.
+    """
+    basenames = np.unique(np.concatenate([index.basenames for index in indexes])) if len(indexes) > 0 else np.zeros(0, dtype=str)
+    stride = max((index.stride for index in indexes), default=1)
+    assert len(basenames) <= np.iinfo(np.int64).max // stride, 'Too many blobs to encode keys.'
+    keys = []
+    for index in indexes:
+        remap = np.searchsorted(basenames, index.basenames).astype(np.int64)
+        keys.append(remap[index.codes] * stride + index.blobidxs)
+    return keys
+
+
+@dataclass
+class MatchResult:
+    """Row correspondence between a reference dataset and a query dataset.
+
+    ``ref_idx[i]`` and ``query_idx[i]`` are the rows of the i-th matched particle.
+    Matched rows are ordered by the (basename, blob/idx) key.
+    """
+    ref_idx: np.ndarray
+    query_idx: np.ndarray
+    num_ref: int
+    num_query: int
+    unmatched_query_idx: np.ndarray
+    duplicate_ref_keys: List[Tuple[str, int]] = field(default_factory=list)
+    duplicate_query_keys: List[Tuple[str, int]] = field(default_factory=list)
+
+    @property
+    def num_matched(self) -> int:
+        return len(self.query_idx)
+
+    @property
+    def ok(self) -> bool:
+        return len(self.unmatched_query_idx) == 0 and len(self.duplicate_ref_keys) == 0 and len(self.duplicate_query_keys) == 0
+
+    def summary(self, max_examples: int = 5) -> str:
+        lines = [
+            f'Reference particles : {self.num_ref}',
+            f'Query particles     : {self.num_query}',
+            f'Matched particles   : {self.num_matched}',
+            f'Unmatched query     : {len(self.unmatched_query_idx)}',
+            f'Duplicate ref keys  : {len(self.duplicate_ref_keys)}',
+            f'Duplicate query keys: {len(self.duplicate_query_keys)}',
+        ]
+        for name, keys in (('ref', self.duplicate_ref_keys), ('query', self.duplicate_query_keys)):
+            for basename, idx in keys[:max_examples]:
+                lines.append(f'\tduplicate {name} key: ({basename}, {idx})')
+        return '\n'.join(lines)
+
+
+def match_blob_keys(ref: KeyIndex, query_basenames: np.ndarray, query_blobidxs: np.ndarray) -> MatchResult:
+    """Match all query particles against the reference index at once by sort/searchsorted.
+
+    Unmatched and duplicate keys are reported in the returned MatchResult. Duplicate reference keys
+    are only reported if a query particle refers to them, since the others do not make any match ambiguous.
+    """
+    query_keys = ref.lookup(query_basenames, query_blobidxs)
+    query_order = np.argsort(query_keys, kind='stable')
+    query_keys_sorted = query_keys[query_order]
+    # Unknown keys (-1) come first
+    num_unknown = int(np.searchsorted(query_keys_sorted, 0))
+
+    found = np.zeros(len(query_keys_sorted), dtype=bool)
+    pos = np.zeros(len(query_keys_sorted), dtype=np.int64)
+    if len(ref) > 0:
+        pos = np.minimum(np.searchsorted(ref.sorted_keys, query_keys_sorted), len(ref) - 1)
+        found = ref.sorted_keys[pos] == query_keys_sorted
+        found[:num_unknown] = False
+
+    return MatchResult(
+        ref_idx=ref.order[pos[found]],
+        query_idx=query_order[found],
+        num_ref=len(ref),
+        num_query=len(query_keys),
+        unmatched_query_idx=np.sort(query_order[~found]),
+        duplicate_ref_keys=ref.describe(np.intersect1d(find_duplicates(ref.sorted_keys), query_keys_sorted[found])),
+        duplicate_query_keys=ref.describe(find_duplicates(query_keys_sorted[found])),
+    )
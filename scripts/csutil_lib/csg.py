@@ -0,0 +1,277 @@
+"""Reading and editing cryoSPARC .csg (result group) files.
+
+A .csg file is a small YAML document::
+
+    created: 2024-01-01 00:00:00
+    group:
+      description: ...
+      name: particles
+      title: Particles
+      type: particle
+    results:
+      blob:
+        metafile: '>J10_particles.cs'
+        num_items: 1000
+        type: particle.blob
+      ...
+    version: v4.0.0
+
+It is parsed with the libyaml C loader when PyYAML was built with it. Edits (typically results.*.metafile
+and results.*.num_items) are written back into the original text line by line, so everything else in the
+document is kept as it is. The edited text is parsed again and compared with the intended content; if the
+document has a layout the line editor does not handle (flow style, anchors, ...), the whole document is
+dumped instead, which Import Result Group accepts as well.
+"""
+
+import os
+import re
+import sys
+import functools
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# "<indent><key>:" or "<indent><key>: <value>" of a block mapping
+_KEY_RE = re.compile(r'^( *)([^\s#\'"\-?:][^#]*?|\'[^\']*\'|"[^"]*"):(?: +(.*))?$')
+
+
+@functools.lru_cache(maxsize=None)
+def _yaml() -> Tuple[Any, Any, Any]:
+    """(yaml module, loader, dumper), with the libyaml C implementations if available. yaml is imported on first use."""
+    import yaml
+    loader = getattr(yaml, 'CFullLoader', yaml.FullLoader) if yaml.__with_libyaml__ else yaml.FullLoader
+    dumper = yaml.CDumper if yaml.__with_libyaml__ else yaml.Dumper
+    return yaml, loader, dumper
+
+
+def loads(text: str) -> dict:
+    yaml, loader, _ = _yaml()
+    return yaml.load(text, Loader=loader)
+
+
+def dumps(data: Any) -> str:
+    yaml, _, dumper = _yaml()
+    return yaml.dump(data, Dumper=dumper, default_flow_style=False, sort_keys=False)
+
+
+def _scalar(value: Any) -> str:
+    """``value`` as a one-line YAML scalar, e.g. '>J10_particles.cs' quoted because of the leading '>'."""
+    yaml, _, dumper = _yaml()
+    text = yaml.dump({'k': value}, Dumper=dumper, default_flow_style=False, width=2 ** 30)
+    return text[len('k: '):].rstrip('\n')
+
+
+class CsgDocument:
+    """A .csg document whose edits are applied to the original text."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.data = loads(text)
+        self._edits: Dict[Tuple[str, ...], Any] = {}
+        self._removed: List[Tuple[str, ...]] = []
+
+    @classmethod
+    def read(cls, path: str) -> 'CsgDocument':
+        with open(path, 'r') as f:
+            return cls(f.read())
+
+    @property
+    def results(self) -> Dict[str, dict]:
+        return self.data.setdefault('results', {})
+
+    def set(self, path: Tuple[str, ...], value: Any) -> None:
+        """Set the value at a key path such as ('results', 'blob', 'metafile'), creating missing mappings."""
+        node = self.data
+        for key in path[:-1]:
+            node = node.setdefault(key, {})
+        node[path[-1]] = value
+        self._edits[tuple(path)] = value
+
+    def remove(self, path: Tuple[str, ...]) -> None:
+        """Remove the key at a key path such as ('results', 'alignments2D') with its value."""
+        node = self.data
+        for key in path[:-1]:
+            node = node[key]
+        del node[path[-1]]
+        self._edits = {p: v for p, v in self._edits.items() if p[:len(path)] != tuple(path)}
+        self._removed.append(tuple(path))
+
+    def set_result(self, name: str, metafile: Optional[str] = None, num_items: Optional[int] = None, result_type: Optional[str] = None) -> None:
+        """Edit (or add) results.<name>. ``metafile`` is written as '>metafile', i.e. relative to the .csg file."""
+        if metafile is not None:
+            self.set(('results', name, 'metafile'), f'>{metafile}')
+        if num_items is not None:
+            self.set(('results', name, 'num_items'), int(num_items))
+        if result_type is not None:
+            self.set(('results', name, 'type'), result_type)
+
+    def dumps(self) -> str:
+        if len(self._edits) == 0 and len(self._removed) == 0:
+            return self.text
+        yaml, _, _ = _yaml()
+        try:
+            text = self._apply_edits()
+            if loads(text) == self.data:
+                return text
+            reason = 'the edited text does not parse to the edited document'
+        except (ValueError, yaml.YAMLError) as err:
+            reason = str(err)
+        print(f'Warning: cannot edit the .csg document line by line ({reason}). The whole document is written instead.', file=sys.stderr)
+        return dumps(self.data)
+
+    def write(self, path: str) -> None:
+        text = self.dumps()
+        with open(path, 'w') as f:
+            f.write(text)
+
+    def _apply_edits(self) -> str:
+        lines = self.text.splitlines()
+        blocks = _block_map(lines)
+        replace: Dict[int, Tuple[int, Optional[str]]] = {}
+        insert: Dict[int, List[str]] = {}
+        inserted = set()
+        for path in self._removed:
+            if path in blocks:
+                start, end, _, _ = blocks[path]
+                replace[start] = (end, None)
+        for path, value in self._edits.items():
+            if path in blocks:
+                start, end, indent, _ = blocks[path]
+                if isinstance(value, dict):
+                    raise ValueError('Only scalar values are replaced in place.')
+                replace[start] = (end, ' ' * indent + f'{_yaml_key(path[-1])}: {_scalar(value)}')
+                continue
+            # Insert the topmost missing key with its whole (current) subtree at the end of its parent mapping.
+            depth = max(d for d in range(len(path)) if path[:d] in blocks or d == 0)
+            new_path = path[:depth + 1]
+            if new_path in inserted:
+                continue
+            inserted.add(new_path)
+            parent = blocks.get(path[:depth], (None, len(lines) - 1, -2, None))
+            _, parent_end, parent_indent, child_indent = parent
+            if child_indent is None:
+                child_indent = parent_indent + 2
+            value = self.data
+            for key in new_path:
+                value = value[key]
+            new_lines = dumps({new_path[-1]: value}).splitlines()
+            insert.setdefault(parent_end, []).extend(' ' * child_indent + line for line in new_lines)
+        out = []
+        skip_until = -1
+        for i, line in enumerate(lines):
+            if i <= skip_until:
+                pass
+            elif i in replace:
+                skip_until, new_line = replace[i]
+                if new_line is not None:
+                    out.append(new_line)
+            else:
+                out.append(line)
+            out.extend(insert.get(i, []))
+        if len(lines) == 0:
+            out.extend(insert.get(-1, []))
+        return '\n'.join(out) + '\n'
+
+
+def _yaml_key(key: str) -> str:
+    return _scalar(key)
+
+
+def _block_map(lines: List[str]) -> Dict[Tuple[str, ...], Tuple[int, int, int, Optional[int]]]:
+    """Key path -> (first line, last line, indent, indent of its child keys or None) of every block mapping key.
+
+    The root mapping is the empty path.
+    """
+    blocks = {}
+    inline = set()
+    stack: List[Tuple[int, Tuple[str, ...]]] = []
+    last = -1
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        if stripped == '' or stripped.startswith('#') or stripped in ('---', '...'):
+            continue
+        indent = len(line) - len(line.lstrip(' '))
+        m = _KEY_RE.match(line)
+        if stack and ((indent > stack[-1][0] and (stack[-1][1] in inline or m is None))
+                      or (indent == stack[-1][0] and stripped.startswith('-'))):
+            # Continuation of a multi-line value or a block sequence of the current key
+            last = i
+            continue
+        if m is None:
+            raise ValueError(f'Unsupported .csg line: {line}')
+        while stack and stack[-1][0] >= indent:
+            _, path = stack.pop()
+            blocks[path] = blocks[path][:1] + (last,) + blocks[path][2:]
+        parent = stack[-1][1] if stack else ()
+        if stack and blocks[parent][3] is None:
+            blocks[parent] = blocks[parent][:3] + (indent,)
+        key = loads(m.group(2)) if m.group(2)[0] in '\'"' else m.group(2)
+        path = parent + (str(key),)
+        blocks[path] = (i, i, indent, None)
+        if m.group(3):
+            inline.add(path)
+        stack.append((indent, path))
+        last = i
+    while stack:
+        _, path = stack.pop()
+        blocks[path] = blocks[path][:1] + (last,) + blocks[path][2:]
+    blocks[()] = (-1, len(lines) - 1, -2, 0)
+    return blocks
+
+
+def load_csg(path: str) -> dict:
+    return CsgDocument.read(path).data
+
+
+def save_csg(path: str, csg: dict) -> None:
+    with open(path, 'w') as f:
+        f.write(dumps(csg))
+
+
+def result_names(field_names: Sequence[str]) -> List[str]:
+    """Result names (field prefixes such as 'blob', 'ctf', 'alignments3D') of the fields of a particle dataset."""
+    return list(dict.fromkeys(name.split('/')[0] for name in field_names if '/' in name))
+
+
+def new_csg(metafile: str, num_items: int, results: Sequence[str], description: str = '', title: str = 'Particles') -> dict:
+    """Minimal particle result group with every result in ``metafile`` (relative to the .csg file).
+
+    Result types are 'particle.<result name>'. Use an existing .csg file as a template where the
+    cryoSPARC job output has other types.
+    """
+    import datetime
+    return {
+        'created': datetime.datetime.now(),
+        'group': {'description': description, 'name': 'particles', 'title': title, 'type': 'particle'},
+        'results': {name: {'metafile': f'>{metafile}', 'num_items': int(num_items), 'type': f'particle.{name}'} for name in results},
+        'version': 'v4.0.0',
+    }
+
+
+def metafile_path(value: str) -> str:
+    """Path of a results.*.metafile value. The leading '>' means relative to the .csg file."""
+    return value[1:] if value.startswith('>') else value
+
+
+def repoint_results(doc: CsgDocument, new_metafile: Callable[[str], str], num_items: Callable[[str], int]) -> int:
+    """Replace results.*.metafile by ``new_metafile(old path)`` and results.*.num_items by ``num_items(new path)``.
+
+    Returns the number of edited results entries.
+    """
+    num_edited = 0
+    for name, result in list(doc.results.items()):
+        if 'metafile' not in result:
+            continue
+        path = new_metafile(metafile_path(result['metafile']))
+        doc.set_result(name, metafile=path, num_items=num_items(path) if 'num_items' in result else None)
+        num_edited += 1
+    return num_edited
+
+
+def resolve_metafile(csg_path: str, path: str) -> str:
+    """Filesystem path of a metafile path written in a .csg file.
+
+    The path is used as is if it exists (absolute or relative to the current directory),
+    otherwise it is taken as relative to the directory of the .csg file.
+    """
+    if os.path.isabs(path) or os.path.exists(path):
+        return path
+    return os.path.join(os.path.dirname(os.path.abspath(csg_path)), path)
@@ -0,0 +1,155 @@
+"""Memory-mapped, column-projected reading of cryoSPARC .cs files.
+
+A .cs file is a numpy structured array saved in the .npy format. The array is opened with
+np.memmap, and only the requested fields are copied into RAM when they are accessed.
+"""
+
+import os
+import glob
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+
+# Rows per chunk where files are read in chunks without an explicit chunk size.
+DEFAULT_CHUNK_SIZE = 1000000
+
+
+@dataclass
+class CsHeader:
+    shape: Tuple[int, ...]
+    dtype: np.dtype
+    fortran_order: bool
+    offset: int
+
+    @property
+    def num_items(self) -> int:
+        return int(self.shape[0]) if len(self.shape) > 0 else 0
+
+    @property
+    def names(self) -> Tuple[str, ...]:
+        return self.dtype.names
+
+    @property
+    def nbytes(self) -> int:
+        return self.num_items * self.dtype.itemsize
+
+
+def read_header(path: str) -> CsHeader:
+    """Read only the .npy header of a .cs file."""
+    with open(path, 'rb') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    return CsHeader(shape=shape, dtype=dtype, fortran_order=fortran_order, offset=offset)
+
+
+def open_cs(path: str, mode: str = 'r') -> np.ndarray:
+    """Memory map of the whole structured array of a .cs file, read-only by default ('r+' to modify it in place)."""
+    header = read_header(path)
+    if header.num_items == 0:
+        return np.zeros(0, dtype=header.dtype)
+    return np.memmap(path, dtype=header.dtype, mode=mode, offset=header.offset, shape=header.shape)
+
+
+def check_fields(names: Iterable[str], fields: Iterable[str], path: str = '') -> None:
+    missing = [field for field in fields if field not in names]
+    if len(missing) > 0:
+        raise KeyError(f'No such fields {missing} in {path}. Available fields are: {tuple(names)}')
+
+
+def load_fields(path: str, fields: Optional[List[str]] = None) -> np.ndarray:
+    """Structured array holding only ``fields`` of a .cs file (all fields if None)."""
+    mm = open_cs(path)
+    if fields is None:
+        fields = list(mm.dtype.names)
+    check_fields(mm.dtype.names, fields, path)
+    return project(mm, fields)
+
+
+def project(arr: np.ndarray, fields: List[str]) -> np.ndarray:
+    """Packed copy of ``fields`` of a structured array."""
+    out = np.empty(len(arr), dtype=[(field, arr.dtype.fields[field][0]) for field in fields])
+    for field in fields:
+        out[field] = arr[field]
+    return out
+
+
+def iter_chunks(path: str, chunk_size: int, fields: Optional[List[str]] = None) -> Iterator[np.ndarray]:
+    """Yield consecutive row chunks of a .cs file, holding only ``fields`` (all fields if None).
+
+    At least one (possibly empty) chunk is yielded, so that writers can emit a header.
+    """
+    assert chunk_size > 0, 'chunk_size must be positive.'
+    mm = open_cs(path)
+    if fields is None:
+        fields = list(mm.dtype.names)
+    check_fields(mm.dtype.names, fields, path)
+    for start in range(0, max(len(mm), 1), chunk_size):
+        yield project(mm[start:start + chunk_size], fields)
+
+
+class CsReader:
+    """Lazy, column-wise reader of a .cs file.
+
+    Columns are copied out of the memory map on first access and cached.
+    """
+
+    def __init__(self, path: str):
+        assert os.path.exists(path), f'Input file {path} does not exist.'
+        self.path = path
+        self.header = read_header(path)
+        self._mm = None
+        self._columns: Dict[str, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return self.header.num_items
+
+    def __contains__(self, field: str) -> bool:
+        return field in self.header.names
+
+    @property
+    def names(self) -> Tuple[str, ...]:
+        return self.header.names
+
+    @property
+    def memmap(self) -> np.ndarray:
+        if self._mm is None:
+            self._mm = open_cs(self.path)
+        return self._mm
+
+    def __getitem__(self, field: str) -> np.ndarray:
+        if field not in self._columns:
+            check_fields(self.names, [field], self.path)
+            self._columns[field] = np.array(self.memmap[field])
+        return self._columns[field]
+
+    def load(self, fields: Optional[List[str]] = None) -> np.ndarray:
+        return load_fields(self.path, fields)
+
+
+def save_cs(path: str, arr: np.ndarray) -> None:
+    """Save a structured array as a .cs file (np.save without appending .npy)."""
+    with open(path, 'wb') as f:
+        np.save(f, arr)
+
+
+def save_dataset(path: str, arr: np.ndarray) -> None:
+    """Save a structured array through cryosparc_compute, which is imported only here because it is slow to import."""
+    from cryosparc_compute import dataset
+    dataset.Dataset(arr).save(path)
+
+
+def expand_paths(patterns: List[str], suffix: str = '.cs') -> List[str]:
+    """Input files from paths, glob patterns and directories (all ``*<suffix>`` files in them), without duplicates."""
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths.extend(sorted(glob.glob(os.path.join(pattern, f'*{suffix}'))))
+        elif glob.has_magic(pattern):
+            paths.extend(sorted(glob.glob(pattern)))
+        else:
+            paths.append(pattern)
+    return list(dict.fromkeys(paths))
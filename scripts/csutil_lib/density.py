@@ -0,0 +1,168 @@
+"""Pre-binned 2D densities of particle columns, and viewing directions of 3D alignments.
+
+A density is specified as "<x field>:<y field>" (sub-array elements as e.g. alignments3D/pose/0), or
+as VIEWING for the azimuth/elevation of the viewing directions of alignments3D/pose. Counts are
+accumulated chunk by chunk with np.histogram2d on fixed ranges, so the densities of several chunks or
+files are merged by adding counts, and only the counts are sent to the plotting processes.
+"""
+
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from csutil_lib import csio
+
+VIEWING = 'viewing_direction'
+POSE_FIELD = 'alignments3D/pose'
+VIEWING_RANGE = ((-180.0, 180.0), (-90.0, 90.0))
+
+
+def viewing_directions(pose: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Azimuth and elevation (degrees) of the viewing direction of every particle.
+
+    ``pose`` is the rotation vector (axis * angle) of cryoSPARC. The particle is a projection of the map
+    rotated by R along z, so the viewing direction in the map frame is R^T z, i.e. the third row of R,
+    which Rodrigues' formula gives without building the matrices.
+    """
+    pose = np.asarray(pose, dtype=np.float64).reshape(-1, 3)
+    theta = np.linalg.norm(pose, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        k = np.where(theta[:, None] > 0, pose / theta[:, None], 0.0)
+    cos, sin = np.cos(theta), np.sin(theta)
+    kx, ky, kz = k[:, 0], k[:, 1], k[:, 2]
+    dx = -sin * ky + (1.0 - cos) * kz * kx
+    dy = sin * kx + (1.0 - cos) * kz * ky
+    dz = cos + (1.0 - cos) * kz * kz
+    azimuth = np.degrees(np.arctan2(dy, dx))
+    elevation = np.degrees(np.arcsin(np.clip(dz, -1.0, 1.0)))
+    return azimuth, elevation
+
+
+def parse_spec(spec: str) -> Tuple[str, str]:
+    """(x name, y name) of a density specification."""
+    if spec == VIEWING:
+        return 'azimuth', 'elevation'
+    x, sep, y = spec.partition(':')
+    if sep != ':' or x == '' or y == '':
+        raise ValueError(f'Invalid density specification: {spec}. Give "<x field>:<y field>" or "{VIEWING}".')
+    return x, y
+
+
+def base_field(name: str, names: Tuple[str, ...]) -> str:
+    """Field holding a column name, e.g. alignments3D/pose for alignments3D/pose/0."""
+    if name in names:
+        return name
+    parent, _, index = name.rpartition('/')
+    if parent in names and index.isdigit():
+        return parent
+    raise KeyError(f'No such field: {name}')
+
+
+def spec_fields(spec: str, names: Tuple[str, ...]) -> List[str]:
+    if spec == VIEWING:
+        if POSE_FIELD not in names:
+            raise KeyError(f'No such field: {POSE_FIELD}')
+        return [POSE_FIELD]
+    return list(dict.fromkeys(base_field(name, names) for name in parse_spec(spec)))
+
+
+def column(arr: np.ndarray, name: str) -> np.ndarray:
+    if name in arr.dtype.names:
+        return arr[name]
+    parent, _, index = name.rpartition('/')
+    col = arr[parent]
+    return col.reshape(len(col), -1)[:, int(index)]
+
+
+def spec_values(arr: np.ndarray, spec: str) -> Tuple[np.ndarray, np.ndarray]:
+    if spec == VIEWING:
+        return viewing_directions(arr[POSE_FIELD])
+    x, y = parse_spec(spec)
+    return column(arr, x), column(arr, y)
+
+
+class Histogram2D:
+    def __init__(self, xrange: Tuple[float, float], yrange: Tuple[float, float], bins: int):
+        self.xedges = np.linspace(xrange[0], xrange[1], bins + 1)
+        self.yedges = np.linspace(yrange[0], yrange[1], bins + 1)
+        self.counts = np.zeros((bins, bins), dtype=np.int64)
+
+    def update(self, x: np.ndarray, y: np.ndarray) -> None:
+        counts, _, _ = np.histogram2d(x, y, bins=(self.xedges, self.yedges))
+        self.counts += counts.astype(np.int64)
+
+    def merge(self, other: 'Histogram2D') -> None:
+        self.counts += other.counts
+
+
+def _finite_range(lo: float, hi: float) -> Tuple[float, float]:
+    if not (np.isfinite(lo) and np.isfinite(hi)):
+        return 0.0, 1.0
+    if hi <= lo:
+        return lo - 0.5, lo + 0.5
+    return lo, hi
+
+
+def file_ranges(path: str, specs: List[str], chunk_size: int) -> Dict[str, Tuple[float, float, float, float]]:
+    """(x min, x max, y min, y max) of every density of one .cs file."""
+    names = csio.read_header(path).names
+    fields = list(dict.fromkeys(f for spec in specs for f in spec_fields(spec, names)))
+    ranges = {spec: (np.inf, -np.inf, np.inf, -np.inf) for spec in specs}
+    for chunk in csio.iter_chunks(path, chunk_size, fields):
+        if len(chunk) == 0:
+            continue
+        for spec in specs:
+            if spec == VIEWING:
+                continue
+            x, y = spec_values(chunk, spec)
+            r = ranges[spec]
+            ranges[spec] = (min(r[0], float(np.nanmin(x))), max(r[1], float(np.nanmax(x))),
+                            min(r[2], float(np.nanmin(y))), max(r[3], float(np.nanmax(y))))
+    return ranges
+
+
+def merge_ranges(partials: List[Dict[str, Tuple[float, float, float, float]]]) -> Dict[str, Tuple[Tuple[float, float], Tuple[float, float]]]:
+    """Ranges of the densities over several files. The viewing direction density always covers the whole sphere."""
+    out = {}
+    for spec in partials[0]:
+        if spec == VIEWING:
+            out[spec] = VIEWING_RANGE
+            continue
+        r = [p[spec] for p in partials]
+        out[spec] = (_finite_range(min(x[0] for x in r), max(x[1] for x in r)), _finite_range(min(x[2] for x in r), max(x[3] for x in r)))
+    return out
+
+
+def file_densities(
+    path: str, specs: List[str], ranges: Dict[str, Tuple[Tuple[float, float], Tuple[float, float]]], bins: int, chunk_size: int
+) -> Dict[str, Histogram2D]:
+    """2D counts of every density of one .cs file on the given ranges."""
+    names = csio.read_header(path).names
+    fields = list(dict.fromkeys(f for spec in specs for f in spec_fields(spec, names)))
+    hists = {spec: Histogram2D(ranges[spec][0], ranges[spec][1], bins) for spec in specs}
+    for chunk in csio.iter_chunks(path, chunk_size, fields):
+        for spec in specs:
+            hists[spec].update(*spec_values(chunk, spec))
+    return hists
+
+
+def merge_densities(partials: List[Dict[str, Histogram2D]]) -> Dict[str, Histogram2D]:
+    merged = partials[0]
+    for partial in partials[1:]:
+        for spec, hist in partial.items():
+            merged[spec].merge(hist)
+    return merged
+
+
+def output_name(spec: str) -> str:
+    if spec == VIEWING:
+        return VIEWING
+    x, y = parse_spec(spec)
+    return f'{x.replace("/", "_")}_vs_{y.replace("/", "_")}'
+
+
+def check_specs(specs: Optional[List[str]], names: Tuple[str, ...], path: str) -> None:
+    for spec in specs or []:
+        try:
+            parse_spec(spec)
+            spec_fields(spec, names)
+        except (KeyError, ValueError) as err:
+            raise ValueError(f'{path}: {err.args[0]}')
@@ -0,0 +1,46 @@
+"""Fan-in of many .cs files.
+
+Per-file work (partial statistics, masks, conversions) runs in a process pool and only the small,
+mergeable results are combined in the parent process.
+"""
+
+import os
+import collections
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple
+
+
+def imap(func: Callable, jobs: Sequence[Tuple], num_workers: Optional[int] = None) -> Iterator:
+    """Yield ``func(*job)`` for every job in order, computed in a process pool if ``num_workers`` != 1."""
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    num_workers = max(1, min(num_workers, len(jobs)))
+    if num_workers == 1:
+        for job in jobs:
+            yield func(*job)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(func, *job) for job in jobs]
+        for future in futures:
+            yield future.result()
+
+
+def file_labels(paths: Sequence[str]) -> List[str]:
+    """Short unique labels of input files for per-file output names.
+
+    The file name without extension, prefixed with parent directories as far as needed to tell
+    files apart (e.g. J12/particles.cs and J13/particles.cs -> J12_particles, J13_particles).
+    """
+    parts = [os.path.normpath(os.path.splitext(os.path.abspath(path))[0]).split(os.sep) for path in paths]
+    depths = [1] * len(parts)
+    while True:
+        labels = ['_'.join(p[-d:]).lstrip('_') for p, d in zip(parts, depths)]
+        counts = collections.Counter(labels)
+        clashes = [i for i, label in enumerate(labels) if counts[label] > 1 and depths[i] < len(parts[i])]
+        if len(clashes) == 0:
+            break
+        for i in clashes:
+            depths[i] += 1
+    if len(set(labels)) < len(labels):
+        labels = [f'{i}_{label}' for i, label in enumerate(labels)]
+    return labels
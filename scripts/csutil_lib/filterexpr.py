@@ -0,0 +1,143 @@
+"""Compound filter expressions over particle columns.
+
+An expression is a conjunction of clauses joined by ``&``, e.g.::
+
+    alignments3D/error < 1e4 & ctf/cross_corr_ctffind4 > 0.1 & sigma(alignments2D/alpha, 3)
+
+Clauses:
+
+- ``<field> <op> <number>`` or ``<number> <op> <field>`` with op one of <, <=, >, >=, ==, !=
+- ``sigma(<field>, <k>)``: mean - k * stdev <= field <= mean + k * stdev
+- ``range(<field>, <min>, <max>)``: min <= field <= max
+
+Field names contain '/', which is why expressions are parsed here instead of by numexpr.
+Every clause is evaluated as one vectorized comparison on its column, and the clause masks
+are combined into one boolean mask.
+"""
+
+import operator
+import re
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+
+OPERATORS = {
+    '<=': operator.le,
+    '>=': operator.ge,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '>': operator.gt,
+}
+FLIPPED = {'<=': '>=', '>=': '<=', '==': '==', '!=': '!=', '<': '>', '>': '<'}
+
+_FIELD = r'[A-Za-z_][\w/.\-]*'
+_NUMBER = r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?'
+_OP = r'<=|>=|==|!=|<|>'
+_COMPARE_RE = re.compile(rf'^({_FIELD})\s*({_OP})\s*({_NUMBER})$')
+_COMPARE_FLIPPED_RE = re.compile(rf'^({_NUMBER})\s*({_OP})\s*({_FIELD})$')
+_FUNC_RE = re.compile(rf'^(sigma|range)\(\s*({_FIELD})\s*((?:,\s*{_NUMBER}\s*)+)\)$')
+
+
+class FilterSyntaxError(ValueError):
+    pass
+
+
+@dataclass
+class Clause:
+    text: str
+    field: str
+    kind: str
+    op: Optional[str] = None
+    value: Optional[float] = None
+    sigma: Optional[float] = None
+    minval: Optional[float] = None
+    maxval: Optional[float] = None
+
+    def evaluate(self, col: np.ndarray) -> np.ndarray:
+        if self.kind == 'compare':
+            return OPERATORS[self.op](col, self.value)
+        if self.kind == 'sigma':
+            mean = col.mean(dtype=np.float64)
+            stdev = col.std(dtype=np.float64, ddof=1)
+            self.minval = mean - self.sigma * stdev
+            self.maxval = mean + self.sigma * stdev
+        return (self.minval <= col) & (col <= self.maxval)
+
+
+def split_clauses(expr: str) -> List[str]:
+    """Split at top-level '&' (outside parentheses)."""
+    clauses = []
+    depth = 0
+    current = ''
+    for c in expr:
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+            if depth < 0:
+                raise FilterSyntaxError(f'Unbalanced parentheses in filter expression: {expr}')
+        if c == '&' and depth == 0:
+            clauses.append(current.strip())
+            current = ''
+        else:
+            current += c
+    if depth != 0:
+        raise FilterSyntaxError(f'Unbalanced parentheses in filter expression: {expr}')
+    clauses.append(current.strip())
+    if any(len(clause) == 0 for clause in clauses):
+        raise FilterSyntaxError(f'Empty clause in filter expression: {expr}')
+    return clauses
+
+
+def parse_clause(text: str) -> Clause:
+    m = _COMPARE_RE.match(text)
+    if m:
+        return Clause(text, m.group(1), 'compare', op=m.group(2), value=float(m.group(3)))
+    m = _COMPARE_FLIPPED_RE.match(text)
+    if m:
+        return Clause(text, m.group(3), 'compare', op=FLIPPED[m.group(2)], value=float(m.group(1)))
+    m = _FUNC_RE.match(text)
+    if m:
+        args = [float(a) for a in m.group(3).split(',')[1:]]
+        if m.group(1) == 'sigma' and len(args) == 1:
+            return Clause(text, m.group(2), 'sigma', sigma=args[0])
+        if m.group(1) == 'range' and len(args) == 2:
+            return Clause(text, m.group(2), 'range', minval=args[0], maxval=args[1])
+    raise FilterSyntaxError(f'Cannot parse filter clause: {text}')
+
+
+def parse_filter(expr: str) -> List[Clause]:
+    return [parse_clause(text) for text in split_clauses(expr)]
+
+
+def evaluate(clauses: List[Clause], get_column: Callable[[str], np.ndarray], num_items: int) -> Tuple[np.ndarray, Dict[str, int]]:
+    """Combined mask of all clauses and the number of particles rejected by each clause on its own.
+
+    sigma() thresholds are computed over all input particles, independently of other clauses.
+    """
+    mask = np.ones(num_items, dtype=bool)
+    rejected = {}
+    for clause in clauses:
+        col = get_column(clause.field)
+        if col.ndim != 1:
+            raise FilterSyntaxError(f'Field {clause.field} is not a scalar field.')
+        clause_mask = clause.evaluate(col)
+        rejected[clause.text] = int(num_items - np.count_nonzero(clause_mask))
+        mask &= clause_mask
+    return mask, rejected
+
+
+def resolve_sigma(clauses: List[Clause], mean_stdev: Dict[str, Tuple[float, float]]) -> List[Clause]:
+    """Replace sigma() clauses by ranges from externally computed (mean, stdev) of their fields.
+
+    Used when the thresholds must come from statistics over several files instead of one column.
+    """
+    resolved = []
+    for clause in clauses:
+        if clause.kind == 'sigma':
+            mean, stdev = mean_stdev[clause.field]
+            clause = Clause(clause.text, clause.field, 'range', sigma=clause.sigma,
+                            minval=mean - clause.sigma * stdev, maxval=mean + clause.sigma * stdev)
+        resolved.append(clause)
+    return resolved
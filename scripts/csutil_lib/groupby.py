@@ -0,0 +1,128 @@
+"""Per-group statistics of particle columns, e.g. per micrograph or per exposure group.
+
+The rows of a column are sorted by (group, value) once, and every statistic is computed for all
+groups at once with ufunc.reduceat over the group boundaries or by indexing positions inside the
+groups, so there is no Python loop over groups.
+"""
+
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+from csutil_lib import blobkey, records
+
+# Aliases of --group-by
+GROUP_KEYS = {
+    'micrograph': 'location/micrograph_path',
+    'blob': 'blob/path',
+    'exp_group': 'ctf/exp_group_id',
+}
+OUTLIER_STATS = ('count', 'mean', 'stdev', 'median')
+
+
+def group_field(group_by: str) -> str:
+    return GROUP_KEYS.get(group_by, group_by)
+
+
+def group_labels(group_by: str, col: np.ndarray) -> np.ndarray:
+    """Per-row group labels. Blob paths are reduced to their basenames, other string fields are decoded."""
+    if group_field(group_by) == 'blob/path':
+        return blobkey.get_blobpath_basename(col, 0)
+    if col.dtype.kind in 'SO':
+        return records.as_str_array(col)
+    return col
+
+
+class Groups:
+    """Group codes and boundaries (in group-sorted row order) of one label column."""
+
+    def __init__(self, labels: np.ndarray):
+        self.labels, codes = np.unique(labels, return_inverse=True)
+        codes = codes.ravel()
+        self.counts = np.bincount(codes, minlength=len(self.labels))
+        self.starts = np.concatenate([[0], np.cumsum(self.counts)[:-1]]).astype(np.int64)
+        self.codes = codes
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def aggregate(self, values: np.ndarray, quantiles: Sequence[float] = ()) -> Dict[str, np.ndarray]:
+        """count, mean, stdev (ddof=1), min, max, median and quantiles of ``values`` in every group. NaNs are ignored."""
+        values = np.asarray(values, dtype=np.float64)
+        valid = ~np.isnan(values)
+        # Sort by (group, value) so that quantiles are positions inside each group; NaNs go to the end of their group.
+        order = np.lexsort((values, self.codes))
+        v = values[order]
+        ok = valid[order]
+        n = np.add.reduceat(ok.astype(np.int64), self.starts) if len(v) > 0 else np.zeros(0, dtype=np.int64)
+        v0 = np.where(ok, v, 0.0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.add.reduceat(v0, self.starts) / n if len(v) > 0 else np.zeros(0)
+            dev = np.where(ok, v - np.repeat(mean, self.counts), 0.0)
+            var = np.add.reduceat(dev * dev, self.starts) / (n - 1) if len(v) > 0 else np.zeros(0)
+        var[n < 2] = np.nan
+        out = {
+            'count': n,
+            'mean': mean,
+            'stdev': np.sqrt(var),
+            'min': self._at(v, n, 0.0),
+            'max': self._at(v, n, 1.0),
+            'median': self._at(v, n, 0.5),
+        }
+        for q in quantiles:
+            out[f'q{q:g}'] = self._at(v, n, q)
+        return out
+
+    def _at(self, sorted_values: np.ndarray, n: np.ndarray, q: float) -> np.ndarray:
+        """q-quantile of every group with linear interpolation (numpy's default method)."""
+        pos = q * np.maximum(n - 1, 0)
+        lo = np.floor(pos).astype(np.int64)
+        hi = np.minimum(lo + 1, np.maximum(n - 1, 0))
+        frac = pos - lo
+        out = np.full(len(n), np.nan)
+        has = n > 0
+        vlo = sorted_values[self.starts[has] + lo[has]]
+        vhi = sorted_values[self.starts[has] + hi[has]]
+        out[has] = vlo + (vhi - vlo) * frac[has]
+        return out
+
+
+def robust_zscores(x: np.ndarray) -> np.ndarray:
+    """Modified z-scores 0.6745 * (x - median) / MAD (Iglewicz and Hoaglin). NaN where MAD is 0."""
+    x = np.asarray(x, dtype=np.float64)
+    median = np.nanmedian(x) if np.any(~np.isnan(x)) else np.nan
+    mad = np.nanmedian(np.abs(x - median)) if np.any(~np.isnan(x)) else np.nan
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(mad > 0, 0.6745 * (x - median) / mad, np.nan)
+
+
+def flag_outliers(table: Dict[str, np.ndarray], columns: Sequence[str], threshold: float) -> Tuple[np.ndarray, List[str]]:
+    """Groups with |robust z-score| > ``threshold`` in any of ``columns`` of the group table, and the reasons per group."""
+    num_groups = len(next(iter(table.values()))) if len(table) > 0 else 0
+    flagged = np.zeros(num_groups, dtype=bool)
+    reasons = [[] for _ in range(num_groups)]
+    for column in columns:
+        z = robust_zscores(table[column])
+        with np.errstate(invalid='ignore'):
+            hit = np.abs(z) > threshold
+        for i in np.flatnonzero(hit):
+            reasons[i].append(f'{column} (z={z[i]:+.1f})')
+        flagged |= hit
+    return flagged, ['; '.join(r) for r in reasons]
+
+
+def write_table(path: str, labels: np.ndarray, table: Dict[str, np.ndarray], group_name: str = 'group') -> None:
+    """CSV file with one row per group."""
+    import csv
+    columns = list(table.keys())
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow([group_name] + columns)
+        for i, label in enumerate(labels):
+            writer.writerow([label] + [_cell(table[column][i]) for column in columns])
+
+
+def _cell(value):
+    if isinstance(value, (float, np.floating)):
+        return '' if np.isnan(value) else repr(float(value))
+    if isinstance(value, np.bool_):
+        return int(value)
+    return value.item() if isinstance(value, np.generic) else value
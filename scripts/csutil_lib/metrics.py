@@ -0,0 +1,179 @@
+"""Phase timers, peak-memory sampling and throughput reporting for the csutil scripts.
+
+Usage::
+
+    metrics = Metrics('csutil_stat.py', metrics_json)
+    with metrics.phase('load', rows=n):
+        ...
+    metrics.finish()
+
+Every phase prints one human-readable line when it ends. If a JSON path is given,
+``finish()`` writes all phases (duration, rows, rows/s, RSS) there, for tracking
+regressions of each stage across runs. A phase which raises is recorded with its
+exception, and the JSON is then written right away with the phases so far.
+"""
+
+import sys
+import os
+import json
+import time
+import datetime
+import resource
+import threading
+from contextlib import contextmanager
+from typing import Iterable, Iterator, List, Optional
+
+
+def current_rss_mb() -> Optional[float]:
+    """Current resident set size. None where /proc is not available."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def max_rss_mb() -> float:
+    """Peak resident set size of the process so far."""
+    ru_maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return ru_maxrss / (1024 * 1024) if sys.platform == 'darwin' else ru_maxrss / 1024
+
+
+class _RssSampler(threading.Thread):
+    def __init__(self, interval: float):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = current_rss_mb() or 0.0
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            rss = current_rss_mb()
+            if rss is not None:
+                self.peak = max(self.peak, rss)
+
+    def stop(self) -> float:
+        self._stop_event.set()
+        self.join()
+        rss = current_rss_mb()
+        if rss is not None:
+            self.peak = max(self.peak, rss)
+        return self.peak
+
+
+class Phase:
+    def __init__(self, name: str, rows: Optional[int] = None):
+        self.name = name
+        self.rows = rows
+        self.duration_s = 0.0
+        self.rss_start_mb = None
+        self.rss_end_mb = None
+        self.peak_rss_mb = None
+        # repr of the exception which ended the phase, None if it completed
+        self.error = None
+
+    @property
+    def rows_per_s(self) -> Optional[float]:
+        if self.rows is None or self.duration_s <= 0:
+            return None
+        return self.rows / self.duration_s
+
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'duration_s': self.duration_s,
+            'rows': self.rows,
+            'rows_per_s': self.rows_per_s,
+            'rss_start_mb': self.rss_start_mb,
+            'rss_end_mb': self.rss_end_mb,
+            'peak_rss_mb': self.peak_rss_mb,
+            'error': self.error,
+        }
+
+    def text(self) -> str:
+        s = f'[{self.name}] {self.duration_s:.3f} s'
+        if self.rows is not None:
+            s += f', {self.rows} rows'
+            if self.rows_per_s is not None:
+                s += f' ({self.rows_per_s:,.0f} rows/s)'
+        if self.peak_rss_mb is not None:
+            s += f', peak RSS {self.peak_rss_mb:.1f} MB'
+        if self.error is not None:
+            s += f', FAILED with {self.error}'
+        return s
+
+
+class Metrics:
+    def __init__(self, script: str, metrics_json: Optional[str] = None, verbose: bool = True, sample_interval: float = 0.05):
+        self.script = script
+        self.metrics_json = metrics_json
+        self.verbose = verbose
+        self.sample_interval = sample_interval
+        self.phases: List[Phase] = []
+        self._t0 = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name: str, rows: Optional[int] = None) -> Iterator[Phase]:
+        """Time a block. ``rows`` can also be set on the yielded Phase inside the block.
+
+        If the block raises, the phase is recorded as failed and the exception is re-raised.
+        """
+        phase = Phase(name, rows)
+        phase.rss_start_mb = current_rss_mb()
+        sampler = _RssSampler(self.sample_interval) if phase.rss_start_mb is not None else None
+        if sampler is not None:
+            sampler.start()
+        t0 = time.perf_counter()
+        try:
+            yield phase
+        except BaseException as exc:
+            phase.error = repr(exc)
+            raise
+        finally:
+            phase.duration_s = time.perf_counter() - t0
+            phase.peak_rss_mb = sampler.stop() if sampler is not None else max_rss_mb()
+            phase.rss_end_mb = current_rss_mb()
+            self.phases.append(phase)
+            if self.verbose:
+                print(phase.text())
+            if phase.error is not None:
+                self.write_json()
+
+    def progress(self, iterable: Iterable, total: int, label: str = 'Progress', width: int = 50) -> Iterator:
+        """Yield from ``iterable`` while drawing a progress bar of ``total`` steps on stdout."""
+        if not self.verbose or total <= 0:
+            yield from iterable
+            return
+        drawn = -1
+        for i, item in enumerate(iterable):
+            done = min(i + 1, total)
+            # Redraw only when the bar grows, or at the end
+            if done * width // total != drawn or done == total:
+                drawn = done * width // total
+                sys.stdout.write('\r{}: [{:{}}] ({:d} / {:d})'.format(label, '|' * drawn, width, done, total))
+                sys.stdout.flush()
+            yield item
+        sys.stdout.write('\n')
+
+    def to_dict(self) -> dict:
+        return {
+            'script': self.script,
+            'created': datetime.datetime.now().isoformat(),
+            'argv': sys.argv,
+            'total_s': time.perf_counter() - self._t0,
+            'max_rss_mb': max_rss_mb(),
+            'phases': [phase.to_dict() for phase in self.phases],
+        }
+
+    def write_json(self) -> None:
+        if self.metrics_json is not None:
+            with open(self.metrics_json, 'w') as f:
+                json.dump(self.to_dict(), f, indent=2)
+            if self.verbose:
+                print(f'Metrics are saved as {self.metrics_json}')
+
+    def finish(self) -> None:
+        if self.verbose:
+            print(f'[total] {time.perf_counter() - self._t0:.3f} s, max RSS {max_rss_mb():.1f} MB')
+        self.write_json()
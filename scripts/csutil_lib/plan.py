@@ -0,0 +1,463 @@
+"""Dry-run plans of the heavy scripts, from the .npy headers and a sample of rows.
+
+Only the headers and a few thousand sampled rows (through the memory map) are read, so a plan of
+datasets with tens of millions of particles takes well under a second. Memory is estimated from the
+dtypes, the blob path widths of the sample and the arrays each phase of the script keeps alive, as
+the resident set size reported by --metrics-json (mapped pages of the input files included). Runtimes
+are the bytes read and written at nominal disk rates plus the rows of each phase at the nominal rates
+of ROWS_PER_S. These rates and BASE_MEMORY are rounded figures of one workstation, not calibrated to
+the machine the plan runs on, so the estimates are only orders of magnitude; --metrics-json measures
+the actual runs.
+"""
+
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from csutil_lib import blobkey, csio, filterexpr, records
+
+DEFAULT_SAMPLE_SIZE = 10000
+# Nominal disk rates of the runtime estimates (cold page cache).
+RATES = {
+    'read_mb_per_s': 500.0,
+    'write_mb_per_s': 300.0,
+}
+# Interpreter, numpy and matplotlib, added to the memory of every phase. Nominal, as the rates below.
+BASE_MEMORY = 96 * 1024 * 1024
+# Nominal rows per second of each phase, warm page cache, on one core. Rounded figures of one workstation, which
+# only set the order of magnitude of the runtime estimates.
+ROWS_PER_S = {
+    'transfer/load': 3e6,
+    'transfer/join_passthrough': 1.2e6,
+    'transfer/index_original': 4.5e5,
+    'transfer/index_original_cached': 2e7,
+    'transfer/index_imported': 3.5e5,
+    'transfer/match': 1.2e6,
+    'transfer/gather': 6e5,
+    'transfer/save': 2.5e6,
+    'filter/filter': 2e6,
+    'filter/gather': 9e6,
+    'filter/gather_passthrough': 4e5,
+    'filter/save': 3e6,
+}
+# Sizes of the temporaries of the scripts, per row. Counts of arrays are those alive at the peak of the function named.
+# int64 row index, sort order or blob key
+INDEX_NBYTES = np.dtype(np.int64).itemsize
+# bool mask
+MASK_NBYTES = np.dtype(bool).itemsize
+# float64 value, as statistics are accumulated
+FLOAT_NBYTES = np.dtype(np.float64).itemsize
+# Copies of the input of np.unique(..., return_inverse=True): the flattened and the sorted copy
+UNIQUE_COPIES = 2
+# int64 arrays of np.unique(..., return_inverse=True): the sort order and the inverse
+UNIQUE_INDEX_ARRAYS = 2
+# int64 arrays of a blobkey.KeyIndex: codes, blob/idx, keys, sort order and sorted keys
+KEY_INDEX_ARRAYS = 5
+# int64 arrays read from a cached blobkey.KeyIndex: codes and blob/idx
+CACHED_INDEX_ARRAYS = 2
+# int64 arrays per query row of blobkey.match_blob_keys: blob/idx, lookup keys and basename positions
+MATCH_INDEX_ARRAYS = 3
+# int64 arrays per query row of records.match_uids: searchsorted positions, found query rows and their reference rows
+UID_JOIN_INDEX_ARRAYS = 3
+# int64 arrays kept per row after a match or uid join: the rows on both sides
+MATCHED_ROW_ARRAYS = 2
+# float64 arrays per value of streaming.QuantileSketch.update: the values, their weights and the merged, sorted means and weights
+SKETCH_ARRAYS = 5
+# bool masks per row of filterexpr.evaluate: the combined mask and that of the clause evaluated
+EVALUATE_MASKS = 2
+# Copies of the output made by cryosparc_compute.dataset.Dataset before it is written
+SAVE_COPIES = 1
+
+
+def sample_rows(num_items: int, sample_size: int, seed: int = 0) -> np.ndarray:
+    """Sorted random rows (all rows if there are not more than ``sample_size``)."""
+    if num_items <= sample_size:
+        return np.arange(num_items)
+    return np.sort(np.random.default_rng(seed).choice(num_items, sample_size, replace=False))
+
+
+def sample_fields(path: str, fields: List[str], sample_size: int, seed: int = 0) -> np.ndarray:
+    """``fields`` of sampled rows of a .cs file. Only the pages of the sampled rows are read."""
+    arr = csio.open_cs(path)
+    return csio.project(arr[sample_rows(len(arr), sample_size, seed)], fields)
+
+
+def sample_joined_fields(path: str, passthrough_path: Optional[str], fields: List[str], sample_size: int, seed: int = 0) -> Dict[str, np.ndarray]:
+    """``fields`` of sampled rows of a .cs file, those it does not have from the uid-aligned rows of its passthrough file.
+
+    If any field comes from the passthrough file, sampled rows which are not in it are left out.
+    """
+    arr = csio.open_cs(path)
+    passthrough_fields = [name for name in fields if name not in arr.dtype.names]
+    if len(passthrough_fields) == 0:
+        sample = sample_fields(path, fields, sample_size, seed)
+        return {name: sample[name] for name in fields}
+    passthrough = csio.open_cs(passthrough_path)
+    rows = sample_rows(len(arr), sample_size, seed)
+    found, passthrough_idx = records.match_uids(arr['uid'][rows], passthrough['uid'])
+    return {
+        name: np.array(passthrough[name][passthrough_idx] if name in passthrough_fields else arr[name][rows[found]])
+        for name in fields
+    }
+
+
+def fields_nbytes(dtype: np.dtype, fields: Optional[Sequence[str]] = None) -> int:
+    """Bytes per row of ``fields`` (all fields if None)."""
+    return sum(dtype.fields[name][0].itemsize for name in (dtype.names if fields is None else fields))
+
+
+def clause_fields_nbytes(header: csio.CsHeader, passthrough: Optional[csio.CsHeader], fields: Sequence[str]) -> int:
+    """Bytes per row of filter clause ``fields``, those the input file does not have from its passthrough file."""
+    nbytes = fields_nbytes(header.dtype, [name for name in fields if name in header.names])
+    if passthrough is not None:
+        nbytes += fields_nbytes(passthrough.dtype, [name for name in fields if name not in header.names and name in passthrough.names])
+    return nbytes
+
+
+def unique_nbytes(itemsize: int) -> int:
+    """Bytes per row of the temporaries of np.unique(..., return_inverse=True) on items of ``itemsize``."""
+    return UNIQUE_COPIES * itemsize + UNIQUE_INDEX_ARRAYS * INDEX_NBYTES
+
+
+def uid_join_nbytes(num_query: int, num_ref: int, uid_nbytes: int) -> int:
+    """Bytes of the temporaries of records.match_uids: the sorted reference uids with their order, and the
+    positions, comparison and found rows of the query uids."""
+    return num_ref * (INDEX_NBYTES + uid_nbytes) + num_query * (UID_JOIN_INDEX_ARRAYS * INDEX_NBYTES + uid_nbytes + MASK_NBYTES)
+
+
+def format_bytes(num_bytes: float) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(num_bytes) < 1024:
+            return f'{num_bytes:.1f} {unit}'
+        num_bytes /= 1024
+    return f'{num_bytes:.1f} TB'
+
+
+@dataclass
+class Phase:
+    """Estimated peak memory, rows processed (at ``rows_per_s``) and bytes read and written of one phase of a script."""
+    name: str
+    memory: int
+    rows: int = 0
+    rows_per_s: float = 1e7
+    read: int = 0
+    write: int = 0
+
+    @property
+    def seconds(self) -> float:
+        return (
+            self.rows / self.rows_per_s
+            + self.read / (RATES['read_mb_per_s'] * 1024 * 1024) + self.write / (RATES['write_mb_per_s'] * 1024 * 1024)
+        )
+
+
+@dataclass
+class Plan:
+    title: str
+    lines: List[str] = field(default_factory=list)
+    phases: List[Phase] = field(default_factory=list)
+    warnings: List[str] = field(default_factory=list)
+
+    @property
+    def peak_memory(self) -> int:
+        return BASE_MEMORY + max((phase.memory for phase in self.phases), default=0)
+
+    @property
+    def seconds(self) -> float:
+        return sum(phase.seconds for phase in self.phases)
+
+    def report(self) -> str:
+        lines = [f'##### Plan: {self.title} #####'] + [f'\t{line}' for line in self.lines]
+        if len(self.phases) > 0:
+            lines.append('Estimated phases (peak memory, read, written, time), orders of magnitude only:')
+            width = max(len(phase.name) for phase in self.phases)
+            for phase in self.phases:
+                lines.append(
+                    f'\t{phase.name:<{width}} : {format_bytes(BASE_MEMORY + phase.memory):>10}, {format_bytes(phase.read):>10}, '
+                    f'{format_bytes(phase.write):>10}, {phase.seconds:7.1f} s'
+                )
+            lines.append(f'Estimated peak memory : ~{format_bytes(self.peak_memory)}')
+            lines.append(
+                f'Estimated runtime     : ~{self.seconds:.1f} s (at nominal rates: {RATES["read_mb_per_s"]:g} MB/s read, '
+                f'{RATES["write_mb_per_s"]:g} MB/s write; --metrics-json measures the actual run)'
+            )
+        for warning in self.warnings:
+            lines.append(f'WARNING: {warning}')
+        return '\n'.join(lines)
+
+
+@dataclass
+class UuidCheck:
+    """Overlap of sampled blob path basenames for several numbers of removed UUID strings."""
+    # (orig num_remove_uuid, imported num_remove_uuid) -> fraction of sampled imported rows whose basename is in the original sample
+    overlap: Dict[Tuple[int, int], float]
+    # num_remove_uuid -> distinct basenames in the original sample
+    orig_distinct: Dict[int, int]
+    imported_distinct: Dict[int, int]
+
+    def merges(self, n_orig: int, n_imported: int) -> bool:
+        """Whether removing the strings merges blob paths which are distinct without removing anything."""
+        return self.orig_distinct[n_orig] < self.orig_distinct[0] or self.imported_distinct[n_imported] < self.imported_distinct[0]
+
+    def best(self, current: Tuple[int, int]) -> Tuple[int, int]:
+        """Settings of the largest overlap which merge no blob paths, the closest to ``current`` (preferably in the
+        imported setting only) among ties."""
+        candidates = [k for k in self.overlap if not self.merges(*k)] or [current]
+        return max(candidates, key=lambda k: (
+            round(self.overlap[k], 6), -abs(k[0] - current[0]) - abs(k[1] - current[1]), -abs(k[0] - current[0])
+        ))
+
+
+def check_uuid_settings(orig_paths: np.ndarray, imported_paths: np.ndarray, max_remove: int) -> UuidCheck:
+    orig_basenames = {n: blobkey.get_blobpath_basename(orig_paths, n) for n in range(max_remove + 1)}
+    imported_basenames = {n: blobkey.get_blobpath_basename(imported_paths, n) for n in range(max_remove + 1)}
+    overlap = {}
+    for n_orig, orig in orig_basenames.items():
+        uniq = np.unique(orig[orig != ''])
+        for n_imp, imported in imported_basenames.items():
+            overlap[(n_orig, n_imp)] = float(np.mean(np.isin(imported, uniq))) if len(imported) > 0 else 0.0
+    return UuidCheck(
+        overlap=overlap,
+        orig_distinct={n: len(np.unique(b)) for n, b in orig_basenames.items()},
+        imported_distinct={n: len(np.unique(b)) for n, b in imported_basenames.items()},
+    )
+
+
+def sample_coverage(labels: np.ndarray) -> float:
+    """Good-Turing estimate of the fraction of all rows whose label occurs in the sample (1 - singletons / n)."""
+    if len(labels) == 0:
+        return 0.0
+    _, counts = np.unique(labels, return_counts=True)
+    return 1.0 - np.count_nonzero(counts == 1) / len(labels)
+
+
+def transfer_plan(
+    orig_cs_file: str, orig_passthrough_file: str, imported_cs_file: str,
+    orig_num_remove_uuid: int, imported_num_remove_uuid: int,
+    index_cache_dir: Optional[str] = None, use_cache: bool = True, sample_size: int = DEFAULT_SAMPLE_SIZE
+) -> Plan:
+    """Plan of csutil_transfer_alignments3d.py: sizes, match coverage, UUID settings, memory and runtime."""
+    start = time.perf_counter()
+    plan = Plan('csutil_transfer_alignments3d.py')
+    orig = csio.read_header(orig_cs_file)
+    passthrough = csio.read_header(orig_passthrough_file)
+    imported = csio.read_header(imported_cs_file)
+    for path, header, fields in (
+        (orig_cs_file, orig, ['uid', 'blob/path', 'blob/idx']),
+        (orig_passthrough_file, passthrough, ['uid']),
+        (imported_cs_file, imported, ['blob/path', 'blob/idx']),
+    ):
+        missing = [name for name in fields if name not in header.names]
+        if len(missing) > 0:
+            plan.warnings.append(f'{path} has no fields {missing}.')
+        plan.lines.append(f'{path} : {header.num_items} rows, {len(header.names)} fields, {format_bytes(header.nbytes)}')
+    if len(plan.warnings) > 0:
+        return plan
+    n_orig, n_pass, n_imp = orig.num_items, passthrough.num_items, imported.num_items
+    if n_pass != n_orig:
+        plan.warnings.append(f'The original dataset has {n_orig} rows but the passthrough file {n_pass}.')
+    if n_imp > n_orig:
+        plan.warnings.append(f'The imported dataset has more rows ({n_imp}) than the original dataset ({n_orig}).')
+
+    alignments3d = [name for name in imported.names if name.startswith('alignments3D/')]
+    if len(alignments3d) == 0:
+        plan.warnings.append(f'{imported_cs_file} has no alignments3D fields.')
+    out_fields = dict.fromkeys(passthrough.names)
+    out_fields.update(dict.fromkeys(orig.names))
+    out_fields.update(dict.fromkeys(alignments3d))
+    out_itemsize = sum(
+        (imported if name in alignments3d else orig if name in orig.names else passthrough).dtype.fields[name][0].itemsize
+        for name in out_fields
+    )
+    plan.lines.append(f'Output : {n_imp} rows (if all imported particles match), {len(out_fields)} fields, {format_bytes(n_imp * out_itemsize)}')
+    plan.lines.append(f'Transferred fields : {", ".join(alignments3d)}')
+
+    # Matching on the sampled rows
+    orig_sample = sample_fields(orig_cs_file, ['blob/path', 'blob/idx'], sample_size)
+    imported_sample = sample_fields(imported_cs_file, ['blob/path', 'blob/idx'], sample_size, seed=1)
+    plan.lines.append(f'Original blobpath example : {orig_sample["blob/path"][0] if len(orig_sample) > 0 else ""}')
+    plan.lines.append(f'Imported blobpath example : {imported_sample["blob/path"][0] if len(imported_sample) > 0 else ""}')
+    settings = (orig_num_remove_uuid, imported_num_remove_uuid)
+    check = check_uuid_settings(orig_sample['blob/path'], imported_sample['blob/path'], max(settings) + 1)
+    plan.lines.append('Sampled basename overlap by (orig, imported) removed UUID strings:')
+    for key, value in sorted(check.overlap.items()):
+        plan.lines.append(f'\t{key} : {value * 100:5.1f} %' + ('  <- current settings' if key == settings else ''))
+    best = check.best(settings)
+    if check.overlap[best] > check.overlap[settings]:
+        plan.warnings.append(
+            f'--orig_num_remove_blobpath_uuid {best[0]} --imported_num_remove_blobpath_uuid {best[1]} matches more sampled particles '
+            f'({check.overlap[best] * 100:.1f} %) than the current settings ({check.overlap[settings] * 100:.1f} %).'
+        )
+    for name, distinct, n in (('original', check.orig_distinct, settings[0]), ('imported', check.imported_distinct, settings[1])):
+        if distinct[n] < distinct[0]:
+            plan.warnings.append(f'Removing {n} UUID strings merges distinct {name} blob paths ({distinct[0]} -> {distinct[n]} basenames in the sample). It removes more than the UUIDs.')
+
+    imported_basenames = blobkey.get_blobpath_basename(imported_sample['blob/path'], imported_num_remove_uuid)
+    cache_path = blobkey.index_cache_path(orig_cs_file, orig_num_remove_uuid, index_cache_dir)
+    index = blobkey.KeyIndex.load(cache_path, blobkey.index_source(orig_cs_file, orig_num_remove_uuid)) if use_cache else None
+    if index is not None:
+        # Exact lookup of the sampled imported particles in the whole original dataset.
+        match = blobkey.match_blob_keys(index, imported_basenames, imported_sample['blob/idx'])
+        coverage = match.num_matched / max(len(imported_sample), 1)
+        plan.lines.append(f'Match coverage : {coverage * 100:.1f} % of {len(imported_sample)} sampled imported particles (cached original index)')
+        if len(match.duplicate_ref_keys) > 0:
+            plan.warnings.append(f'{len(match.duplicate_ref_keys)} duplicate (basename, blob/idx) keys in the original dataset.')
+    else:
+        # Without the whole original index, the sampled imported basenames are looked up in the basenames of the original
+        # sample, which miss the stacks not sampled; the overlap is scaled by the estimated fraction of particles in sampled stacks.
+        orig_basenames = blobkey.get_blobpath_basename(orig_sample['blob/path'], orig_num_remove_uuid)
+        seen = sample_coverage(orig_basenames)
+        coverage = min(1.0, check.overlap[settings] / seen) if seen > 0 else 0.0
+        plan.lines.append(
+            f'Match coverage : ~{coverage * 100:.1f} % of {len(imported_sample)} sampled imported particles by basename '
+            f'({check.overlap[settings] * 100:.1f} % found in the stacks of the original sample, which hold ~{seen * 100:.0f} % of the particles). '
+            'Run once without --no_index_cache for an exact check with the cached index.'
+        )
+    imported_keys = np.char.add(imported_basenames.astype(str), np.char.mod('@%d', imported_sample['blob/idx']))
+    num_dup = len(imported_keys) - len(np.unique(imported_keys))
+    if num_dup > 0:
+        plan.warnings.append(f'{num_dup} duplicate (basename, blob/idx) keys among the sampled imported particles.')
+    if coverage < 1.0 and index is not None:
+        plan.warnings.append(f'About {(1 - coverage) * n_imp:.0f} imported particles would not match and the transfer would fail.')
+
+    # Memory as in csutil_transfer_alignments3d.main: arrays kept from earlier phases plus the temporaries of each phase.
+    # Blob paths are decoded to unicode as wide as the longest one, estimated from the sample.
+    orig_path_nbytes = records.as_str_array(orig_sample['blob/path']).dtype.itemsize
+    imported_path_nbytes = records.as_str_array(imported_sample['blob/path']).dtype.itemsize
+    orig_basename_nbytes = blobkey.get_blobpath_basename(orig_sample['blob/path'], orig_num_remove_uuid).dtype.itemsize
+    imported_basename_nbytes = imported_basenames.dtype.itemsize
+    loaded_fields = ['blob/path', 'blob/idx'] + alignments3d
+    out_bytes = n_imp * out_itemsize
+    held = n_imp * fields_nbytes(imported.dtype, loaded_fields)
+    load = Phase('load', imported.nbytes + held, n_imp, ROWS_PER_S['transfer/load'], read=imported.nbytes)
+    # The original and passthrough files stay mapped until the gather.
+    held += orig.nbytes + passthrough.nbytes
+    join = Phase(
+        'join_passthrough', held + uid_join_nbytes(n_orig, n_pass, fields_nbytes(orig.dtype, ['uid'])), n_orig,
+        ROWS_PER_S['transfer/join_passthrough'], read=orig.nbytes + passthrough.nbytes
+    )
+    held += MATCHED_ROW_ARRAYS * INDEX_NBYTES * n_orig
+    if index is not None:
+        index_original = Phase(
+            'index_original', held + (CACHED_INDEX_ARRAYS + KEY_INDEX_ARRAYS) * INDEX_NBYTES * n_orig, n_orig,
+            ROWS_PER_S['transfer/index_original_cached'], read=CACHED_INDEX_ARRAYS * INDEX_NBYTES * n_orig
+        )
+    else:
+        # blob/path and blob/idx loaded, then the larger of the basename normalization of the decoded paths and the
+        # encoding of the basenames.
+        index_original = Phase(
+            'index_original',
+            held + n_orig * (
+                fields_nbytes(orig.dtype, ['blob/path', 'blob/idx'])
+                + max(orig_path_nbytes + unique_nbytes(orig_path_nbytes), orig_basename_nbytes + unique_nbytes(orig_basename_nbytes))
+            ),
+            n_orig, ROWS_PER_S['transfer/index_original']
+        )
+    held += KEY_INDEX_ARRAYS * INDEX_NBYTES * n_orig
+    index_imported = Phase(
+        'index_imported', held + n_imp * (imported_path_nbytes + unique_nbytes(imported_path_nbytes)), n_imp, ROWS_PER_S['transfer/index_imported']
+    )
+    held += n_imp * imported_basename_nbytes
+    # The lookup compares the basenames at the looked-up positions with the imported ones.
+    match = Phase('match', held + n_imp * (MATCH_INDEX_ARRAYS * INDEX_NBYTES + imported_basename_nbytes), n_imp, ROWS_PER_S['transfer/match'])
+    held += MATCHED_ROW_ARRAYS * INDEX_NBYTES * n_imp
+    # The output is filled column by column through the passthrough rows of the matched original rows.
+    out_column_nbytes = max(
+        (imported if name in alignments3d else orig if name in orig.names else passthrough).dtype.fields[name][0].itemsize
+        for name in out_fields
+    )
+    gather = Phase('gather', held + out_bytes + n_imp * (INDEX_NBYTES + out_column_nbytes), n_imp, ROWS_PER_S['transfer/gather'])
+    held -= n_imp * fields_nbytes(imported.dtype, loaded_fields) + orig.nbytes + passthrough.nbytes
+    save = Phase('save', held + (1 + SAVE_COPIES) * out_bytes, n_imp, ROWS_PER_S['transfer/save'], write=out_bytes)
+    plan.phases = [load, join, index_original, index_imported, match, gather, save]
+    plan.lines.append(f'Planned in {time.perf_counter() - start:.2f} s')
+    return plan
+
+
+def filter_plan(
+    infiles: List[str], infiles_passthrough: Optional[List[str]], clauses: List[filterexpr.Clause], chunk_size: Optional[int],
+    sample_size: int = DEFAULT_SAMPLE_SIZE
+) -> Plan:
+    """Plan of csutil_particle_filtering.py: sizes, retention estimated on sampled rows, memory and runtime.
+
+    sigma() thresholds are estimated from the sample.
+    """
+    start = time.perf_counter()
+    plan = Plan('csutil_particle_filtering.py')
+    headers = [csio.read_header(path) for path in infiles]
+    passthroughs = [csio.read_header(path) for path in infiles_passthrough] if infiles_passthrough is not None else [None] * len(infiles)
+    fields = list(dict.fromkeys(clause.field for clause in clauses))
+    for path, header, passthrough in zip(infiles, headers, passthroughs):
+        plan.lines.append(f'{path} : {header.num_items} rows, {len(header.names)} fields, {format_bytes(header.nbytes)}')
+        missing = [name for name in fields if name not in header.names and (passthrough is None or name not in passthrough.names)]
+        if len(missing) > 0:
+            plan.warnings.append(f'{path} has no fields {missing}' + (' (nor its passthrough file).' if passthrough is not None else '.'))
+        if passthrough is not None and passthrough.num_items != header.num_items:
+            plan.warnings.append(f'{path} has {header.num_items} rows but its passthrough file {passthrough.num_items}.')
+    if len(plan.warnings) > 0:
+        return plan
+
+    # The sample is split over the files in proportion to their rows, so that it is a sample of all particles.
+    num_in = sum(header.num_items for header in headers)
+    # Sampled rows which are not in the passthrough file are dropped when a clause field comes from it.
+    sizes = [int(round(sample_size * header.num_items / max(num_in, 1))) for header in headers]
+    samples = [
+        sample_joined_fields(path, passthrough_path, fields, size, seed=i)
+        for i, (path, passthrough_path, size) in enumerate(zip(infiles, infiles_passthrough or [None] * len(infiles), sizes))
+    ]
+    num_drawn = sum(min(size, header.num_items) for size, header in zip(sizes, headers))
+    values = {name: np.concatenate([s[name] for s in samples]) for name in fields}
+    num_sampled = len(values[fields[0]]) if len(fields) > 0 else 0
+    if any(clause.sigma is not None for clause in clauses) and num_sampled < 2:
+        plan.warnings.append(f'Not enough sampled rows to estimate sigma() thresholds ({num_sampled} sampled particles).')
+        return plan
+    clauses = filterexpr.resolve_sigma(clauses, {name: (float(np.nanmean(v)), float(np.nanstd(v, ddof=1))) for name, v in values.items() if len(v) > 1})
+    mask, rejected = filterexpr.evaluate(clauses, values.__getitem__, num_sampled)
+    retained = np.count_nonzero(mask) / num_drawn if num_drawn > 0 else 0.0
+    for clause in clauses:
+        plan.lines.append(f'{clause.text} : rejects ~{rejected[clause.text] / max(num_sampled, 1) * 100:.1f} % of {num_sampled} sampled particles')
+    num_out = int(round(retained * num_in))
+    plan.lines.append(f'Output : ~{num_out} of {num_in} particles ({retained * 100:.1f} %)')
+
+    # Memory of the largest file, which is what one process holds at a time. The input (and passthrough) file stays mapped.
+    largest = int(np.argmax([header.num_items for header in headers]))
+    header, passthrough = headers[largest], passthroughs[largest]
+    n = header.num_items
+    chunk_rows = n if chunk_size is None else min(n, chunk_size)
+    held = header.nbytes + n * MASK_NBYTES
+    # The clause columns of a chunk, the masks of the clauses and the statistics of the retained values of one field
+    filter_temp = chunk_rows * (clause_fields_nbytes(header, passthrough, fields) + EVALUATE_MASKS * MASK_NBYTES + SKETCH_ARRAYS * FLOAT_NBYTES)
+    if passthrough is not None and any(name not in header.names for name in fields):
+        # Clause fields of the passthrough file are read through a uid join over all rows, whose rows are kept while filtering.
+        filter_temp = passthrough.nbytes + max(
+            uid_join_nbytes(n, passthrough.num_items, fields_nbytes(passthrough.dtype, ['uid'])), MATCHED_ROW_ARRAYS * INDEX_NBYTES * n + filter_temp
+        )
+    out_itemsize = fields_nbytes(header.dtype)
+    num_retained = int(round(retained * n))
+    if passthrough is not None:
+        passthrough_fields = [name for name in passthrough.names if name not in header.names]
+        out_itemsize += fields_nbytes(passthrough.dtype, passthrough_fields)
+        # Retained rows joined on uid with the passthrough file, then the output filled column by column
+        gather_temp = (
+            passthrough.nbytes + num_retained * INDEX_NBYTES + uid_join_nbytes(num_retained, passthrough.num_items, fields_nbytes(passthrough.dtype, ['uid']))
+            + num_retained * max(fields_nbytes(header.dtype, [name]) for name in header.names)
+        )
+    else:
+        gather_temp = 0
+    out_bytes = num_retained * out_itemsize
+    # Passes over the clause fields: statistics for sigma() thresholds, the filter itself and, with chunks, the exact
+    # histograms of the retained values on the range of the merged statistics.
+    num_passes = 1 + any(clause.sigma is not None for clause in clauses) + (chunk_size is not None)
+    num_read = sum(h.num_items * clause_fields_nbytes(h, p, fields) for h, p in zip(headers, passthroughs)) * num_passes
+    total_out = num_out * out_itemsize
+    # The retained rows of all files are concatenated in the main process before they are saved.
+    save_memory = (1 + SAVE_COPIES) * total_out + (total_out if len(infiles) > 1 else 0)
+    plan.phases = [
+        Phase('filter', held + filter_temp, num_in * num_passes, ROWS_PER_S['filter/filter'], read=num_read),
+        Phase('gather', held + gather_temp + out_bytes, num_out, ROWS_PER_S['filter/gather' if passthrough is None else 'filter/gather_passthrough'], read=total_out),
+        Phase('save', save_memory, num_out, ROWS_PER_S['filter/save'], write=total_out),
+    ]
+    if len(infiles) > 1:
+        plan.lines.append(f'Memory is per worker process for the largest file {infiles[largest]}.')
+    plan.lines.append(f'Planned in {time.perf_counter() - start:.2f} s')
+    return plan
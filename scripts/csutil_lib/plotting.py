@@ -0,0 +1,66 @@
+"""Rendering of pre-computed histograms and 2D densities, optionally in worker processes.
+
+Only counts and bin edges are passed to the rendering functions, so that matplotlib never bins
+raw particle columns. matplotlib is imported with the non-interactive Agg backend inside the
+rendering functions only.
+"""
+
+from typing import Callable, List, Optional, Sequence, Tuple
+from csutil_lib import fanin
+
+
+def _pyplot():
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def render_histogram(outfile: str, xlabel: str, counts: Sequence[int], edges: Sequence[float], text: str = '') -> str:
+    plt = _pyplot()
+    fig, ax = plt.subplots(layout='constrained')
+    ax.stairs(counts, edges, fill=True)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel('Frequency')
+    if text:
+        ax.text(0.99, 0.99, text, va='top', ha='right', transform=ax.transAxes)
+    fig.savefig(outfile)
+    plt.close(fig)
+    return outfile
+
+
+def render_density(
+    outfile: str, xlabel: str, ylabel: str, counts, xedges: Sequence[float], yedges: Sequence[float], title: str = '', log: bool = True
+) -> str:
+    """2D counts (x bins along the first axis) as a heatmap, on a log color scale by default."""
+    import numpy as np
+    from matplotlib.colors import LogNorm
+    plt = _pyplot()
+    counts = np.asarray(counts)
+    fig, ax = plt.subplots(layout='constrained')
+    if log and counts.max(initial=0) > 0:
+        mesh = ax.pcolormesh(xedges, yedges, np.ma.masked_equal(counts.T, 0), norm=LogNorm(vmin=1, vmax=counts.max()), shading='flat')
+    else:
+        mesh = ax.pcolormesh(xedges, yedges, counts.T, shading='flat')
+    fig.colorbar(mesh, ax=ax, label='Particles')
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    if title:
+        ax.set_title(title)
+    fig.savefig(outfile)
+    plt.close(fig)
+    return outfile
+
+
+def _call(func: Callable, args: Tuple) -> str:
+    return func(*args)
+
+
+def render_calls(calls: List[Tuple[Callable, Tuple]], num_workers: Optional[int] = None) -> List[str]:
+    """Call ``func(*args)`` for every (func, args), in a process pool if ``num_workers`` != 1."""
+    return list(fanin.imap(_call, calls, num_workers))
+
+
+def render_many(jobs: List[Tuple], render=render_histogram, num_workers: Optional[int] = None) -> List[str]:
+    """Call ``render(*job)`` for every job, in a process pool if ``num_workers`` != 1."""
+    return render_calls([(render, job) for job in jobs], num_workers)
@@ -0,0 +1,98 @@
+"""Column-wise operations on numpy structured (record) arrays of cryoSPARC datasets."""
+
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+
+
+def gather(sources: Sequence[Tuple[np.ndarray, np.ndarray, Optional[Sequence[str]]]]) -> np.ndarray:
+    """Structured array built from rows of several sources.
+
+    Each source is ``(arr, idx, fields)`` and contributes ``arr[field][idx]`` for its ``fields``
+    (all fields of ``arr`` if None). A field provided by a later source overwrites the earlier one
+    but keeps the earlier position. The output is filled column by column, so no intermediate
+    table other than the output itself is allocated and the dtypes are kept exactly.
+    """
+    owner = {}
+    for i, (arr, idx, fields) in enumerate(sources):
+        assert len(idx) == len(sources[0][1])
+        for name in (arr.dtype.names if fields is None else fields):
+            owner[name] = i
+    descr = [(name, sources[i][0].dtype.fields[name][0]) for name, i in owner.items()]
+    out = np.empty(len(sources[0][1]), dtype=descr)
+    for name, i in owner.items():
+        arr, idx, _ = sources[i]
+        out[name] = arr[name][idx]
+    return out
+
+
+def gather_transfer(
+    base: np.ndarray, base_idx: np.ndarray,
+    other: np.ndarray, other_idx: np.ndarray,
+    columns: Sequence[str]
+) -> np.ndarray:
+    """Rows ``base[base_idx]`` whose ``columns`` are overwritten by ``other[other_idx]``.
+
+    Columns which do not exist in ``base`` are appended at the end in the given order.
+    """
+    return gather([(base, base_idx, None), (other, other_idx, columns)])
+
+
+def columns_with_prefix(arr: np.ndarray, prefix: str) -> List[str]:
+    return [name for name in arr.dtype.names if name.startswith(prefix)]
+
+
+def as_str_array(arr: np.ndarray) -> np.ndarray:
+    """Unicode string array from a column holding str or bytes (fixed-width or object)."""
+    arr = np.asarray(arr)
+    if arr.dtype.kind == 'U':
+        return arr
+    if arr.dtype.kind == 'S':
+        return np.char.decode(arr)
+    if len(arr) > 0 and isinstance(arr[0], bytes):
+        return np.char.decode(arr.astype(bytes))
+    return arr.astype(str)
+
+
+def match_uids(query_uids: np.ndarray, ref_uids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Rows of ``query_uids`` found in ``ref_uids`` and the corresponding rows of ``ref_uids``.
+
+    Vectorized sort/searchsorted join. The returned rows keep the order of ``query_uids``.
+    """
+    order = np.argsort(ref_uids, kind='stable')
+    ref_sorted = ref_uids[order]
+    if len(ref_sorted) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    pos = np.minimum(np.searchsorted(ref_sorted, query_uids), len(ref_sorted) - 1)
+    found = ref_sorted[pos] == query_uids
+    return np.flatnonzero(found), order[pos[found]]
+
+
+def gather_join(base: np.ndarray, base_idx: np.ndarray, other: np.ndarray, other_idx: np.ndarray) -> np.ndarray:
+    """Rows ``base[base_idx]`` extended with the fields of ``other[other_idx]`` which ``base`` does not have."""
+    columns = [name for name in other.dtype.names if name not in base.dtype.names]
+    return gather([(base, base_idx, None), (other, other_idx, columns)])
+
+
+def concatenate(arrays: Sequence[np.ndarray]) -> np.ndarray:
+    """Concatenate structured arrays with the same fields.
+
+    Fixed-width string fields are widened to the longest width, other fields take the promoted type.
+    """
+    names = arrays[0].dtype.names
+    for arr in arrays[1:]:
+        if arr.dtype.names != names:
+            raise ValueError(f'Cannot concatenate datasets with different fields: {names} and {arr.dtype.names}')
+    descr = []
+    for name in names:
+        dtypes = [arr.dtype.fields[name][0] for arr in arrays]
+        base = dtypes[0].base
+        for dt in dtypes[1:]:
+            base = np.promote_types(base, dt.base)
+        descr.append((name, base, dtypes[0].shape))
+    out = np.empty(sum(len(arr) for arr in arrays), dtype=descr)
+    start = 0
+    for arr in arrays:
+        for name in names:
+            out[name][start:start + len(arr)] = arr[name]
+        start += len(arr)
+    return out
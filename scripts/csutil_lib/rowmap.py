@@ -0,0 +1,116 @@
+"""Row mapping of a csutil_transfer_alignments3d.py output, for incremental transfers.
+
+Output row i of a transfer holds original row ``orig_idx[i]`` and the 3D alignments of imported row
+``imported_idx[i]``. The mapping is saved in an .npz sidecar next to the output, together with the
+path, mtime and size of the original, passthrough and output files and the UUID settings it was
+computed with. When the particles are re-imported after another refinement round (same particles
+in the same order), the new alignments3D columns are scattered into the memory-mapped previous
+output through the mapping, instead of matching and rewriting the whole dataset again.
+"""
+
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+import numpy as np
+from csutil_lib import blobkey, csio, plan
+
+ROWMAP_VERSION = 1
+
+
+def rowmap_path(output_cs_file: str) -> str:
+    return f'{output_cs_file}.rowmap.npz'
+
+
+def file_source(path: str) -> Dict[str, object]:
+    st = os.stat(path)
+    return {'path': os.path.abspath(path), 'mtime_ns': st.st_mtime_ns, 'size': st.st_size}
+
+
+@dataclass
+class RowMap:
+    orig_idx: np.ndarray
+    imported_idx: np.ndarray
+    num_imported: int
+    # alignments3D columns taken from the imported dataset
+    columns: List[str] = field(default_factory=list)
+    # 'orig', 'passthrough' and 'output' file sources, and the numbers of removed UUID strings
+    sources: Dict[str, Dict[str, object]] = field(default_factory=dict)
+    settings: Dict[str, int] = field(default_factory=dict)
+
+    def save(self, path: str) -> None:
+        with open(path, 'wb') as f:
+            np.savez(
+                f, version=ROWMAP_VERSION, orig_idx=self.orig_idx, imported_idx=self.imported_idx, num_imported=self.num_imported,
+                columns=np.array(self.columns, dtype=str),
+                **{f'source_{name}_{k}': v for name, source in self.sources.items() for k, v in source.items()},
+                **{f'setting_{k}': v for k, v in self.settings.items()}
+            )
+
+    @classmethod
+    def load(cls, path: str) -> Optional['RowMap']:
+        """None if the file does not exist or has another version."""
+        try:
+            with np.load(path, allow_pickle=False) as npz:
+                if int(npz['version']) != ROWMAP_VERSION:
+                    return None
+                sources = {}
+                settings = {}
+                for key in npz.files:
+                    if key.startswith('source_'):
+                        name, k = key[len('source_'):].split('_', 1)
+                        sources.setdefault(name, {})[k] = npz[key].item()
+                    elif key.startswith('setting_'):
+                        settings[key[len('setting_'):]] = int(npz[key])
+                return cls(npz['orig_idx'], npz['imported_idx'], int(npz['num_imported']), [str(c) for c in npz['columns']], sources, settings)
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def stale(self, files: Dict[str, str], settings: Dict[str, int]) -> List[str]:
+        """Reasons why the mapping does not apply to ``files`` (name -> path) and ``settings``. Empty if it does."""
+        reasons = []
+        for name, path in files.items():
+            if self.sources.get(name) != file_source(path):
+                reasons.append(f'{path} is not the {name} file the row mapping was computed with, or has been modified since.')
+        for k, v in settings.items():
+            if self.settings.get(k) != v:
+                reasons.append(f'The row mapping was computed with {k} = {self.settings.get(k)}, not {v}.')
+        return reasons
+
+
+def check_imported(
+    rowmap: RowMap, out: np.ndarray, imported_path: str, columns: List[str],
+    orig_num_remove_uuid: int, imported_num_remove_uuid: int, sample_size: int = plan.DEFAULT_SAMPLE_SIZE
+) -> List[str]:
+    """Reasons why the row mapping does not hold for a re-imported dataset. Empty if it does.
+
+    The number of rows, the dtypes of ``columns`` and blob/idx of every row are compared exactly; the
+    blob path basenames, whose normalization is costly, on a sample of rows.
+    """
+    header = csio.read_header(imported_path)
+    if header.num_items != rowmap.num_imported:
+        return [f'{imported_path} has {header.num_items} particles, the row mapping was computed for {rowmap.num_imported}.']
+    if sorted(columns) != sorted(rowmap.columns):
+        return [f'The alignments3D columns of {imported_path} {columns} are not those of the previous import {rowmap.columns}.']
+    reasons = []
+    for name in columns:
+        if name not in out.dtype.names:
+            reasons.append(f'{name} is not in the previous output.')
+        elif out.dtype.fields[name][0] != header.dtype.fields[name][0]:
+            reasons.append(f'{name} is {header.dtype.fields[name][0]} in {imported_path} but {out.dtype.fields[name][0]} in the previous output.')
+    if len(reasons) > 0:
+        return reasons
+    imported = csio.open_cs(imported_path)
+    if not np.array_equal(imported['blob/idx'][rowmap.imported_idx], out['blob/idx']):
+        return [f'blob/idx of {imported_path} does not match the previous output through the row mapping.']
+    rows = plan.sample_rows(len(out), sample_size)
+    imported_basenames = blobkey.get_blobpath_basename(imported['blob/path'][rowmap.imported_idx[rows]], imported_num_remove_uuid)
+    out_basenames = blobkey.get_blobpath_basename(out['blob/path'][rows], orig_num_remove_uuid)
+    if not np.array_equal(imported_basenames, out_basenames):
+        reasons.append(f'The blob paths of {imported_path} do not match the previous output through the row mapping.')
+    return reasons
+
+
+def scatter_columns(out: np.ndarray, imported: np.ndarray, imported_idx: np.ndarray, columns: List[str]) -> None:
+    """Write ``imported[column][imported_idx]`` into every column of ``out`` in place, one column at a time."""
+    for name in columns:
+        out[name] = imported[name][imported_idx]
@@ -0,0 +1,53 @@
+"""Set operations on particle keys (uid or blob key) of several datasets.
+
+Keys are integer arrays, one per dataset. Every operation is a sort/searchsorted join, so that
+it scales to tens of millions of rows, and returns row indices into the datasets instead of copies
+of the rows.
+
+- union: every key once, from the first dataset that has it (in the order of the datasets and rows)
+- intersect: rows of the first dataset whose key is in all other datasets
+- difference: rows of the first dataset whose key is in none of the other datasets
+"""
+
+from typing import List, Sequence
+import numpy as np
+
+OPERATIONS = ('union', 'intersect', 'difference')
+
+
+def isin(keys: np.ndarray, other_keys: np.ndarray) -> np.ndarray:
+    """Mask of ``keys`` which are in ``other_keys``."""
+    other_sorted = np.unique(other_keys)
+    if len(other_sorted) == 0:
+        return np.zeros(len(keys), dtype=bool)
+    pos = np.minimum(np.searchsorted(other_sorted, keys), len(other_sorted) - 1)
+    return other_sorted[pos] == keys
+
+
+def union(key_arrays: Sequence[np.ndarray]) -> List[np.ndarray]:
+    """Rows of every dataset which hold the first occurrence of their key."""
+    sizes = [len(keys) for keys in key_arrays]
+    _, first = np.unique(np.concatenate(key_arrays), return_index=True)
+    first.sort()
+    bounds = np.cumsum([0] + sizes)
+    split = np.searchsorted(first, bounds[1:-1])
+    return [rows - start for rows, start in zip(np.split(first, split), bounds[:-1])]
+
+
+def intersect(key_arrays: Sequence[np.ndarray]) -> np.ndarray:
+    mask = np.ones(len(key_arrays[0]), dtype=bool)
+    for other_keys in key_arrays[1:]:
+        mask &= isin(key_arrays[0], other_keys)
+    return np.flatnonzero(mask)
+
+
+def difference(key_arrays: Sequence[np.ndarray]) -> np.ndarray:
+    mask = np.ones(len(key_arrays[0]), dtype=bool)
+    for other_keys in key_arrays[1:]:
+        mask &= ~isin(key_arrays[0], other_keys)
+    return np.flatnonzero(mask)
+
+
+def num_duplicates(keys: np.ndarray) -> int:
+    """Number of rows whose key already appeared in an earlier row."""
+    return len(keys) - len(np.unique(keys))
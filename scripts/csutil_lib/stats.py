@@ -0,0 +1,128 @@
+"""Batched descriptive statistics and histograms of particle columns."""
+
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Sequence, Union
+import numpy as np
+
+DEFAULT_QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+
+@dataclass
+class ColumnStats:
+    """Same quantities as scipy.stats.describe (variance with ddof=1, biased skewness/kurtosis),
+    plus quantiles and histogram counts."""
+    name: str
+    nobs: int
+    mean: float
+    variance: float
+    min: float
+    max: float
+    skewness: float
+    kurtosis: float
+    quantiles: Dict[str, float] = field(default_factory=dict)
+    hist_counts: List[int] = field(default_factory=list)
+    hist_edges: List[float] = field(default_factory=list)
+
+    @property
+    def stdev(self) -> float:
+        return float(np.sqrt(self.variance))
+
+    def to_dict(self, with_hist: bool = True) -> dict:
+        out = asdict(self)
+        out['stdev'] = self.stdev
+        if not with_hist:
+            del out['hist_counts'], out['hist_edges']
+        return out
+
+    def text(self) -> str:
+        return f'Mean {self.mean:.6f}\nMin {self.min:.6f}\nMax {self.max:.6f}\nStdev {self.stdev:.6f}\n#Ptcls {self.nobs}'
+
+
+def expand_columns(name: str, col: np.ndarray) -> Dict[str, np.ndarray]:
+    """1-D columns of a field. Sub-array fields (e.g. alignments3D/pose) are split into ``name/0``, ``name/1``, ..."""
+    if col.ndim == 1:
+        return {name: col}
+    col = col.reshape(col.shape[0], int(np.prod(col.shape[1:])))
+    return {f'{name}/{i}': col[:, i] for i in range(col.shape[1])}
+
+
+def describe_matrix(mat: np.ndarray, quantiles: Sequence[float] = DEFAULT_QUANTILES) -> Dict[str, np.ndarray]:
+    """Moments, min/max and quantiles of every column of a 2-D float array in one pass over axis 0."""
+    nobs = mat.shape[0]
+    if nobs == 0:
+        nan = np.full(mat.shape[1], np.nan)
+        out = {'nobs': np.zeros(mat.shape[1], dtype=np.int64), 'mean': nan, 'variance': nan, 'min': nan, 'max': nan, 'skewness': nan, 'kurtosis': nan}
+        if len(quantiles) > 0:
+            out['quantiles'] = np.full((len(quantiles), mat.shape[1]), np.nan)
+        return out
+    mean = mat.mean(axis=0)
+    dev = mat - mean
+    dev2 = dev * dev
+    m2 = dev2.mean(axis=0)
+    m3 = (dev2 * dev).mean(axis=0)
+    m4 = (dev2 * dev2).mean(axis=0)
+    del dev, dev2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out = {
+            'nobs': np.full(mat.shape[1], nobs),
+            'mean': mean,
+            'variance': m2 * nobs / (nobs - 1) if nobs > 1 else np.full(mat.shape[1], np.nan),
+            'min': mat.min(axis=0),
+            'max': mat.max(axis=0),
+            'skewness': m3 / m2 ** 1.5,
+            'kurtosis': m4 / m2 ** 2 - 3.0,
+        }
+    if len(quantiles) > 0:
+        out['quantiles'] = np.quantile(mat, quantiles, axis=0)
+    return out
+
+
+def describe_columns(
+    columns: Dict[str, np.ndarray],
+    quantiles: Sequence[float] = DEFAULT_QUANTILES,
+    bins: Union[int, str] = 'auto',
+    block_size: int = 8
+) -> List[ColumnStats]:
+    """Statistics of all 1-D columns, processed ``block_size`` columns at a time as one float64 matrix."""
+    names = list(columns.keys())
+    out = []
+    for start in range(0, len(names), block_size):
+        block = names[start:start + block_size]
+        mat = np.stack([np.asarray(columns[name], dtype=np.float64) for name in block], axis=1)
+        desc = describe_matrix(mat, quantiles)
+        for j, name in enumerate(block):
+            counts, edges = np.histogram(mat[:, j], bins=bins)
+            out.append(ColumnStats(
+                name=name,
+                nobs=int(desc['nobs'][j]),
+                mean=float(desc['mean'][j]),
+                variance=float(desc['variance'][j]),
+                min=float(desc['min'][j]),
+                max=float(desc['max'][j]),
+                skewness=float(desc['skewness'][j]),
+                kurtosis=float(desc['kurtosis'][j]),
+                quantiles={f'{q:g}': float(desc['quantiles'][i, j]) for i, q in enumerate(quantiles)},
+                hist_counts=counts.tolist(),
+                hist_edges=edges.tolist(),
+            ))
+        del mat
+    return out
+
+
+def write_summary_json(path: str, stats: List[ColumnStats], infile: Union[str, List[str]] = '', quantiles_approximate: bool = False) -> None:
+    """``quantiles_approximate`` records that the quantiles were estimated from streaming sketches."""
+    import json
+    with open(path, 'w') as f:
+        json.dump({'infile': infile, 'quantiles_approximate': quantiles_approximate, 'columns': [s.to_dict() for s in stats]}, f, indent=2)
+
+
+def write_summary_csv(path: str, stats: List[ColumnStats]) -> None:
+    import csv
+    rows = [s.to_dict(with_hist=False) for s in stats]
+    qnames = list(rows[0]['quantiles'].keys()) if len(rows) > 0 else []
+    header = ['name', 'nobs', 'mean', 'stdev', 'variance', 'min', 'max', 'skewness', 'kurtosis'] + [f'q{q}' for q in qnames]
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow([row[k] for k in header[:9]] + [row['quantiles'][q] for q in qnames])
@@ -0,0 +1,370 @@
+"""Single-pass, mergeable statistics for out-of-core particle columns.
+
+Every accumulator can be updated chunk by chunk and merged with another accumulator of the
+same kind, so statistics of a combined dataset can be computed from partial results of
+chunks or of separate files without concatenating the data.
+
+- Moments: count, mean and central moments up to the 4th order (Welford/Pebay update).
+- QuantileSketch: t-digest-style sketch of weighted centroids for approximate quantiles.
+- FixedHistogram: exact counts on a fixed range.
+
+Histograms over [min, max] of the data need that range first, so their counts are filled by a
+second pass (``file_histograms``) on the range of the merged moments.
+"""
+
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+import numpy as np
+from csutil_lib import csio, stats
+
+
+class Moments:
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.m3 = 0.0
+        self.m4 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    @classmethod
+    def from_values(cls, values: np.ndarray) -> 'Moments':
+        out = cls()
+        values = np.asarray(values, dtype=np.float64).ravel()
+        out.n = len(values)
+        if out.n == 0:
+            return out
+        out.mean = float(values.mean())
+        dev = values - out.mean
+        dev2 = dev * dev
+        out.m2 = float(dev2.sum())
+        out.m3 = float((dev2 * dev).sum())
+        out.m4 = float((dev2 * dev2).sum())
+        out.min = float(values.min())
+        out.max = float(values.max())
+        return out
+
+    def update(self, values: np.ndarray) -> None:
+        self.merge(Moments.from_values(values))
+
+    def merge(self, other: 'Moments') -> None:
+        if other.n == 0:
+            return
+        if self.n == 0:
+            self.__dict__.update(other.__dict__)
+            return
+        na, nb = self.n, other.n
+        n = na + nb
+        d = other.mean - self.mean
+        d2 = d * d
+        m2 = self.m2 + other.m2 + d2 * na * nb / n
+        m3 = (self.m3 + other.m3 + d * d2 * na * nb * (na - nb) / n ** 2
+              + 3.0 * d * (na * other.m2 - nb * self.m2) / n)
+        m4 = (self.m4 + other.m4 + d2 * d2 * na * nb * (na * na - na * nb + nb * nb) / n ** 3
+              + 6.0 * d2 * (na * na * other.m2 + nb * nb * self.m2) / n ** 2
+              + 4.0 * d * (na * other.m3 - nb * self.m3) / n)
+        self.n = n
+        self.mean = self.mean + d * nb / n
+        self.m2, self.m3, self.m4 = m2, m3, m4
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / (self.n - 1) if self.n > 1 else np.nan
+
+    @property
+    def skewness(self) -> float:
+        return np.sqrt(self.n) * self.m3 / self.m2 ** 1.5 if self.m2 > 0 else np.nan
+
+    @property
+    def kurtosis(self) -> float:
+        return self.n * self.m4 / self.m2 ** 2 - 3.0 if self.m2 > 0 else np.nan
+
+    def to_dict(self) -> dict:
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'Moments':
+        out = cls()
+        out.__dict__.update(d)
+        return out
+
+
+class QuantileSketch:
+    """t-digest-style quantile sketch.
+
+    Centroids are merged so that each one covers at most one unit of the arcsine scale
+    function k(q) = compression / (2 pi) * asin(2q - 1), which keeps the tails accurate.
+    """
+
+    def __init__(self, compression: float = 1000.0):
+        self.compression = compression
+        self.means = np.zeros(0, dtype=np.float64)
+        self.weights = np.zeros(0, dtype=np.float64)
+        self.min = np.inf
+        self.max = -np.inf
+
+    @property
+    def total(self) -> float:
+        return float(self.weights.sum())
+
+    def update(self, values: np.ndarray) -> None:
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if len(values) == 0:
+            return
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self._add(values, np.ones(len(values)))
+
+    def merge(self, other: 'QuantileSketch') -> None:
+        if len(other.means) == 0:
+            return
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._add(other.means, other.weights)
+
+    def _add(self, means: np.ndarray, weights: np.ndarray) -> None:
+        means = np.concatenate([self.means, means])
+        weights = np.concatenate([self.weights, weights])
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        cum = np.cumsum(weights)
+        q_mid = (cum - weights / 2) / cum[-1]
+        k = self.compression / (2 * np.pi) * np.arcsin(2 * q_mid - 1)
+        group = np.floor(k)
+        starts = np.flatnonzero(np.concatenate([[True], group[1:] != group[:-1]]))
+        group_weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / group_weights
+        self.weights = group_weights
+
+    def _positions(self) -> Tuple[np.ndarray, np.ndarray]:
+        cum = np.cumsum(self.weights)
+        centers = cum - self.weights / 2
+        return np.concatenate([[0.0], centers, [cum[-1]]]), np.concatenate([[self.min], self.means, [self.max]])
+
+    def quantile(self, q: Union[float, Sequence[float]]) -> np.ndarray:
+        if len(self.means) == 0:
+            return np.full(np.shape(q), np.nan)
+        positions, values = self._positions()
+        return np.interp(np.asarray(q) * positions[-1], positions, values)
+
+    def cdf(self, x: Union[float, Sequence[float]]) -> np.ndarray:
+        if len(self.means) == 0:
+            return np.full(np.shape(x), np.nan)
+        positions, values = self._positions()
+        return np.interp(x, values, positions) / positions[-1]
+
+    def to_dict(self) -> dict:
+        return {'compression': self.compression, 'means': self.means.tolist(), 'weights': self.weights.tolist(), 'min': self.min, 'max': self.max}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'QuantileSketch':
+        out = cls(d['compression'])
+        out.means = np.asarray(d['means'], dtype=np.float64)
+        out.weights = np.asarray(d['weights'], dtype=np.float64)
+        out.min, out.max = d['min'], d['max']
+        return out
+
+
+class FixedHistogram:
+    """Exact histogram counts on a fixed range. Values outside the range are counted separately."""
+
+    def __init__(self, lo: float, hi: float, bins: int):
+        self.edges = np.linspace(lo, hi, bins + 1)
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.underflow = 0
+        self.overflow = 0
+
+    def update(self, values: np.ndarray) -> None:
+        values = np.asarray(values).ravel()
+        self.counts += np.histogram(values, bins=self.edges)[0]
+        self.underflow += int(np.count_nonzero(values < self.edges[0]))
+        self.overflow += int(np.count_nonzero(values > self.edges[-1]))
+
+    def merge(self, other: 'FixedHistogram') -> None:
+        assert np.array_equal(self.edges, other.edges), 'Histograms with different bin edges cannot be merged.'
+        self.counts += other.counts
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+
+    def to_dict(self) -> dict:
+        return {'edges': self.edges.tolist(), 'counts': self.counts.tolist(), 'underflow': self.underflow, 'overflow': self.overflow}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'FixedHistogram':
+        out = cls(d['edges'][0], d['edges'][-1], len(d['counts']))
+        out.edges = np.asarray(d['edges'], dtype=np.float64)
+        out.counts = np.asarray(d['counts'], dtype=np.int64)
+        out.underflow, out.overflow = d['underflow'], d['overflow']
+        return out
+
+
+def auto_num_bins(n: int, lo: float, hi: float, iqr: float) -> int:
+    """Number of bins of numpy's 'auto' estimator (min width of Freedman-Diaconis and Sturges)."""
+    if n == 0 or hi <= lo:
+        return 1
+    width = (hi - lo) / (np.log2(n) + 1.0)
+    if iqr > 0:
+        width = min(width, 2.0 * iqr * n ** (-1.0 / 3.0))
+    return int(np.ceil((hi - lo) / width))
+
+
+class StreamingStats:
+    """Moments, quantile sketch and (optionally fixed-range) histogram of one column."""
+
+    def __init__(self, hist_range: Optional[Tuple[float, float]] = None, bins: Union[int, str] = 'auto', compression: float = 1000.0):
+        self.moments = Moments()
+        self.sketch = QuantileSketch(compression)
+        self.bins = bins
+        self.hist = None
+        if hist_range is not None:
+            assert isinstance(bins, int), 'A fixed-range histogram needs an integer number of bins.'
+            self.hist = FixedHistogram(hist_range[0], hist_range[1], bins)
+
+    def update(self, values: np.ndarray) -> None:
+        self.moments.update(values)
+        self.sketch.update(values)
+        if self.hist is not None:
+            self.hist.update(values)
+
+    def merge(self, other: 'StreamingStats') -> None:
+        self.moments.merge(other.moments)
+        self.sketch.merge(other.sketch)
+        if self.hist is not None:
+            self.hist.merge(other.hist)
+
+    def histogram_range(self) -> Tuple[float, float, int]:
+        """Range and number of bins of a histogram over [min, max] of the values seen, as np.histogram would choose."""
+        m = self.moments
+        if m.n == 0:
+            # As np.histogram of no values
+            lo, hi = 0.0, 1.0
+        else:
+            lo, hi = (m.min, m.max) if m.max > m.min else (m.min - 0.5, m.min + 0.5)
+        if self.bins == 'auto':
+            iqr = float(np.diff(self.sketch.quantile([0.25, 0.75]))[0]) if m.n > 0 else 0.0
+            bins = auto_num_bins(m.n, lo, hi, iqr)
+        else:
+            bins = int(self.bins)
+        return lo, hi, bins
+
+    def histogram(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Exact counts of the fixed-range histogram, given up front or filled by a second pass (``file_histograms``)."""
+        if self.hist is None:
+            raise ValueError('No histogram counts. Fill them with a second pass over the values on histogram_range().')
+        return self.hist.counts, self.hist.edges
+
+    def to_column_stats(self, name: str, quantiles: Sequence[float] = stats.DEFAULT_QUANTILES) -> stats.ColumnStats:
+        m = self.moments
+        counts, edges = self.histogram()
+        qvalues = self.sketch.quantile(list(quantiles))
+        return stats.ColumnStats(
+            name=name,
+            nobs=m.n,
+            mean=m.mean,
+            variance=m.variance,
+            min=m.min,
+            max=m.max,
+            skewness=m.skewness,
+            kurtosis=m.kurtosis,
+            quantiles={f'{q:g}': float(v) for q, v in zip(quantiles, qvalues)},
+            hist_counts=counts.tolist(),
+            hist_edges=edges.tolist(),
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            'moments': self.moments.to_dict(),
+            'sketch': self.sketch.to_dict(),
+            'bins': self.bins,
+            'hist': self.hist.to_dict() if self.hist is not None else None,
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'StreamingStats':
+        out = cls(bins=d['bins'])
+        out.moments = Moments.from_dict(d['moments'])
+        out.sketch = QuantileSketch.from_dict(d['sketch'])
+        if d['hist'] is not None:
+            out.hist = FixedHistogram.from_dict(d['hist'])
+        return out
+
+
+def file_stats(
+    path: str, targets: List[str], chunk_size: int, hist_range: Optional[Tuple[float, float]] = None,
+    bins: Union[int, str] = 'auto', compression: float = 1000.0
+) -> Dict[str, StreamingStats]:
+    """Partial statistics of the (expanded) ``targets`` columns of one .cs file, in one pass over chunks."""
+    accumulators = {}
+    for chunk in csio.iter_chunks(path, chunk_size, targets):
+        for target in targets:
+            for name, col in stats.expand_columns(target, chunk[target]).items():
+                if name not in accumulators:
+                    accumulators[name] = StreamingStats(hist_range, bins, compression)
+                accumulators[name].update(col)
+    return accumulators
+
+
+def file_histograms(
+    path: str, targets: List[str], chunk_size: int, hist_ranges: Dict[str, Tuple[float, float, int]]
+) -> Dict[str, FixedHistogram]:
+    """Exact histograms of the (expanded) ``targets`` columns of one .cs file on fixed ranges, in a second pass over chunks.
+
+    ``hist_ranges`` maps column names to (lo, hi, bins), usually ``histogram_range()`` of statistics merged
+    over all files. Columns which are not in it are skipped.
+    """
+    hists = {name: FixedHistogram(*hist_range) for name, hist_range in hist_ranges.items()}
+    for chunk in csio.iter_chunks(path, chunk_size, targets):
+        for target in targets:
+            for name, col in stats.expand_columns(target, chunk[target]).items():
+                if name in hists:
+                    hists[name].update(col)
+    return hists
+
+
+def pending_histogram_ranges(accumulators: Dict[str, StreamingStats]) -> Dict[str, Tuple[float, float, int]]:
+    """Histogram ranges of the columns whose counts still need a second pass."""
+    return {name: acc.histogram_range() for name, acc in accumulators.items() if acc.hist is None}
+
+
+def set_histograms(accumulators: Dict[str, StreamingStats], partials: Iterable[Dict[str, FixedHistogram]]) -> None:
+    """Merge per-file results of ``file_histograms`` into the histograms of ``accumulators``."""
+    for partial in partials:
+        for name, hist in partial.items():
+            if accumulators[name].hist is None:
+                accumulators[name].hist = hist
+            else:
+                accumulators[name].hist.merge(hist)
+
+
+def describe_file(
+    path: str, targets: List[str], quantiles: Sequence[float] = stats.DEFAULT_QUANTILES, bins: Union[int, str] = 'auto',
+    chunk_size: Optional[int] = None, hist_range: Optional[Tuple[float, float]] = None
+) -> List[stats.ColumnStats]:
+    """Statistics of the (expanded) ``targets`` columns of one .cs file.
+
+    Exact if ``chunk_size`` is None. Otherwise moments and quantiles come from one streaming pass over
+    chunks (quantiles are estimated from the sketch) and histogram counts from a second, exact pass.
+    """
+    if chunk_size is None:
+        reader = csio.CsReader(path)
+        columns = {}
+        for target in targets:
+            columns.update(stats.expand_columns(target, reader[target]))
+        return stats.describe_columns(columns, quantiles, bins)
+    accumulators = file_stats(path, targets, chunk_size, hist_range, bins)
+    set_histograms(accumulators, [file_histograms(path, targets, chunk_size, pending_histogram_ranges(accumulators))])
+    return [acc.to_column_stats(name, quantiles) for name, acc in accumulators.items()]
+
+
+def merge_stats(partials: Iterable[Dict[str, StreamingStats]]) -> Dict[str, StreamingStats]:
+    """Merge per-file results of ``file_stats`` column by column."""
+    merged = {}
+    for partial in partials:
+        for name, acc in partial.items():
+            if name in merged:
+                merged[name].merge(acc)
+            else:
+                merged[name] = acc
+    return merged
@@ -0,0 +1,185 @@
+"""Synthetic cryoSPARC particle datasets for testing the scripts without a cryoSPARC install.
+
+The layout mimics the particles of an Extract From Micrographs job:
+blob/path is ``J<job>/extract/<uuid>_<micrograph>_particles.mrc`` with ``num_uuid`` UUID-like prefixes.
+"""
+
+import os
+import argparse
+import datetime
+from typing import Dict, Optional, Sequence, Tuple
+import numpy as np
+from csutil_lib import csg, csio
+
+PARTICLE_DTYPE = [
+    ('uid', '<u8'),
+    ('blob/path', 'S{}'),
+    ('blob/idx', '<u4'),
+    ('blob/shape', '<u4', (2,)),
+    ('blob/psize_A', '<f4'),
+    ('ctf/type', 'S8'),
+    ('ctf/exp_group_id', '<u4'),
+    ('ctf/accel_kv', '<f4'),
+    ('ctf/cs_mm', '<f4'),
+    ('ctf/df1_A', '<f4'),
+    ('ctf/df2_A', '<f4'),
+    ('ctf/df_angle_rad', '<f4'),
+    ('ctf/cross_corr_ctffind4', '<f4'),
+    ('alignments2D/alpha', '<f4'),
+    ('alignments3D/pose', '<f4', (3,)),
+    ('alignments3D/shift', '<f4', (2,)),
+    ('alignments3D/error', '<f4'),
+    ('alignments3D/psize_A', '<f4'),
+    ('location/micrograph_path', 'S{}'),
+    ('location/center_x_frac', '<f4'),
+    ('location/center_y_frac', '<f4'),
+]
+
+
+def uuid_prefixes(rng: np.random.Generator, num: int, depth: int) -> np.ndarray:
+    prefixes = np.full(num, '', dtype='U1')
+    for _ in range(depth):
+        digits = rng.integers(0, 10 ** 12, size=num)
+        prefixes = np.char.add(prefixes, np.char.add(np.char.zfill(digits.astype(str), 12), '_'))
+    return prefixes
+
+
+def make_particles(
+    num_particles: int,
+    num_micrographs: int = 100,
+    num_uuid: int = 1,
+    job: str = 'J1',
+    extra_fields: Sequence[str] = (),
+    seed: int = 0,
+    micrograph_uuids: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """Random particle records. ``extra_fields`` are added as float32 columns."""
+    rng = np.random.default_rng(seed)
+    num_micrographs = max(1, min(num_micrographs, max(num_particles, 1)))
+    mic_names = np.char.add('mic_', np.char.zfill(np.arange(num_micrographs).astype(str), 6))
+    if micrograph_uuids is None:
+        micrograph_uuids = uuid_prefixes(rng, num_micrographs, num_uuid)
+    mic_of_ptcl = np.sort(rng.integers(0, num_micrographs, size=num_particles))
+    # blob/idx is the index of the particle in its micrograph's particle stack
+    first = np.searchsorted(mic_of_ptcl, mic_of_ptcl, side='left')
+    blob_idx = np.arange(num_particles) - first
+    blob_paths = np.char.add(np.char.add(f'{job}/extract/', micrograph_uuids[mic_of_ptcl]), np.char.add(mic_names[mic_of_ptcl], '_particles.mrc'))
+    mic_paths = np.char.add(np.char.add('S1/motioncorrected/', mic_names[mic_of_ptcl]), '.mrc')
+
+    strlen = max([1] + [int(np.char.str_len(a).max()) for a in (blob_paths, mic_paths) if len(a) > 0])
+    dtype = [(f[0], f[1].format(strlen)) + f[2:] for f in PARTICLE_DTYPE] + [(name, '<f4') for name in extra_fields]
+    arr = np.zeros(num_particles, dtype=dtype)
+    arr['uid'] = rng.integers(1, np.iinfo(np.int64).max, size=num_particles, dtype=np.int64).astype(np.uint64)
+    arr['blob/path'] = np.char.encode(blob_paths)
+    arr['blob/idx'] = blob_idx
+    arr['blob/shape'] = 256
+    arr['blob/psize_A'] = 1.0
+    arr['ctf/type'] = b'spline'
+    arr['ctf/exp_group_id'] = mic_of_ptcl % 8
+    arr['ctf/accel_kv'] = 300.0
+    arr['ctf/cs_mm'] = 2.7
+    arr['ctf/df1_A'] = rng.normal(15000.0, 3000.0, size=num_particles)
+    arr['ctf/df2_A'] = arr['ctf/df1_A'] + rng.normal(200.0, 50.0, size=num_particles)
+    arr['ctf/df_angle_rad'] = rng.uniform(-np.pi, np.pi, size=num_particles)
+    arr['ctf/cross_corr_ctffind4'] = rng.uniform(0.0, 0.3, size=num_particles)
+    arr['alignments2D/alpha'] = rng.normal(0.5, 0.1, size=num_particles)
+    arr['alignments3D/pose'] = rng.normal(0.0, 1.0, size=(num_particles, 3))
+    arr['alignments3D/shift'] = rng.normal(0.0, 2.0, size=(num_particles, 2))
+    arr['alignments3D/error'] = rng.gamma(4.0, 2500.0, size=num_particles)
+    arr['alignments3D/psize_A'] = 1.0
+    arr['location/micrograph_path'] = np.char.encode(mic_paths)
+    arr['location/center_x_frac'] = rng.uniform(0.0, 1.0, size=num_particles)
+    arr['location/center_y_frac'] = rng.uniform(0.0, 1.0, size=num_particles)
+    for name in extra_fields:
+        arr[name] = rng.normal(0.0, 1.0, size=num_particles)
+    return arr
+
+
+PASSTHROUGH_PREFIXES = ('ctf/', 'location/')
+
+
+def split_passthrough(arr: np.ndarray, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """Main particle fields and a passthrough file (uid, ctf/*, location/*) in a shuffled row order."""
+    passthrough_fields = [name for name in arr.dtype.names if name.startswith(PASSTHROUGH_PREFIXES)]
+    main_fields = [name for name in arr.dtype.names if name not in passthrough_fields]
+    perm = np.random.default_rng(seed).permutation(len(arr))
+    return csio.project(arr, main_fields), csio.project(arr[perm], ['uid'] + passthrough_fields)
+
+
+def make_imported(arr: np.ndarray, fraction: float = 0.67, num_uuid: int = 1, job: str = 'J2', seed: int = 0) -> np.ndarray:
+    """Particles re-imported from RELION: a shuffled subset with new uids, refined 3D poses and blob paths
+    ``J<job>/imported/<num_uuid UUIDs>_<original blob basename>``, with the same UUIDs for all particles of a stack."""
+    rng = np.random.default_rng(seed)
+    sel = rng.choice(len(arr), int(len(arr) * fraction), replace=False)
+    stacks, stack_of_ptcl = np.unique(arr['blob/path'][sel], return_inverse=True)
+    basenames = np.char.decode(np.char.rpartition(arr['blob/path'][sel], b'/')[:, 2])
+    blob_paths = np.char.add(np.char.add(f'{job}/imported/', uuid_prefixes(rng, len(stacks), num_uuid)[stack_of_ptcl.ravel()]), basenames)
+    strlen = max(1, int(np.char.str_len(blob_paths).max())) if len(sel) > 0 else 1
+    fields = ['uid', 'blob/path', 'blob/idx', 'blob/shape', 'blob/psize_A'] + [name for name in arr.dtype.names if name.startswith(('ctf/', 'alignments3D/'))]
+    out = np.empty(len(sel), dtype=[(name, f'S{strlen}' if name == 'blob/path' else arr.dtype.fields[name][0]) for name in fields])
+    for name in fields:
+        if name != 'blob/path':
+            out[name] = arr[name][sel]
+    out['uid'] = rng.integers(1, np.iinfo(np.int64).max, size=len(sel), dtype=np.int64).astype(np.uint64)
+    out['blob/path'] = np.char.encode(blob_paths)
+    out['alignments3D/pose'] += rng.normal(0.0, 0.05, size=(len(sel), 3)).astype(np.float32)
+    out['alignments3D/error'] *= 0.9
+    return out
+
+
+def make_csg(metafile: str, num_items: int, result_names: Sequence[str] = ('blob', 'ctf', 'location', 'alignments3D')) -> dict:
+    return {
+        'created': datetime.datetime(2024, 1, 1),
+        'group': {'description': 'Synthetic particles', 'name': 'particles', 'title': 'Particles', 'type': 'particle'},
+        'results': {name: {'metafile': f'>{metafile}', 'num_items': num_items, 'type': f'particle.{name}'} for name in result_names},
+        'version': 'v4.0.0',
+    }
+
+
+def write_transfer_set(
+    outdir: str, num_particles: int, num_micrographs: int = 100, orig_num_uuid: int = 1, imported_num_uuid: int = 1,
+    extra_fields: Sequence[str] = (), fraction: float = 0.67, seed: int = 0
+) -> Dict[str, str]:
+    """Write the inputs of csutil_transfer_alignments3d.py and return their paths.
+
+    The imported blob basenames carry ``orig_num_uuid + imported_num_uuid`` UUID prefixes.
+    """
+    os.makedirs(outdir, exist_ok=True)
+    paths = {
+        'orig_cs_file': os.path.join(outdir, 'J1_particles.cs'),
+        'orig_csg_file': os.path.join(outdir, 'J1_particles.csg'),
+        'orig_passthrough_file': os.path.join(outdir, 'P1_J1_passthrough_particles.cs'),
+        'imported_cs_file': os.path.join(outdir, 'imported_particles.cs'),
+    }
+    arr = make_particles(num_particles, num_micrographs, orig_num_uuid, job='J1', extra_fields=extra_fields, seed=seed)
+    main, passthrough = split_passthrough(arr, seed=seed + 1)
+    csio.save_cs(paths['orig_cs_file'], main)
+    csio.save_cs(paths['orig_passthrough_file'], passthrough)
+    csio.save_cs(paths['imported_cs_file'], make_imported(arr, fraction, imported_num_uuid, seed=seed + 2))
+    csg.save_csg(paths['orig_csg_file'], make_csg(os.path.basename(paths['orig_cs_file']), len(arr)))
+    return paths
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Write a synthetic particle .cs file.'
+    )
+    parser.add_argument('--outfile', type=str, help='Output cs file.')
+    parser.add_argument('--transfer-dir', type=str, help='Instead of --outfile, write the original .cs/.csg, passthrough and imported files of csutil_transfer_alignments3d.py into this directory.')
+    parser.add_argument('--num-particles', type=int, default=10000, help='Number of particles.')
+    parser.add_argument('--num-micrographs', type=int, default=100, help='Number of micrographs.')
+    parser.add_argument('--num-uuid', type=int, default=1, help='Number of UUID prefixes of blob paths.')
+    parser.add_argument('--extra-fields', nargs='*', default=[], help='Additional float32 fields.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.transfer_dir is not None:
+        for name, path in write_transfer_set(args.transfer_dir, args.num_particles, args.num_micrographs, args.num_uuid, extra_fields=args.extra_fields, seed=args.seed).items():
+            print(f'{name}: {path}')
+    else:
+        assert args.outfile is not None, 'Specify --outfile or --transfer-dir.'
+        csio.save_cs(args.outfile, make_particles(args.num_particles, args.num_micrographs, args.num_uuid, extra_fields=args.extra_fields, seed=args.seed))
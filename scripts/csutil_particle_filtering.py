@@ -1,11 +1,9 @@
 import sys
 import os
 import argparse
-from typing import List
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 import numpy as np
-import scipy.stats
-import matplotlib.pyplot as plt
-from cryosparc_compute import dataset
+from csutil_lib import csio, fanin, filterexpr, metrics, plan, plotting, records, stats, streaming
 
 
 def parse_args():
@@ -13,13 +11,20 @@ def parse_args():
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
         description=__doc__
     )
-    parser.add_argument('--infile', type=str, required=True, help='Input cs file.')
-    parser.add_argument('--infile-passthrough', type=str, help='Input passthrough cs file.')
+    parser.add_argument('--infile', nargs='+', type=str, required=True, help='Input cs file(s). Glob patterns and directories (all *.cs files in them) are accepted. Thresholds for several files are computed over all of their particles.')
+    parser.add_argument('--infile-passthrough', nargs='+', type=str, help='Input passthrough cs file(s), one per input file in the same order.')
     parser.add_argument('--outfile-rootname', type=str, required=True, help='Root name for output files.')
-    parser.add_argument('--target', type=str, required=True, help='Target feature for filtering.')
+    parser.add_argument('--target', type=str, help='Target feature for filtering.')
     parser.add_argument('--sigma', type=float, help='Only mean ± sigma * stdev particles will be retained.')
     parser.add_argument('--minval', type=float, help='Min value')
     parser.add_argument('--maxval', type=float, help='Max value')
+    parser.add_argument('--filter', type=str, help='Filter expression combining several clauses with "&", e.g. "alignments3D/error < 1e4 & ctf/cross_corr_ctffind4 > 0.1 & sigma(alignments2D/alpha, 3)". Clauses are "<field> <op> <number>", "sigma(<field>, <k>)" and "range(<field>, <min>, <max>)". Cannot be combined with --target.')
+    parser.add_argument('--chunk-size', type=int, help='Compute statistics and the mask in streaming passes over chunks of this many rows instead of loading the filtered columns at once.')
+    parser.add_argument('--per-file', action='store_true', help='With several input files, write the retained particles of each file to <outfile-rootname>_<file name>.cs instead of concatenating them into <outfile-rootname>.cs.')
+    parser.add_argument('--num-workers', type=int, help='Number of processes for filtering several input files. Default is the number of CPUs.')
+    parser.add_argument('--plan', action='store_true', help='Only report the sizes, the retention estimated on sampled particles and the order of magnitude of the memory and runtime, without filtering anything.')
+    parser.add_argument('--plan-sample-size', type=int, default=plan.DEFAULT_SAMPLE_SIZE, help='Number of particles sampled over all input files for --plan.')
+    parser.add_argument('--metrics-json', type=str, help='Write timing, throughput and memory of each processing phase to this JSON file.')
     parser.add_argument('--overwrite', action='store_true', help='Allow overwriting output files.')
 
     args = parser.parse_args()
@@ -32,58 +37,276 @@ def parse_args():
     return args
 
 
-def main(infile: str, infile_passthrough: str, outfile_rootname: str, target: str, sigma: float, minval: float, maxval: float, overwrite: bool) -> None:
-    assert os.path.exists(infile), f'Input file {infile} does not exist.'
+def gather_retained(inreader: csio.CsReader, mask: np.ndarray, infile_passthrough: Optional[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Retained rows, joined with the passthrough file if given, and the mask of rows actually output."""
+    if infile_passthrough is None:
+        return inreader.memmap[mask], mask
+    # Only the retained rows of the input and passthrough files are gathered, aligned on uid.
+    inpassthrough = csio.open_cs(infile_passthrough)
+    retained_idx = np.flatnonzero(mask)
+    found, passthrough_idx = records.match_uids(inreader.memmap['uid'][retained_idx], inpassthrough['uid'])
+    if len(found) < len(retained_idx):
+        print(f'{len(retained_idx) - len(found)} retained particles are not in {infile_passthrough} and were dropped.')
+    outarr = records.gather_join(inreader.memmap, retained_idx[found], inpassthrough, passthrough_idx)
+    mask = np.zeros(len(mask), dtype=bool)
+    mask[retained_idx[found]] = True
+    return outarr, mask
 
-    indata = dataset.Dataset().load(infile)
-    inarr = indata.to_records()
-    assert target in inarr.dtype.names, f'Target {target} does not exist in {infile}.'
-
-    if infile_passthrough is not None:
-        assert os.path.exists(infile_passthrough), f'Input passthrough file {infile_passthrough} does not exist.'
-        indatapassthrough = dataset.Dataset().load(infile_passthrough)
-        indata = indata.innerjoin(indatapassthrough)
-
-    dat = inarr[target]
-    dat_stat = scipy.stats.describe(dat)
 
+def target_clause(target: str, sigma: Optional[float], minval: Optional[float], maxval: Optional[float]) -> filterexpr.Clause:
+    """--target/--sigma/--minval/--maxval as a filter clause."""
     if sigma is not None and (minval is not None or maxval is not None):
         sys.exit('--sigma and (--minval or --maxval) cannot be specified at once.')
-
     if sigma is not None:
-        minval = dat_stat.mean - sigma * np.sqrt(dat_stat.variance)
-        maxval = dat_stat.mean + sigma * np.sqrt(dat_stat.variance)
-        print(f'Automatically sets (min, max) = ({minval}, {maxval})')
-
+        return filterexpr.Clause(f'sigma({target}, {sigma:g})', target, 'sigma', sigma=sigma)
     if minval is None:
         minval = sys.float_info.min
     if maxval is None:
         maxval = sys.float_info.max
+    return filterexpr.Clause(f'range({target}, {minval:g}, {maxval:g})', target, 'range', minval=minval, maxval=maxval)
 
-    outhist = f'{outfile_rootname}_hist.png'
-    if not overwrite and os.path.exists(outhist):
-        sys.exit(f'{outhist} already exists. --overwrite for overwriting output files.')
-    mask = (minval <= dat) & (dat <= maxval)
-    dat_out = dat[mask]
-    dat_out_stat = scipy.stats.describe(dat_out)
-    fig, ax = plt.subplots(layout='constrained')
-    ax.hist(dat_out, bins='auto')
-    ax.set_xlabel(target)
-    ax.set_ylabel('Frequency')
-    ax.text(
-        0.99, 0.99,
-        f'Mean {dat_out_stat.mean:.6f}\nMin {dat_out_stat.minmax[0]:.6f}\nMax {dat_out_stat.minmax[1]:.6f}\nStdev {np.sqrt(dat_out_stat.variance):.6f}\n#Ptcls {dat_out_stat.nobs}',
-        va='top', ha='right', transform=ax.transAxes
-    )
-    plt.savefig(outhist)
-    print(f'Output histogram is saved as {outhist}')
 
-    outfile = f'{outfile_rootname}.cs'
-    outdataset = dataset.Dataset(inarr[mask])
-    outdataset.save(outfile)
-    print(f'Output dataset is saved as {outfile}')
+def build_clauses(target: Optional[str], sigma: Optional[float], minval: Optional[float], maxval: Optional[float], filter_expr: Optional[str]) -> List[filterexpr.Clause]:
+    if filter_expr is None:
+        return [target_clause(target, sigma, minval, maxval)]
+    try:
+        return filterexpr.parse_filter(filter_expr)
+    except filterexpr.FilterSyntaxError as err:
+        sys.exit(str(err))
+
+
+def check_clause_fields(infiles: List[str], infiles_passthrough: Optional[List[str]], clauses: List[filterexpr.Clause]) -> None:
+    """Every clause field must be a scalar field of each input file or, failing that, of its passthrough file."""
+    passthroughs = infiles_passthrough if infiles_passthrough is not None else [None] * len(infiles)
+    for path, passthrough in zip(infiles, passthroughs):
+        headers = [csio.read_header(path)] + ([csio.read_header(passthrough)] if passthrough is not None else [])
+        for field in dict.fromkeys(clause.field for clause in clauses):
+            header = next((header for header in headers if field in header.names), None)
+            if header is None:
+                sys.exit(f'Field {field} does not exist in {path}' + (f' or {passthrough}.' if passthrough is not None else '.'))
+            if header.dtype.fields[field][0].shape != ():
+                sys.exit(f'Field {field} is not a scalar field.')
+
+
+def iter_clause_columns(
+    infile: str, infile_passthrough: Optional[str], fields: List[str], chunk_size: Optional[int]
+) -> Iterator[Tuple[Union[slice, np.ndarray], Dict[str, np.ndarray]]]:
+    """Columns of ``fields`` over chunks of ``chunk_size`` rows of the input file (all rows at once if None), with their rows.
+
+    Fields which the input file does not have are taken from the passthrough file, aligned on uid. Then
+    only the rows found in the passthrough file are yielded, as the others are dropped from the output anyway.
+    """
+    inreader = csio.CsReader(infile)
+    chunk_size = chunk_size or max(len(inreader), 1)
+    passthrough_fields = [field for field in fields if field not in inreader]
+    if len(passthrough_fields) == 0:
+        start = 0
+        for chunk in csio.iter_chunks(infile, chunk_size, fields):
+            yield slice(start, start + len(chunk)), {field: chunk[field] for field in fields}
+            start += len(chunk)
+        return
+    inpassthrough = csio.open_cs(infile_passthrough)
+    found, passthrough_idx = records.match_uids(inreader.memmap['uid'], inpassthrough['uid'])
+    for start in range(0, max(len(found), 1), chunk_size):
+        rows = found[start:start + chunk_size]
+        columns = {
+            field: np.asarray(inreader.memmap[field][rows] if field in inreader else inpassthrough[field][passthrough_idx[start:start + chunk_size]])
+            for field in fields
+        }
+        yield rows, columns
+
+
+def file_field_stats(infile: str, infile_passthrough: Optional[str], fields: List[str], chunk_size: Optional[int]) -> Dict[str, streaming.StreamingStats]:
+    """Partial statistics of ``fields`` of one input file, for sigma() thresholds over all input files."""
+    accumulators = {field: streaming.StreamingStats() for field in fields}
+    for _, columns in iter_clause_columns(infile, infile_passthrough, fields, chunk_size or csio.DEFAULT_CHUNK_SIZE):
+        for field in fields:
+            accumulators[field].update(columns[field])
+    return accumulators
+
+
+def filter_file(
+    infile: str, infile_passthrough: Optional[str], clauses: List[filterexpr.Clause], outfile: Optional[str], chunk_size: Optional[int]
+) -> Tuple[int, int, Dict[str, int], Union[Dict[str, np.ndarray], Dict[str, streaming.StreamingStats]], Optional[np.ndarray], Optional[np.ndarray]]:
+    """Filter one input file with thresholds already resolved over all input files.
+
+    The mask is evaluated over chunks of ``chunk_size`` rows (all rows at once if None). Returns the numbers
+    of input and output particles, the rejections of each clause, the filtered fields of the retained
+    particles (their values if ``chunk_size`` is None, otherwise their partial statistics together with the
+    mask of retained rows for an exact histogram pass) and, if ``outfile`` is None, the retained rows.
+    """
+    inreader = csio.CsReader(infile)
+    fields = list(dict.fromkeys(clause.field for clause in clauses))
+    mask = np.zeros(len(inreader), dtype=bool)
+    rejected = dict.fromkeys((clause.text for clause in clauses), 0)
+    out_stats = {field: streaming.StreamingStats() for field in fields}
+    out_values = {}
+    num_evaluated = 0
+    for rows, columns in iter_clause_columns(infile, infile_passthrough, fields, chunk_size):
+        num_rows = len(next(iter(columns.values())))
+        num_evaluated += num_rows
+        chunk_mask, chunk_rejected = filterexpr.evaluate(clauses, columns.__getitem__, num_rows)
+        mask[rows] = chunk_mask
+        for text, num in chunk_rejected.items():
+            rejected[text] += num
+        for field in fields:
+            if chunk_size is None:
+                out_values[field] = columns[field][chunk_mask]
+            else:
+                out_stats[field].update(columns[field][chunk_mask])
+    if num_evaluated < len(inreader):
+        print(f'{len(inreader) - num_evaluated} particles of {infile} are not in {infile_passthrough} and were dropped.')
+    outarr, mask = gather_retained(inreader, mask, infile_passthrough)
+    if outfile is not None:
+        csio.save_dataset(outfile, outarr)
+        outarr = None
+    if chunk_size is None:
+        out_values = {field: out_values.get(field, np.zeros(0)) for field in fields}
+        return len(inreader), int(np.count_nonzero(mask)), rejected, out_values, None, outarr
+    return len(inreader), int(np.count_nonzero(mask)), rejected, out_stats, mask, outarr
+
+
+def retained_histograms(
+    infile: str, infile_passthrough: Optional[str], fields: List[str], chunk_size: int, mask: np.ndarray,
+    hist_ranges: Dict[str, Tuple[float, float, int]]
+) -> Dict[str, streaming.FixedHistogram]:
+    """Exact histograms of ``fields`` of the retained particles of one input file, in a second pass over chunks."""
+    hists = {field: streaming.FixedHistogram(*hist_ranges[field]) for field in fields}
+    for rows, columns in iter_clause_columns(infile, infile_passthrough, fields, chunk_size):
+        for field in fields:
+            hists[field].update(columns[field][mask[rows]])
+    return hists
+
+
+def retained_field_stats(
+    infiles: List[str], infiles_passthrough: Optional[List[str]], fields: List[str], chunk_size: Optional[int],
+    results: list, num_workers: Optional[int]
+) -> List[stats.ColumnStats]:
+    """Statistics and exact histograms of ``fields`` of the retained particles of all input files.
+
+    Without ``chunk_size`` these are computed on the retained values at once, as for a single file. Otherwise
+    the histograms take a second pass over the input files on the range of the merged statistics.
+    """
+    if chunk_size is None:
+        return stats.describe_columns({field: np.concatenate([result[3][field] for result in results]) for field in fields}, quantiles=[])
+    out_stats = streaming.merge_stats(result[3] for result in results)
+    hist_ranges = {field: out_stats[field].histogram_range() for field in fields}
+    passthroughs = infiles_passthrough if infiles_passthrough is not None else [None] * len(infiles)
+    jobs = [(path, passthrough, fields, chunk_size, result[4], hist_ranges) for path, passthrough, result in zip(infiles, passthroughs, results)]
+    streaming.set_histograms(out_stats, fanin.imap(retained_histograms, jobs, num_workers))
+    return [out_stats[field].to_column_stats(field, quantiles=[]) for field in fields]
+
+
+def filter_files(
+    infiles: List[str], infiles_passthrough: Optional[List[str]], outfile_rootname: str, clauses: List[filterexpr.Clause],
+    outhists: Dict[str, str], overwrite: bool, chunk_size: Optional[int], per_file: bool, num_workers: Optional[int],
+    run_metrics: metrics.Metrics
+) -> None:
+    """Filter the input files with thresholds computed over all of their particles.
+
+    sigma() thresholds come from moments merged over per-file partial statistics, then every file is
+    filtered, in worker processes if there are several. The retained particles are written to one
+    (concatenated) file or, with ``per_file``, to one file per input.
+    """
+    num_in = sum(csio.read_header(path).num_items for path in infiles)
+    if per_file and len(infiles) > 1:
+        outfiles = [f'{outfile_rootname}_{label}.cs' for label in fanin.file_labels(infiles)]
+    else:
+        outfiles = [f'{outfile_rootname}.cs']
+        per_file = False
+    for outfile in outfiles + list(outhists.values()):
+        if not overwrite and os.path.exists(outfile):
+            sys.exit(f'{outfile} already exists. --overwrite for overwriting output files.')
+
+    sigma_fields = list(dict.fromkeys(clause.field for clause in clauses if clause.kind == 'sigma'))
+    if len(sigma_fields) > 0:
+        with run_metrics.phase('statistics', rows=num_in):
+            passthroughs = infiles_passthrough if infiles_passthrough is not None else [None] * len(infiles)
+            jobs = [(path, passthrough, sigma_fields, chunk_size) for path, passthrough in zip(infiles, passthroughs)]
+            merged = streaming.merge_stats(run_metrics.progress(fanin.imap(file_field_stats, jobs, num_workers), len(jobs), 'Files'))
+        clauses = filterexpr.resolve_sigma(clauses, {field: (merged[field].moments.mean, np.sqrt(merged[field].moments.variance)) for field in sigma_fields})
+        for clause in clauses:
+            if clause.sigma is not None:
+                print(f'{clause.text} : automatically sets (min, max) = ({clause.minval}, {clause.maxval})')
+
+    with run_metrics.phase('filter', rows=num_in):
+        passthroughs = infiles_passthrough if infiles_passthrough is not None else [None] * len(infiles)
+        file_outfiles = outfiles if per_file else [None] * len(infiles)
+        jobs = [(path, passthrough, clauses, outfile, chunk_size) for path, passthrough, outfile in zip(infiles, passthroughs, file_outfiles)]
+        results = list(run_metrics.progress(fanin.imap(filter_file, jobs, num_workers), len(jobs), 'Files'))
+
+    if len(infiles) > 1:
+        print('Particles retained in each file:')
+        for path, result in zip(infiles, results):
+            print(f'\t{path} : {result[0]} -> {result[1]}')
+    rejected = dict.fromkeys((clause.text for clause in clauses), 0)
+    for result in results:
+        for text, num in result[2].items():
+            rejected[text] += num
+    print('Particles rejected by each clause:')
+    for text, num in rejected.items():
+        print(f'\t{text} : {num} ({num / max(num_in, 1) * 100:.1f} %)')
+
+    if not per_file:
+        with run_metrics.phase('save') as phase:
+            outarr = records.concatenate([result[5] for result in results]) if len(results) > 1 else results[0][5]
+            phase.rows = len(outarr)
+            csio.save_dataset(outfiles[0], outarr)
+    for outfile in outfiles:
+        print(f'Output dataset is saved as {outfile}')
+
+    hist_stats = retained_field_stats(infiles, infiles_passthrough, list(outhists), chunk_size, results, num_workers)
+    plotting.render_many([
+        (outhist, column_stats.name, column_stats.hist_counts, column_stats.hist_edges, column_stats.text())
+        for outhist, column_stats in zip(outhists.values(), hist_stats)
+    ], num_workers=num_workers)
+    for outhist in outhists.values():
+        print(f'Output histogram is saved as {outhist}')
+
+    num_out = sum(result[1] for result in results)
+    print(f'Num particles {num_in} -> {num_out} ({num_in - num_out} particles = {(num_in - num_out) / max(num_in, 1) * 100:.1f} % were discarded.)')
+
+
+def main(
+    infile: Union[str, List[str]], infile_passthrough: Optional[Union[str, List[str]]], outfile_rootname: str, target: str,
+    sigma: float, minval: float, maxval: float, overwrite: bool, chunk_size: Optional[int] = None, filter_expr: Optional[str] = None,
+    metrics_json: Optional[str] = None, per_file: bool = False, num_workers: Optional[int] = None,
+    plan_only: bool = False, plan_sample_size: int = plan.DEFAULT_SAMPLE_SIZE
+) -> None:
+    infiles = csio.expand_paths([infile] if isinstance(infile, str) else infile)
+    if len(infiles) == 0:
+        sys.exit(f'No input files match {infile}')
+    for path in infiles:
+        if not os.path.exists(path):
+            sys.exit(f'Input file {path} does not exist.')
+    if (target is None) == (filter_expr is None):
+        sys.exit('Specify either --target or --filter.')
+    if filter_expr is not None and (sigma is not None or minval is not None or maxval is not None):
+        sys.exit('--filter cannot be combined with --sigma, --minval or --maxval.')
+
+    infiles_passthrough = None
+    if infile_passthrough is not None:
+        infiles_passthrough = csio.expand_paths([infile_passthrough] if isinstance(infile_passthrough, str) else infile_passthrough)
+        if len(infiles_passthrough) != len(infiles):
+            sys.exit(f'{len(infiles_passthrough)} passthrough files were given for {len(infiles)} input files. Give one passthrough file per input file, in the same order.')
+        for path in infiles_passthrough:
+            if not os.path.exists(path):
+                sys.exit(f'Input passthrough file {path} does not exist.')
+
+    # --target/--sigma/--minval/--maxval is a single clause, with the histogram named as before filter expressions.
+    clauses = build_clauses(target, sigma, minval, maxval, filter_expr)
+    if plan_only:
+        print(plan.filter_plan(infiles, infiles_passthrough, clauses, chunk_size, plan_sample_size).report())
+        return
+    check_clause_fields(infiles, infiles_passthrough, clauses)
+    if filter_expr is None:
+        outhists = {target: f'{outfile_rootname}_hist.png'}
+    else:
+        outhists = {field: f'{outfile_rootname}_{field.replace("/", "_")}_hist.png' for field in dict.fromkeys(clause.field for clause in clauses)}
 
-    print(f'Num particles {dat_stat.nobs} -> {dat_out_stat.nobs} ({dat_stat.nobs - dat_out_stat.nobs} particles = {(dat_stat.nobs - dat_out_stat.nobs) / dat_stat.nobs * 100:.1f} % were discarded.)')
+    run_metrics = metrics.Metrics('csutil_particle_filtering.py', metrics_json)
+    filter_files(infiles, infiles_passthrough, outfile_rootname, clauses, outhists, overwrite, chunk_size, per_file, num_workers, run_metrics)
+    run_metrics.finish()
 
 
 if __name__ == '__main__':
@@ -96,5 +319,12 @@ if __name__ == '__main__':
         args.sigma,
         args.minval,
         args.maxval,
-        args.overwrite
+        args.overwrite,
+        args.chunk_size,
+        args.filter,
+        args.metrics_json,
+        args.per_file,
+        args.num_workers,
+        args.plan,
+        args.plan_sample_size
     )
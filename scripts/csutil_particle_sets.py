@@ -0,0 +1,144 @@
+"""Set operations (union, intersect, difference) on particle .cs files.
+
+Particles are matched by uid, or by the (blob path basename without UUID prefixes, blob/idx) key used by
+csutil_transfer_alignments3d.py. The output .cs file comes with a .csg file for Import Result Group.
+"""
+
+import sys
+import os
+import argparse
+from typing import List, Optional
+import numpy as np
+from csutil_lib import blobkey, csg, csio, metrics, records, setops
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description=__doc__
+    )
+    parser.add_argument('--operation', type=str, choices=setops.OPERATIONS, required=True, help='union: particles in any input file (each once, from the first file that has it). intersect: particles of the first file which are in all other files. difference: particles of the first file which are in none of the other files.')
+    parser.add_argument('--infile', nargs='+', type=str, required=True, help='Input cs files. Glob patterns and directories (all *.cs files in them) are accepted. The order matters for intersect and difference.')
+    parser.add_argument('--outfile', type=str, required=True, help='Output cs file. The csg file is written next to it with the extension .csg')
+    parser.add_argument('--match-by', type=str, choices=['uid', 'blob'], default='uid', help='Match particles by uid or by (blob path basename, blob/idx).')
+    parser.add_argument('--num-remove-blobpath-uuid', nargs='+', type=int, default=[1], help='Preceding UUID strings removed from the blob paths for --match-by blob. One value for all files or one per input file.')
+    parser.add_argument('--csg', type=str, help='csg file used as the template of the output csg file, e.g. the csg file of the first input. Default is a minimal particle result group.')
+    parser.add_argument('--index-cache-dir', type=str, help='Directory for the cached blob key indexes. Default is next to each input file.')
+    parser.add_argument('--no-index-cache', action='store_true', help='Neither read nor write the cached blob key indexes.')
+    parser.add_argument('--metrics-json', type=str, help='Write timing, throughput and memory of each processing phase to this JSON file.')
+    parser.add_argument('--overwrite', action='store_true', help='Allow overwriting output files.')
+
+    args = parser.parse_args()
+
+    print('##### Command #####\n\t' + ' '.join(sys.argv))
+    args_print_str = '##### Input parameters #####\n'
+    for opt, val in vars(args).items():
+        args_print_str += '\t{} : {}\n'.format(opt, val)
+    print(args_print_str)
+    return args
+
+
+def load_keys(infiles: List[str], match_by: str, num_remove_uuid: List[int], index_cache_dir: Optional[str], use_cache: bool) -> List[np.ndarray]:
+    """Keys of every input file, comparable across the files."""
+    if match_by == 'uid':
+        return [csio.load_fields(path, ['uid'])['uid'] for path in infiles]
+    indexes = []
+    for path, n in zip(infiles, num_remove_uuid):
+        index, cached = blobkey.load_key_index(path, n, cache_dir=index_cache_dir, use_cache=use_cache)
+        if cached:
+            print(f'Loaded the cached blob key index of {path}.')
+        indexes.append(index)
+    return blobkey.shared_keys(indexes)
+
+
+def main(
+    operation: str, infile: List[str], outfile: str, match_by: str = 'uid', num_remove_uuid: Optional[List[int]] = None,
+    template_csg: Optional[str] = None, index_cache_dir: Optional[str] = None, use_cache: bool = True,
+    overwrite: bool = False, metrics_json: Optional[str] = None
+) -> None:
+    infiles = csio.expand_paths(infile)
+    if len(infiles) < 2 and operation != 'union':
+        sys.exit(f'{operation} needs at least two input files.')
+    for path in infiles:
+        assert os.path.exists(path), f'Input file {path} does not exist.'
+    if num_remove_uuid is None:
+        num_remove_uuid = [1]
+    if len(num_remove_uuid) == 1:
+        num_remove_uuid = num_remove_uuid * len(infiles)
+    if len(num_remove_uuid) != len(infiles):
+        sys.exit(f'{len(num_remove_uuid)} values of --num-remove-blobpath-uuid were given for {len(infiles)} input files.')
+
+    outcsg = os.path.splitext(outfile)[0] + '.csg'
+    for path in (outfile, outcsg):
+        if not overwrite and os.path.exists(path):
+            sys.exit(f'Output file {path} already exists. Specify --overwrite to overwrite.')
+
+    headers = [csio.read_header(path) for path in infiles]
+    key_fields = ['uid'] if match_by == 'uid' else ['blob/path', 'blob/idx']
+    for path, header in zip(infiles, headers):
+        csio.check_fields(header.names, key_fields, path)
+
+    run_metrics = metrics.Metrics('csutil_particle_sets.py', metrics_json)
+    with run_metrics.phase('keys', rows=sum(header.num_items for header in headers)):
+        keys = load_keys(infiles, match_by, num_remove_uuid, index_cache_dir, use_cache)
+    for path, file_keys in zip(infiles, keys):
+        num_dup = setops.num_duplicates(file_keys)
+        print(f'{path} : {len(file_keys)} particles' + (f' ({num_dup} with a duplicate {match_by} key)' if num_dup > 0 else ''))
+
+    with run_metrics.phase(operation) as phase:
+        if operation == 'union':
+            rows = setops.union(keys)
+        elif operation == 'intersect':
+            rows = [setops.intersect(keys)] + [np.zeros(0, dtype=np.int64)] * (len(infiles) - 1)
+        else:
+            rows = [setops.difference(keys)] + [np.zeros(0, dtype=np.int64)] * (len(infiles) - 1)
+        phase.rows = sum(len(r) for r in rows)
+    del keys
+
+    with run_metrics.phase('gather') as phase:
+        used = [i for i, r in enumerate(rows) if len(r) > 0] or [0]
+        fields = [name for name in headers[used[0]].names if all(name in headers[i].names for i in used)]
+        if any(len(headers[i].names) != len(fields) for i in used):
+            print(f'Only the {len(fields)} fields common to all contributing input files are written.')
+        parts = [csio.project(csio.open_cs(infiles[i])[rows[i]], fields) for i in used]
+        outarr = parts[0] if len(parts) == 1 else records.concatenate(parts)
+        phase.rows = len(outarr)
+    for path, r in zip(infiles, rows):
+        if operation == 'union':
+            print(f'\t{len(r)} particles from {path}')
+
+    with run_metrics.phase('save', rows=len(outarr)):
+        csio.save_dataset(outfile, outarr)
+    print(f'Output dataset ({len(outarr)} particles) is saved as {outfile}')
+
+    description = f'Created by csutil_particle_sets.py ({operation} by {match_by}) of https://github.com/kttn8769/cryosparc_utils.git'
+    output_results = csg.result_names(outarr.dtype.names)
+    if template_csg is not None:
+        doc = csg.CsgDocument.read(template_csg)
+        doc.set(('group', 'description'), description)
+        for name in output_results:
+            doc.set_result(name, metafile=os.path.basename(outfile), num_items=len(outarr), result_type=None if name in doc.results else f'particle.{name}')
+        for name in [name for name in doc.results if name not in output_results]:
+            print(f'Result {name} of {template_csg} is not in the output dataset and removed.')
+            doc.remove(('results', name))
+        doc.write(outcsg)
+    else:
+        csg.save_csg(outcsg, csg.new_csg(os.path.basename(outfile), len(outarr), output_results, description))
+    print(f'The accompanying csg file {outcsg}. Use this file for the input of Import Result Group job in cryoSPARC.')
+    run_metrics.finish()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    main(
+        args.operation,
+        args.infile,
+        args.outfile,
+        args.match_by,
+        args.num_remove_blobpath_uuid,
+        args.csg,
+        args.index_cache_dir,
+        not args.no_index_cache,
+        args.overwrite,
+        args.metrics_json
+    )
@@ -1,8 +1,9 @@
 import sys
 import os
 import argparse
-import re
-from cryosparc_compute import dataset
+import functools
+from typing import List, Optional
+from csutil_lib import csg, csio, metrics
 
 
 def parse_args():
@@ -10,9 +11,13 @@ def parse_args():
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
         description=__doc__
     )
-    parser.add_argument('--infile', type=str, required=True, help='Input csg file.')
-    parser.add_argument('--outfile', type=str, required=True, help='Output csg file.')
-    parser.add_argument('--metafile', type=str, required=True, help='Metafile .cs file to replace with.')
+    parser.add_argument('--infile', type=str, nargs='+', required=True, help='Input csg file(s). Glob patterns and directories (all *.csg files in them) are accepted.')
+    parser.add_argument('--outfile', type=str, help='Output csg file. Only for a single input file.')
+    parser.add_argument('--outdir', type=str, help='Output directory for multiple input files. Output files have the same names as the input files.')
+    parser.add_argument('--metafile', type=str, help='Metafile .cs file to replace with.')
+    parser.add_argument('--metafile-dir', type=str, help='Replace the directory of every metafile with this one, keeping the file names. Alternative to --metafile.')
+    parser.add_argument('--num-workers', type=int, default=8, help='Number of threads for processing multiple files.')
+    parser.add_argument('--metrics-json', type=str, help='Write timing, throughput and memory of each processing phase to this JSON file.')
     parser.add_argument('--overwrite', action='store_true', help='Allow overwriting output files.')
 
     args = parser.parse_args()
@@ -25,28 +30,63 @@ def parse_args():
     return args
 
 
-def main(infile: str, outfile: str, metafile: str, overwrite: bool) -> None:
-    assert os.path.exists(infile), f'Input file {infile} not exist'
-    if not overwrite and os.path.exists(outfile):
-        sys.exit(f'Outfile {outfile} already exists. Specify --overwrite to overwrite.')
+@functools.lru_cache(maxsize=None)
+def num_items_of(path: str) -> int:
+    # Only the .npy header is read.
+    return csio.read_header(path).num_items
 
-    metadata = dataset.Dataset().load(metafile)
-    num_ptcls = len(metadata)
 
-    with open(infile) as f:
-        inlines = f.readlines()
+def process(infile: str, outfile: str, metafile: Optional[str], metafile_dir: Optional[str]) -> int:
+    doc = csg.CsgDocument.read(infile)
+    if metafile is not None:
+        new_metafile = lambda path: metafile
+    else:
+        new_metafile = lambda path: os.path.join(metafile_dir, os.path.basename(path))
+    num_edited = csg.repoint_results(doc, new_metafile, lambda path: num_items_of(csg.resolve_metafile(outfile, path)))
+    doc.write(outfile)
+    return num_edited
 
-    outlines = []
-    for line in inlines:
-        if 'metafile' in line:
-            line = re.sub(r"(\s*metafile:\s*'>)(.+\.cs)'", f'\\g<1>{metafile}\'', line)
-        elif 'num_items' in line:
-            line = re.sub(r"(\s*num_items:\s*)([0-9]+)", f'\\g<1>{num_ptcls}', line)
-        outlines.append(line)
 
-    with open(outfile, 'w') as f:
-        f.writelines(outlines)
-    print(f'Output file saved as {outfile}')
+def main(infile: List[str], outfile: Optional[str], metafile: Optional[str], overwrite: bool, outdir: Optional[str] = None, metafile_dir: Optional[str] = None, num_workers: int = 8, metrics_json: Optional[str] = None) -> None:
+    if isinstance(infile, str):
+        infile = [infile]
+    infiles = csio.expand_paths(infile, '.csg')
+    if len(infiles) == 0:
+        sys.exit(f'No input csg files found: {infile}')
+    for f in infiles:
+        assert os.path.exists(f), f'Input file {f} not exist'
+    if (metafile is None) == (metafile_dir is None):
+        sys.exit('Specify either --metafile or --metafile-dir.')
+
+    if outfile is not None:
+        if len(infiles) > 1:
+            sys.exit('--outfile can only be used with a single input file. Use --outdir for multiple input files.')
+        outfiles = [outfile]
+    elif outdir is not None:
+        os.makedirs(outdir, exist_ok=True)
+        outfiles = [os.path.join(outdir, os.path.basename(f)) for f in infiles]
+        if len(set(outfiles)) < len(outfiles):
+            sys.exit('Input files with the same name cannot be written to one --outdir.')
+    else:
+        sys.exit('Specify either --outfile or --outdir.')
+
+    for f in outfiles:
+        if not overwrite and os.path.exists(f):
+            sys.exit(f'Outfile {f} already exists. Specify --overwrite to overwrite.')
+
+    run_metrics = metrics.Metrics('csutil_replace_metafile.py', metrics_json)
+    with run_metrics.phase('replace', rows=len(infiles)):
+        if len(infiles) == 1:
+            num_edited = process(infiles[0], outfiles[0], metafile, metafile_dir)
+            print(f'Output file saved as {outfiles[0]} ({num_edited} results edited)')
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=max(1, num_workers)) as executor:
+                futures = [executor.submit(process, i, o, metafile, metafile_dir) for i, o in zip(infiles, outfiles)]
+                for o, future in zip(outfiles, futures):
+                    num_edited = future.result()
+                    print(f'Output file saved as {o} ({num_edited} results edited)')
+    run_metrics.finish()
 
 
 if __name__ == '__main__':
@@ -55,5 +95,9 @@ if __name__ == '__main__':
         args.infile,
         args.outfile,
         args.metafile,
-        args.overwrite
+        args.overwrite,
+        args.outdir,
+        args.metafile_dir,
+        args.num_workers,
+        args.metrics_json
     )
@@ -1,11 +1,9 @@
 import sys
 import os
 import argparse
-from typing import List
+from typing import List, Optional, Sequence, Tuple, Union
 import numpy as np
-import scipy.stats
-import matplotlib.pyplot as plt
-from cryosparc_compute import dataset
+from csutil_lib import csio, density, fanin, groupby, metrics, plotting, stats, streaming
 
 
 def parse_args():
@@ -13,11 +11,24 @@ def parse_args():
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
         description=__doc__
     )
-    parser.add_argument('--infile', type=str, required=True, help='Input cs file.')
+    parser.add_argument('--infile', nargs='+', type=str, required=True, help='Input cs file(s). Glob patterns and directories (all *.cs files in them) are accepted. Statistics of several files are computed over all of their particles unless --per-file is given. Their quantiles are then estimated from mergeable sketches and are approximate, as with --chunk-size; the histogram counts are exact.')
     parser.add_argument('--outfile-rootname', type=str, help='Root name for output files.')
     parser.add_argument('--targets', nargs='+', type=str, help='Target features to get statistics. Multiple targets can be specified via whitespace separated list.')
     parser.add_argument('--overwrite', action='store_true', help='Allow overwriting output files.')
     parser.add_argument('--num-bins', type=str, default='auto', help='Number of bins for histogram plot. Default "auto"')
+    parser.add_argument('--quantiles', nargs='+', type=float, default=list(stats.DEFAULT_QUANTILES), help='Quantiles reported in the summary.')
+    parser.add_argument('--summary-format', type=str, choices=['json', 'csv', 'none'], default='json', help='Format of the statistics summary file <outfile-rootname>_stats.<format>.')
+    parser.add_argument('--chunk-size', type=int, help='Compute statistics in streaming passes over chunks of this many rows instead of loading the target columns at once. Quantiles are approximate in this mode; histogram counts are exact (from a second pass).')
+    parser.add_argument('--hist-range', nargs=2, type=float, help='Fixed histogram range (min max) for the streaming mode. Requires an integer --num-bins. Default is [min, max] of each target, counted in a second pass over the chunks.')
+    parser.add_argument('--metrics-json', type=str, help='Write timing, throughput and memory of each processing phase to this JSON file.')
+    parser.add_argument('--per-file', action='store_true', help='With several input files, write statistics and plots of each file separately as <outfile-rootname>_<file name>_*.')
+    parser.add_argument('--density', nargs='+', type=str, help='2D density plots of pairs of fields given as <x field>:<y field>, e.g. ctf/df1_A:alignments3D/error. Elements of sub-array fields are given as e.g. alignments3D/pose/0.')
+    parser.add_argument('--viewing-directions', action='store_true', help='Plot the azimuth/elevation density of the viewing directions of alignments3D/pose.')
+    parser.add_argument('--density-bins', type=int, default=100, help='Number of bins along each axis of the density plots.')
+    parser.add_argument('--group-by', type=str, help='Compute statistics of every group of particles instead of all particles, and write them as <outfile-rootname>_groups.csv. "micrograph" (location/micrograph_path), "blob" (blob/path basename), "exp_group" (ctf/exp_group_id) or any other field.')
+    parser.add_argument('--outlier-threshold', type=float, help='With --group-by, flag groups whose statistics are outliers among all groups (|robust z-score| above this value, e.g. 3.5) and list them in <outfile-rootname>_outlier_groups.txt.')
+    parser.add_argument('--outlier-stats', nargs='+', type=str, choices=groupby.OUTLIER_STATS, default=['count', 'mean'], help='Per-group statistics of the targets checked for outliers. "count" is the number of particles of the group.')
+    parser.add_argument('--num-workers', type=int, help='Number of processes for reading input files and rendering plots. Default is the number of CPUs.')
 
     args = parser.parse_args()
 
@@ -29,8 +40,75 @@ def parse_args():
     return args
 
 
-def main(infile: str, outfile_rootname: str, overwrite: bool, num_bins: str, targets: List[str]) -> None:
-    assert os.path.exists(infile), f'Input file {infile} not exist'
+def group_stats(
+    infiles: List[str], outfile_rootname: str, targets: List[str], group_by: str, quantiles: Sequence[float],
+    outlier_threshold: Optional[float], outlier_stats: Sequence[str], overwrite: bool, run_metrics: metrics.Metrics
+) -> None:
+    """Statistics of the targets in every group (e.g. micrograph), written as <outfile-rootname>_groups.csv.
+
+    With ``outlier_threshold``, groups whose count or per-group statistics of any target are outliers among
+    the groups (robust z-score) are flagged and listed in <outfile-rootname>_outlier_groups.txt.
+    """
+    field = groupby.group_field(group_by)
+    for path in infiles:
+        if field not in csio.read_header(path).names:
+            sys.exit(f'No such group field: {field} in {path}.')
+    outtable = f'{outfile_rootname}_groups.csv'
+    outlist = f'{outfile_rootname}_outlier_groups.txt'
+    for outfile in [outtable] + ([outlist] if outlier_threshold is not None else []):
+        if not overwrite and os.path.exists(outfile):
+            sys.exit(f'Abort processing because the output file {outfile} already exists. Specify --overwrite to overwrite.')
+
+    with run_metrics.phase('load') as phase:
+        # Groups may span several input files, so the columns of all files are concatenated.
+        parts = [csio.load_fields(path, [field] + targets) for path in infiles]
+        arr = parts[0] if len(parts) == 1 else np.concatenate([csio.project(part, [field]) for part in parts])
+        labels = groupby.group_labels(group_by, arr[field])
+        columns = {}
+        for target in targets:
+            col = parts[0][target] if len(parts) == 1 else np.concatenate([part[target] for part in parts])
+            columns.update(stats.expand_columns(target, col))
+        del parts, arr
+        phase.rows = len(labels)
+
+    with run_metrics.phase('group_statistics', rows=len(labels)):
+        groups = groupby.Groups(labels)
+        del labels
+        table = {'count': groups.counts}
+        for name, col in columns.items():
+            for stat, values in groups.aggregate(col, quantiles).items():
+                if stat != 'count':
+                    table[f'{name}_{stat}'] = values
+    print(f'{len(groups)} groups by {field}')
+
+    if outlier_threshold is not None:
+        flag_columns = [stat if stat == 'count' else f'{name}_{stat}' for stat in outlier_stats for name in (['count'] if stat == 'count' else columns)]
+        flagged, reasons = groupby.flag_outliers(table, flag_columns, outlier_threshold)
+        table['outlier'] = flagged
+        table['outlier_reasons'] = np.array(reasons, dtype=object)
+        with open(outlist, 'w') as f:
+            for label in groups.labels[flagged]:
+                f.write(f'{label}\n')
+        num_flagged_ptcls = int(groups.counts[flagged].sum())
+        print(f'{int(flagged.sum())} outlier groups ({num_flagged_ptcls} particles) are listed in {outlist}')
+
+    groupby.write_table(outtable, groups.labels, table, group_name=field)
+    print(f'Group statistics are saved as {outtable}')
+
+
+def main(
+    infile: Union[str, List[str]], outfile_rootname: str, overwrite: bool, num_bins: str, targets: List[str],
+    quantiles: Sequence[float] = stats.DEFAULT_QUANTILES, summary_format: str = 'json', num_workers: Optional[int] = None,
+    chunk_size: Optional[int] = None, hist_range: Optional[Tuple[float, float]] = None, metrics_json: Optional[str] = None,
+    per_file: bool = False, group_by: Optional[str] = None, outlier_threshold: Optional[float] = None,
+    outlier_stats: Sequence[str] = ('count', 'mean'), densities: Optional[List[str]] = None, viewing_directions: bool = False,
+    density_bins: int = 100
+) -> None:
+    infiles = csio.expand_paths([infile] if isinstance(infile, str) else infile)
+    if len(infiles) == 0:
+        sys.exit(f'No input files match {infile}')
+    for path in infiles:
+        assert os.path.exists(path), f'Input file {path} not exist'
 
     if num_bins == 'auto':
         bins = num_bins
@@ -38,30 +116,107 @@ def main(infile: str, outfile_rootname: str, overwrite: bool, num_bins: str, tar
         try:
             bins = int(num_bins)
         except ValueError as err:
-            print(f'Invalid value for num_bins: {num_bins}  : {err}')
+            sys.exit(f'Invalid value for num_bins: {num_bins}  : {err}')
+    combined = len(infiles) > 1 and not per_file
+    if hist_range is not None and ((chunk_size is None and not combined) or bins == 'auto'):
+        sys.exit('--hist-range requires --chunk-size (or several input files without --per-file) and an integer --num-bins.')
 
-    indata = dataset.Dataset().load(infile)
-    inarr = indata.to_records()
-    for target in targets:
-        if target not in inarr.dtype.names:
-            sys.exit(f'No such target: {target}. Available targets are: {inarr.dtype.names}')
+    run_metrics = metrics.Metrics('csutil_stat.py', metrics_json)
+    headers = [csio.read_header(path) for path in infiles]
+    for path, header in zip(infiles, headers):
+        for target in targets:
+            if target not in header.names:
+                sys.exit(f'No such target: {target} in {path}. Available targets are: {header.names}')
+    specs = list(densities or []) + ([density.VIEWING] if viewing_directions else [])
+    for path, header in zip(infiles, headers):
+        try:
+            density.check_specs(specs, header.names, path)
+        except ValueError as err:
+            sys.exit(str(err))
+    num_rows = sum(header.num_items for header in headers)
 
-        outfile = f'{outfile_rootname}_{target.replace("/", "_")}.png'
-        if not overwrite and os.path.exists(outfile):
-            sys.exit(f'Abort processing because the output file {outfile} already exists. Specify --overwrite to overwrite.')
+    if group_by is not None:
+        group_stats(infiles, outfile_rootname, targets, group_by, quantiles, outlier_threshold, outlier_stats, overwrite, run_metrics)
+        run_metrics.finish()
+        return
+
+    if len(infiles) == 1 or combined:
+        rootnames = [outfile_rootname]
+    else:
+        rootnames = [f'{outfile_rootname}_{label}' for label in fanin.file_labels(infiles)]
+    first = csio.open_cs(infiles[0])
+    names = [name for target in targets for name in stats.expand_columns(target, first[target][:0])]
+    del first
+    outfiles = []
+    for rootname in rootnames:
+        outfiles.append((
+            {name: f'{rootname}_{name.replace("/", "_")}.png' for name in names},
+            f'{rootname}_stats.{summary_format}'
+        ))
+    outdensities = [{spec: f'{rootname}_{density.output_name(spec)}_density.png' for spec in specs} for rootname in rootnames]
+    for (outpngs, outsummary), outdens in zip(outfiles, outdensities):
+        for outfile in list(outpngs.values()) + list(outdens.values()) + ([outsummary] if summary_format != 'none' else []):
+            if not overwrite and os.path.exists(outfile):
+                sys.exit(f'Abort processing because the output file {outfile} already exists. Specify --overwrite to overwrite.')
+
+    with run_metrics.phase('statistics', rows=num_rows):
+        if combined:
+            # Every file is reduced to mergeable partial statistics in a worker process,
+            # which are merged into the statistics of all particles.
+            jobs = [(path, targets, chunk_size or csio.DEFAULT_CHUNK_SIZE, hist_range, bins) for path in infiles]
+            partials = fanin.imap(streaming.file_stats, jobs, num_workers)
+            merged = streaming.merge_stats(run_metrics.progress(partials, len(jobs), 'Files'))
+            # Histograms on [min, max] of all particles are counted exactly in a second pass over the files.
+            hist_ranges = streaming.pending_histogram_ranges(merged)
+            if len(hist_ranges) > 0:
+                jobs = [(path, targets, chunk_size or csio.DEFAULT_CHUNK_SIZE, hist_ranges) for path in infiles]
+                streaming.set_histograms(merged, fanin.imap(streaming.file_histograms, jobs, num_workers))
+            results = [[merged[name].to_column_stats(name, quantiles) for name in names]]
+        else:
+            jobs = [(path, targets, quantiles, bins, chunk_size, hist_range) for path in infiles]
+            results = list(fanin.imap(streaming.describe_file, jobs, num_workers))
+
+    density_results = []
+    if len(specs) > 0:
+        with run_metrics.phase('density', rows=num_rows):
+            # Ranges first, then fixed-range 2D counts of every file, merged per output.
+            density_chunk_size = chunk_size or csio.DEFAULT_CHUNK_SIZE
+            file_ranges = list(fanin.imap(density.file_ranges, [(path, specs, density_chunk_size) for path in infiles], num_workers))
+            output_files = [list(range(len(infiles)))] if len(rootnames) == 1 else [[i] for i in range(len(infiles))]
+            jobs = []
+            for file_indices in output_files:
+                ranges = density.merge_ranges([file_ranges[i] for i in file_indices])
+                jobs.extend((infiles[i], specs, ranges, density_bins, density_chunk_size) for i in file_indices)
+            partials = list(fanin.imap(density.file_densities, jobs, num_workers))
+            start = 0
+            for file_indices in output_files:
+                density_results.append(density.merge_densities(partials[start:start + len(file_indices)]))
+                start += len(file_indices)
+
+    with run_metrics.phase('render'):
+        calls = [
+            (plotting.render_histogram, (outpngs[s.name], s.name, s.hist_counts, s.hist_edges, s.text()))
+            for (outpngs, _), column_stats in zip(outfiles, results) for s in column_stats
+        ]
+        for outdens, hists in zip(outdensities, density_results):
+            for spec, hist in hists.items():
+                xlabel, ylabel = density.parse_spec(spec)
+                calls.append((plotting.render_density, (outdens[spec], xlabel + (' (deg)' if spec == density.VIEWING else ''),
+                                                        ylabel + (' (deg)' if spec == density.VIEWING else ''), hist.counts, hist.xedges, hist.yedges)))
+        plotting.render_calls(calls, num_workers=num_workers)
+        for outdens in outdensities:
+            for outfile in outdens.values():
+                print(f'Density plot is saved as {outfile}')
 
-        dat = inarr[target]
-        stat = scipy.stats.describe(dat)
-        fig, ax = plt.subplots(layout='constrained')
-        ax.hist(dat, bins=bins)
-        ax.set_xlabel(target)
-        ax.set_ylabel('Frequency')
-        ax.text(
-            0.99, 0.99,
-            f'Mean {stat.mean:.6f}\nMin {stat.minmax[0]:.6f}\nMax {stat.minmax[1]:.6f}\nStdev {np.sqrt(stat.variance):.6f}\n#Ptcls {stat.nobs}',
-            va='top', ha='right', transform=ax.transAxes
-        )
-        plt.savefig(outfile)
+    summary_infiles = [infiles] if combined else infiles
+    for (_, outsummary), column_stats, summary_infile in zip(outfiles, results, summary_infiles):
+        if summary_format == 'json':
+            stats.write_summary_json(outsummary, column_stats, summary_infile, quantiles_approximate=combined or chunk_size is not None)
+        elif summary_format == 'csv':
+            stats.write_summary_csv(outsummary, column_stats)
+        if summary_format != 'none':
+            print(f'Statistics summary is saved as {outsummary}')
+    run_metrics.finish()
 
 
 if __name__ == '__main__':
@@ -71,5 +226,18 @@ if __name__ == '__main__':
         args.outfile_rootname,
         args.overwrite,
         args.num_bins,
-        args.targets
+        args.targets,
+        args.quantiles,
+        args.summary_format,
+        args.num_workers,
+        args.chunk_size,
+        args.hist_range,
+        args.metrics_json,
+        args.per_file,
+        args.group_by,
+        args.outlier_threshold,
+        args.outlier_stats,
+        args.density,
+        args.viewing_directions,
+        args.density_bins
     )
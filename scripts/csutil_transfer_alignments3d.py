@@ -5,24 +5,9 @@ import sys
 import os
 import argparse
 import datetime
-import yaml
-import pandas as pd
+from typing import Dict
 import numpy as np
-from cryosparc_compute import dataset
-
-
-def get_blobpath_basename(arr, num_remove_uuid):
-    out_arr = []
-    for s in arr:
-        # Filename
-        s = os.path.basename(s)
-        # Remove file extension
-        s = os.path.splitext(s)[0]
-        s = '_'.join(s.split('_')[num_remove_uuid:])
-        out_arr.append(s)
-    if isinstance(arr, np.ndarray):
-        out_arr = np.array(out_arr)
-    return out_arr
+from csutil_lib import blobkey, csg, csio, metrics, plan, records, rowmap
 
 
 def parse_args():
@@ -37,6 +22,12 @@ def parse_args():
     parser.add_argument('--output_cs_file', required=True, help='Output cs file.'),
     parser.add_argument('--orig_num_remove_blobpath_uuid', type=int, default=1, help='Preceding UUID strings will be removed from blobpaths of the original dataset this many times.')
     parser.add_argument('--imported_num_remove_blobpath_uuid', type=int, default=2, help='Preceding UUID strings will be removed from blobpaths of the imported dataset this many times.')
+    parser.add_argument('--index_cache_dir', help='Directory for the cached blob key index of the original dataset. Default is next to --orig_cs_file.')
+    parser.add_argument('--no_index_cache', action='store_true', help='Neither read nor write the cached blob key index of the original dataset.')
+    parser.add_argument('--incremental', action='store_true', help='Keep the row mapping of the output in <output_cs_file>.rowmap.npz, and when it is there from a previous run with the same original dataset, write only the alignments3D columns of the re-imported particles (same particles in the same order, e.g. after another RELION refinement) into the previous output in place. Falls back to the full transfer if the mapping does not apply. The full transfer replaces an existing output only with --overwrite, or if it is the previous output recorded in the mapping.')
+    parser.add_argument('--plan', action='store_true', help='Only report the sizes, the match coverage estimated on sampled particles, the check of the UUID settings and the order of magnitude of the memory and runtime, without transferring anything.')
+    parser.add_argument('--plan_sample_size', type=int, default=plan.DEFAULT_SAMPLE_SIZE, help='Number of particles sampled from each dataset for --plan.')
+    parser.add_argument('--metrics_json', help='Write timing, throughput and memory of each processing phase to this JSON file.')
     parser.add_argument('--overwrite', action='store_true', help='Allow overwriting output files.')
 
     args = parser.parse_args()
@@ -49,184 +40,182 @@ def parse_args():
     return args
 
 
+def rowmap_files(args) -> Dict[str, str]:
+    return {'orig': args.orig_cs_file, 'passthrough': args.orig_passthrough_file, 'output': args.output_cs_file}
+
+
+def rowmap_settings(args) -> Dict[str, int]:
+    return {'orig_num_remove_uuid': args.orig_num_remove_blobpath_uuid, 'imported_num_remove_uuid': args.imported_num_remove_blobpath_uuid}
+
+
+def is_recorded_output(args, rowmap_file: str) -> bool:
+    """Whether the existing output is the one recorded in a row mapping which applies to the current inputs and settings."""
+    if not os.path.exists(args.output_cs_file):
+        return False
+    mapping = rowmap.RowMap.load(rowmap_file)
+    return mapping is not None and len(mapping.stale(rowmap_files(args), rowmap_settings(args))) == 0
+
+
+def transfer_incremental(args, rowmap_file: str, run_metrics: metrics.Metrics) -> bool:
+    """Write the alignments3D columns of the re-imported dataset into the previous output through its row mapping.
+
+    Returns False, after printing why, if there is no applicable mapping and the full transfer is needed.
+    """
+    mapping = rowmap.RowMap.load(rowmap_file) if os.path.exists(args.output_cs_file) else None
+    if mapping is None:
+        print(f'No row mapping {rowmap_file} of a previous output. Running the full transfer.')
+        return False
+    reasons = mapping.stale(rowmap_files(args), rowmap_settings(args))
+    if len(reasons) == 0:
+        with run_metrics.phase('check', rows=mapping.num_imported):
+            columns = [name for name in csio.read_header(args.imported_cs_file).names if name.startswith('alignments3D/')]
+            try:
+                out = csio.open_cs(args.output_cs_file, mode='r+')
+            except ValueError as err:
+                reasons = [f'{args.output_cs_file} cannot be memory-mapped: {err}']
+            else:
+                reasons = rowmap.check_imported(
+                    mapping, out, args.imported_cs_file, columns, args.orig_num_remove_blobpath_uuid, args.imported_num_remove_blobpath_uuid
+                )
+    if len(reasons) > 0:
+        print('The row mapping of the previous output cannot be used:')
+        for reason in reasons:
+            print(f'\t{reason}')
+        print('Running the full transfer.')
+        return False
+
+    print(f'Writing {", ".join(columns)} of {args.imported_cs_file} into {args.output_cs_file} ...')
+    with run_metrics.phase('scatter', rows=len(out)):
+        rowmap.scatter_columns(out, csio.open_cs(args.imported_cs_file), mapping.imported_idx, columns)
+        if isinstance(out, np.memmap):
+            out.flush()
+    del out
+    mapping.sources['output'] = rowmap.file_source(args.output_cs_file)
+    mapping.save(rowmap_file)
+    print(f'The alignments3D columns of {mapping.num_imported} particles are updated in {args.output_cs_file}. Its csg file is unchanged.')
+    return True
+
+
 def main():
     args = parse_args()
 
-    if not args.overwrite:
+    if args.plan:
+        transfer_plan = plan.transfer_plan(
+            args.orig_cs_file, args.orig_passthrough_file, args.imported_cs_file,
+            args.orig_num_remove_blobpath_uuid, args.imported_num_remove_blobpath_uuid,
+            index_cache_dir=args.index_cache_dir, use_cache=not args.no_index_cache, sample_size=args.plan_sample_size
+        )
+        print(transfer_plan.report())
+        return
+
+    run_metrics = metrics.Metrics('csutil_transfer_alignments3d.py', args.metrics_json)
+
+    rowmap_file = rowmap.rowmap_path(args.output_cs_file)
+    if args.incremental and transfer_incremental(args, rowmap_file, run_metrics):
+        run_metrics.finish()
+        print('Program finished! Good luck!!')
+        return
+
+    # --incremental may rebuild its own previous output, but nothing else, without --overwrite.
+    replace_recorded_output = args.incremental and is_recorded_output(args, rowmap_file)
+    if not args.overwrite and not replace_recorded_output:
         assert not os.path.exists(args.output_cs_file), f'The output cs file {args.output_cs_file} already exists. If you want to overwride the file, manualy remove it before use this script.'
     output_cs_file_basename = os.path.basename(args.output_cs_file)
     output_csg_file = os.path.splitext(args.output_cs_file)[0] + '.csg'
-    if not args.overwrite:
+    if not args.overwrite and not replace_recorded_output:
         assert not os.path.exists(output_csg_file), f'The output csg file {output_csg_file} already exists. If you want to overwride the file, manualy remove it before use this script.'
 
     print(f'Loading {args.orig_csg_file} ...')
-    with open(args.orig_csg_file, 'r') as f:
-        orig_csg = yaml.load(f, Loader=yaml.FullLoader)
-
-    print(f'Loading {args.orig_cs_file} ...')
-    orig_dataset = dataset.Dataset().load(args.orig_cs_file)
-    print(f'Loading {args.orig_passthrough_file} ...')
-    orig_passthrough = dataset.Dataset().load(args.orig_passthrough_file)
-    print(f'Loading {args.imported_cs_file} ...')
-    imported_dataset = dataset.Dataset().load(args.imported_cs_file)
-
-    assert len(orig_dataset) == len(orig_passthrough)
+    orig_csg = csg.CsgDocument.read(args.orig_csg_file)
+
+    with run_metrics.phase('load') as phase:
+        print(f'Loading {args.orig_cs_file} ...')
+        arr_orig = csio.open_cs(args.orig_cs_file)
+        print(f'Loading {args.orig_passthrough_file} ...')
+        arr_passthrough = csio.open_cs(args.orig_passthrough_file)
+        print(f'Loading {args.imported_cs_file} ...')
+        # Only the fields needed for matching and the 3D poses are read from the imported dataset.
+        imported_reader = csio.CsReader(args.imported_cs_file)
+        arr_imported = imported_reader.load(['blob/path', 'blob/idx'] + [name for name in imported_reader.names if name.startswith('alignments3D/')])
+        phase.rows = len(arr_imported)
+
+    assert len(arr_orig) == len(arr_passthrough)
     # The imported dataset must be a subset of the original dataset.
-    assert len(imported_dataset) <= len(orig_dataset)
+    assert len(arr_imported) <= len(arr_orig)
 
     # Combine the original dataset and passthrough infos
     print(f'Combining the original dataset and passthrough infos...')
-    orig_dataset_passthrough = dataset.Dataset(orig_passthrough).innerjoin(orig_dataset)
+    with run_metrics.phase('join_passthrough', rows=len(arr_orig)):
+        found, orig_passthrough_idx = records.match_uids(arr_orig['uid'], arr_passthrough['uid'])
+    if len(found) != len(arr_orig):
+        sys.exit(f'{len(arr_orig) - len(found)} particles of {args.orig_cs_file} are not in {args.orig_passthrough_file}.')
 
     print(f'Preparing the original dataset infos')
-    df_orig = dataset.to_dataframe(orig_dataset_passthrough)
-    df_orig_dtypes = df_orig.dtypes.to_dict()
-    # Convert to numpy array for speeding up.
-    arr_orig = df_orig.to_numpy(copy=True)
-    cols_orig = list(df_orig.columns)
-    cols_orig_colidx_blobpath = cols_orig.index('blob/path')
-    cols_orig_colidx_blobidx = cols_orig.index('blob/idx')
-    print(f'Original blobpath example: {arr_orig[0, cols_orig_colidx_blobpath]}')
-    orig_blobpaths_basename = get_blobpath_basename(
-        arr_orig[:, cols_orig_colidx_blobpath].flatten().astype(str),
-        args.orig_num_remove_blobpath_uuid
-    )
-    print(f'Original blobpath basename example: {orig_blobpaths_basename[0]}')
-    # Sort by blobpath basename for faster search
-    arr_orig_sort_idxs = np.argsort(orig_blobpaths_basename, axis=0)
-    arr_orig = arr_orig[arr_orig_sort_idxs]
-    orig_blobpaths_basename_sorted = orig_blobpaths_basename[arr_orig_sort_idxs]
+    print(f'Original blobpath example: {arr_orig["blob/path"][0]}')
+    with run_metrics.phase('index_original', rows=len(arr_orig)):
+        orig_index, cached = blobkey.load_key_index(
+            args.orig_cs_file, args.orig_num_remove_blobpath_uuid,
+            cache_dir=args.index_cache_dir, use_cache=not args.no_index_cache
+        )
+    if cached:
+        print('Loaded the cached blob key index of the original dataset.')
+    print(f'Original blobpath basename example: {orig_index.basenames[orig_index.codes[0]]}')
 
     print(f'Preparing the imported dataset infos')
-    df_imported = dataset.to_dataframe(imported_dataset)
-    df_imported_dtypes = df_imported.dtypes.to_dict()
-    arr_imported = df_imported.to_numpy(copy=True)
-    cols_imported = list(df_imported.columns)
-    cols_imported_colidx_blobpath = cols_imported.index('blob/path')
-    cols_imported_colidx_blobidx = cols_imported.index('blob/idx')
-    print(f'Imported blobpath example: {arr_imported[0, cols_imported_colidx_blobpath]}')
-    imported_blobpaths_basename = get_blobpath_basename(
-        arr_imported[:, cols_imported_colidx_blobpath].flatten().astype(str),
-        args.imported_num_remove_blobpath_uuid
-    )
-    print(f'Imported blobpath basename example: {imported_blobpaths_basename[0]}')
-    arr_imported_sort_idxs = np.argsort(imported_blobpaths_basename, axis=0)
-    arr_imported = arr_imported[arr_imported_sort_idxs]
-    imported_blobpaths_basename_sorted = imported_blobpaths_basename[arr_imported_sort_idxs]
-    imported_blobpaths_basename_uniq = np.unique(imported_blobpaths_basename_sorted)
-
-    alignments3d_cols = [col for col in cols_imported if 'alignments3D/' in col]
-
-    output_df_list = []
-
-    print('Processing ....')
-    n = len(imported_blobpaths_basename_uniq)
-    progbar_length = 100
-    progbar_step = int(n / progbar_length)
-    # progbar_step = 1
-    num_step = 0
-    for i in range(len(imported_blobpaths_basename_uniq)):
-    # for i in range(10):
-        if i % progbar_step == 0:
-            sys.stdout.write('\r')
-            sys.stdout.write(
-                'Progress: [{:{}}] ({:7d} / {:7d})'
-                .format(
-                    '|' * num_step,
-                    progbar_length,
-                    i + 1,
-                    n
-                )
-            )
-            num_step += 1
-
-        blobpath_query = imported_blobpaths_basename_uniq[i]
-
-        arr_imported_same_blobpath_end_idx = len(imported_blobpaths_basename_sorted)
-        for j in range(len(imported_blobpaths_basename_sorted)):
-            if blobpath_query != imported_blobpaths_basename_sorted[j]:
-                arr_imported_same_blobpath_end_idx = j
-                break
-        arr_imported_same_blobpath = arr_imported[:arr_imported_same_blobpath_end_idx]
-        arr_imported_same_blobpath = arr_imported_same_blobpath[
-            np.argsort(arr_imported_same_blobpath[:, cols_imported_colidx_blobidx].flatten().astype(np.int))
-        ]
-        arr_imported = arr_imported[arr_imported_same_blobpath_end_idx:]
-        imported_blobpaths_basename_sorted = imported_blobpaths_basename_sorted[arr_imported_same_blobpath_end_idx:]
-
-        for j in range(len(orig_blobpaths_basename_sorted)):
-            if blobpath_query == orig_blobpaths_basename_sorted[j]:
-                break
-        arr_orig_same_blobpath_start_idx = j
-        arr_orig_same_blobpath_end_idx = len(orig_blobpaths_basename_sorted)
-        for j in range(arr_orig_same_blobpath_start_idx, len(orig_blobpaths_basename_sorted)):
-            if blobpath_query != orig_blobpaths_basename_sorted[j]:
-                arr_orig_same_blobpath_end_idx = j
-                break
-        arr_orig_same_blobpath = arr_orig[arr_orig_same_blobpath_start_idx:arr_orig_same_blobpath_end_idx]
-        arr_orig_same_blobpath = arr_orig_same_blobpath[
-            np.argsort(arr_orig_same_blobpath[:, cols_orig_colidx_blobidx].flatten().astype(np.int))
-        ]
-        arr_orig = arr_orig[arr_orig_same_blobpath_end_idx:]
-        orig_blobpaths_basename_sorted = orig_blobpaths_basename_sorted[arr_orig_same_blobpath_end_idx:]
-
-        arr_orig_same_blobpath_match_or_not = np.isin(
-            arr_orig_same_blobpath[:, cols_orig_colidx_blobidx].astype(int),
-            arr_imported_same_blobpath[:, cols_imported_colidx_blobidx].astype(int),
-            assume_unique=True
+    print(f'Imported blobpath example: {arr_imported["blob/path"][0]}')
+    with run_metrics.phase('index_imported', rows=len(arr_imported)):
+        imported_blobpaths_basename = blobkey.get_blobpath_basename(
+            arr_imported['blob/path'],
+            args.imported_num_remove_blobpath_uuid
         )
-        arr_orig_same_blobpath_matched = arr_orig_same_blobpath[arr_orig_same_blobpath_match_or_not]
-        # Sort by blob/idx
-        arr_orig_same_blobpath_matched = arr_orig_same_blobpath_matched[
-            np.argsort(arr_orig_same_blobpath_matched[:, cols_orig_colidx_blobidx].flatten().astype(np.int), axis=0)
-        ]
-
-        assert np.all(arr_imported_same_blobpath[:, cols_imported_colidx_blobidx] == arr_orig_same_blobpath_matched[:, cols_orig_colidx_blobidx])
-
-
-        df_imported_same_blobpath = pd.DataFrame(arr_imported_same_blobpath, columns=cols_imported)
-        df_orig_same_blobpath_matched = pd.DataFrame(arr_orig_same_blobpath_matched, columns=cols_orig)
-
-        # Transfer the 3D poses
-        df_orig_same_blobpath_matched[alignments3d_cols] = df_imported_same_blobpath[alignments3d_cols]
-
-        output_df_list.append(df_orig_same_blobpath_matched)
-
-    sys.stdout.write('\r')
-    sys.stdout.write('Progress: [{:{}}] ({:7d} / {:7d})'.format('|' * progbar_length, progbar_length,  n, n))
-
-    print('\nConcatenating dataframes...')
-    df_out = pd.concat(output_df_list, ignore_index=True)
-    df_out_dtypes = df_orig_dtypes
-    for k, v in df_imported_dtypes.items():
-        if 'alignments3D' in k:
-            df_out_dtypes[k] = v
-    df_out = df_out.astype(df_out_dtypes)
-
-    assert len(df_out) == len(df_imported)
+    print(f'Imported blobpath basename example: {imported_blobpaths_basename[0]}')
 
-    print(f'The number of the total particles: {len(df_out)}')
-    num_items = len(df_out)
+    alignments3d_cols = records.columns_with_prefix(arr_imported, 'alignments3D/')
+
+    print('Matching particles by (blobpath basename, blob/idx) ...')
+    with run_metrics.phase('match', rows=len(arr_imported)):
+        match = blobkey.match_blob_keys(orig_index, imported_blobpaths_basename, arr_imported['blob/idx'])
+    print(match.summary())
+    if not match.ok:
+        sys.exit('Failed to match the imported particles to the original particles one-to-one. Check --orig_num_remove_blobpath_uuid and --imported_num_remove_blobpath_uuid.')
+
+    # Matched rows are ordered by (blobpath basename, blob/idx).
+    # Only the matched rows are gathered from the passthrough, original and imported datasets,
+    # and the 3D poses are transferred column by column.
+    with run_metrics.phase('gather', rows=match.num_matched):
+        arr_out = records.gather([
+            (arr_passthrough, orig_passthrough_idx[match.ref_idx], None),
+            (arr_orig, match.ref_idx, None),
+            (arr_imported, match.query_idx, alignments3d_cols),
+        ])
+    del arr_orig, arr_passthrough, arr_imported
+
+    assert len(arr_out) == len(imported_reader)
+
+    print(f'The number of the total particles: {len(arr_out)}')
+    num_items = len(arr_out)
     print(f'Saving output cs file...')
-    output_dataset = dataset.Dataset(df_out.to_records(index=False))
-    output_dataset.save(args.output_cs_file)
+    with run_metrics.phase('save', rows=num_items):
+        csio.save_dataset(args.output_cs_file, arr_out)
     print(f'The output cs file {args.output_cs_file} saved.')
-
-    orig_csg['group']['description'] = 'Created by csutil_transfer_alignments3d.py of https://github.com/kttn8769/cryosparc_utils.git'
-    orig_csg['created'] = datetime.datetime.now()
-    results_keys = orig_csg['results'].keys()
-    for key in results_keys:
-        orig_csg['results'][key]['metafile'] = f'>{output_cs_file_basename}'
-        orig_csg['results'][key]['num_items'] = num_items
-    if 'alignments3D' not in results_keys:
-        orig_csg['results']['alignments3D'] = {
-            'metafile': f'>{output_cs_file_basename}',
-            'num_items': num_items,
-            'type': 'particle.alignments3D'
-        }
-    with open(output_csg_file, 'w') as f:
-        yaml.dump(orig_csg, stream=f)
+    if args.incremental:
+        rowmap.RowMap(
+            match.ref_idx, match.query_idx, len(imported_reader), alignments3d_cols,
+            sources={name: rowmap.file_source(path) for name, path in rowmap_files(args).items()},
+            settings=rowmap_settings(args)
+        ).save(rowmap_file)
+        print(f'The row mapping of the output is saved as {rowmap_file} for incremental transfers.')
+
+    # Only the description, creation time and results.*.metafile/num_items are edited. The rest of the csg file is kept as it is.
+    orig_csg.set(('group', 'description'), 'Created by csutil_transfer_alignments3d.py of https://github.com/kttn8769/cryosparc_utils.git')
+    orig_csg.set(('created',), datetime.datetime.now())
+    for key in list(orig_csg.results.keys()):
+        orig_csg.set_result(key, metafile=output_cs_file_basename, num_items=num_items)
+    if 'alignments3D' not in orig_csg.results:
+        orig_csg.set_result('alignments3D', metafile=output_cs_file_basename, num_items=num_items, result_type='particle.alignments3D')
+    orig_csg.write(output_csg_file)
     print(f'The accompanying csg file {output_csg_file}. Use this file for the input of Import Result Group job in cryoSPARC.')
+    run_metrics.finish()
     print('Program finished! Good luck!!')
 
 
@@ -0,0 +1,59 @@
+import os
+import numpy as np
+import pytest
+from csutil_lib import blobkey, csio, synthetic
+
+
+def test_unused_duplicate_ref_key_does_not_fail_match():
+    ref = blobkey.KeyIndex.from_basenames(np.array(['a', 'a', 'b', 'b']), np.array([0, 1, 5, 5]))
+    match = blobkey.match_blob_keys(ref, np.array(['a', 'a']), np.array([1, 0]))
+    assert match.ok
+    assert match.duplicate_ref_keys == []
+    assert sorted(zip(match.query_idx.tolist(), match.ref_idx.tolist())) == [(0, 1), (1, 0)]
+
+
+def test_used_duplicate_ref_key_fails_match():
+    ref = blobkey.KeyIndex.from_basenames(np.array(['a', 'b', 'b']), np.array([0, 5, 5]))
+    match = blobkey.match_blob_keys(ref, np.array(['a', 'b']), np.array([0, 5]))
+    assert not match.ok
+    assert match.duplicate_ref_keys == [('b', 5)]
+
+
+def reference_basename(path, num_remove_uuid):
+    s = os.path.splitext(os.path.basename(path))[0]
+    return '_'.join(s.split('_')[num_remove_uuid:])
+
+
+@pytest.mark.parametrize('num_remove_uuid', [0, 1, 2, 3])
+def test_basenames_match_the_os_path_reference(num_remove_uuid):
+    paths = np.array([
+        'J1/imported/012345_6789_particles.mrc', '/abs/J2/extract/0123_particles.mrcs', 'no_dir_file', 'a.b/c_d.e.mrc',
+        'J3/.hidden', 'J3/..double_dot', 'J4/trailing_', 'J4/_leading.mrc', '', 'J1/imported/012345_6789_particles.mrc',
+    ])
+    expected = [reference_basename(path, num_remove_uuid) for path in paths]
+    assert blobkey.get_blobpath_basename(paths, num_remove_uuid).tolist() == expected
+    assert blobkey.get_blobpath_basename(np.char.encode(paths), num_remove_uuid).tolist() == expected
+
+
+def test_key_index_cache_round_trip_and_invalidation(tmp_path):
+    arr = synthetic.make_particles(500, 5)
+    path = str(tmp_path / 'J1_particles.cs')
+    csio.save_cs(path, arr)
+    cache_dir = str(tmp_path / 'cache')
+    index, cached = blobkey.load_key_index(path, 1, cache_dir)
+    assert not cached
+    cached_index, cached = blobkey.load_key_index(path, 1, cache_dir)
+    assert cached
+    assert np.array_equal(cached_index.sorted_keys, index.sorted_keys)
+    assert np.array_equal(cached_index.basenames, index.basenames)
+    # Another number of removed UUID strings and a rewritten file do not use the cache.
+    assert not blobkey.load_key_index(path, 0, cache_dir)[1]
+    os.utime(path, ns=(0, 0))
+    assert not blobkey.load_key_index(path, 1, cache_dir)[1]
+
+
+def test_match_reports_unmatched_query_rows():
+    ref = blobkey.KeyIndex.from_basenames(np.array(['a', 'a', 'b']), np.array([0, 1, 0]))
+    match = blobkey.match_blob_keys(ref, np.array(['b', 'c', 'a', 'a']), np.array([0, 0, 1, 7]))
+    assert sorted(zip(match.query_idx.tolist(), match.ref_idx.tolist())) == [(0, 2), (2, 1)]
+    assert match.unmatched_query_idx.tolist() == [1, 3]
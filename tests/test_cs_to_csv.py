@@ -0,0 +1,41 @@
+import pytest
+import csutil_cs_to_csv
+from csutil_lib import csio, synthetic
+
+
+@pytest.fixture
+def particles_file(tmp_path):
+    path = str(tmp_path / 'particles.cs')
+    csio.save_cs(path, synthetic.make_particles(2500, 10))
+    return path
+
+
+def export(path, outfile, fmt, chunk_size, columns=None):
+    csutil_cs_to_csv.main(path, outfile, False, fmt, columns, chunk_size)
+    return outfile
+
+
+def test_chunked_csv_is_identical_to_unchunked(tmp_path, particles_file):
+    pytest.importorskip('cryosparc_compute')
+    unchunked = export(particles_file, str(tmp_path / 'all.csv'), 'csv', 10 ** 6)
+    chunked = export(particles_file, str(tmp_path / 'chunked.csv'), 'csv', 700)
+    with open(unchunked, 'rb') as f1, open(chunked, 'rb') as f2:
+        assert f1.read() == f2.read()
+
+
+@pytest.mark.parametrize('fmt', ['parquet', 'feather'])
+def test_chunked_arrow_is_identical_to_unchunked(tmp_path, particles_file, fmt):
+    pa = pytest.importorskip('pyarrow')
+    columns = ['uid', 'blob/path', 'alignments3D/pose', 'ctf/df1_A']
+    unchunked = export(particles_file, str(tmp_path / f'all.{fmt}'), fmt, 10 ** 6, columns)
+    chunked = export(particles_file, str(tmp_path / f'chunked.{fmt}'), fmt, 700, columns)
+    if fmt == 'parquet':
+        import pyarrow.parquet
+        read = pyarrow.parquet.read_table
+    else:
+        import pyarrow.feather
+        read = pyarrow.feather.read_table
+    table = read(chunked)
+    assert table.equals(read(unchunked))
+    assert table.num_rows == 2500 and table.column_names == columns
+    assert table.column('alignments3D/pose').type == pa.list_(pa.float32(), 3)
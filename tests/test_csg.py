@@ -0,0 +1,53 @@
+from csutil_lib import csg
+
+TEXT = '''created: 2024-01-01 00:00:00.123456
+group:
+  description: "particles  with  odd spacing"   # kept as is
+  name: particles
+  title: Particles
+  type: particle
+results:
+  blob:
+    metafile: '>J10_particles.cs'
+    num_items: 1000
+    type: particle.blob
+  ctf:
+    metafile: '>J10_particles.cs'
+    num_items: 1000
+    type: particle.ctf
+version: v4.0.0
+'''
+
+
+def test_edits_keep_untouched_lines():
+    doc = csg.CsgDocument(TEXT)
+    doc.set_result('blob', metafile='J20_particles.cs', num_items=42)
+    text = doc.dumps()
+    assert csg.loads(text)['results']['blob'] == {'metafile': '>J20_particles.cs', 'num_items': 42, 'type': 'particle.blob'}
+    old_lines, new_lines = TEXT.splitlines(), text.splitlines()
+    assert len(old_lines) == len(new_lines)
+    changed = [i for i, (old, new) in enumerate(zip(old_lines, new_lines)) if old != new]
+    assert changed == [8, 9]
+
+
+def test_added_and_removed_results():
+    doc = csg.CsgDocument(TEXT)
+    doc.remove(('results', 'ctf'))
+    doc.set_result('alignments3D', metafile='J20_particles.cs', num_items=1000, result_type='particle.alignments3D')
+    text = doc.dumps()
+    assert csg.loads(text) == doc.data
+    assert list(doc.data['results']) == ['blob', 'alignments3D']
+    assert text.startswith(TEXT[:TEXT.index('  ctf:')])
+    assert text.endswith('version: v4.0.0\n')
+
+
+def test_unedited_document_is_returned_as_is():
+    assert csg.CsgDocument(TEXT).dumps() == TEXT
+
+
+def test_unsupported_layout_falls_back_to_full_dump_with_warning(capsys):
+    doc = csg.CsgDocument('results: {blob: {metafile: ">a.cs", num_items: 1}}\n')
+    doc.set_result('blob', num_items=2)
+    text = doc.dumps()
+    assert csg.loads(text) == {'results': {'blob': {'metafile': '>a.cs', 'num_items': 2}}}
+    assert 'Warning' in capsys.readouterr().err
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from csutil_lib import csio, synthetic
+
+
+def write_particles(tmp_path, num_particles):
+    arr = synthetic.make_particles(num_particles, 10)
+    path = str(tmp_path / 'particles.cs')
+    csio.save_cs(path, arr)
+    return path, arr
+
+
+def test_header_matches_array(tmp_path):
+    path, arr = write_particles(tmp_path, 1234)
+    header = csio.read_header(path)
+    assert header.num_items == len(arr)
+    assert header.names == arr.dtype.names
+    assert header.nbytes == arr.nbytes
+
+
+def test_chunks_concatenate_to_projected_fields(tmp_path):
+    path, arr = write_particles(tmp_path, 1234)
+    fields = ['uid', 'alignments3D/pose', 'blob/path']
+    chunks = list(csio.iter_chunks(path, 500, fields))
+    assert [len(chunk) for chunk in chunks] == [500, 500, 234]
+    assert all(chunk.dtype.names == tuple(fields) for chunk in chunks)
+    assert np.array_equal(np.concatenate(chunks), csio.project(arr, fields))
+    assert np.array_equal(csio.load_fields(path, fields), csio.project(arr, fields))
+
+
+def test_empty_file_yields_one_empty_chunk(tmp_path):
+    path, arr = write_particles(tmp_path, 0)
+    chunks = list(csio.iter_chunks(path, 100, ['uid']))
+    assert len(chunks) == 1 and len(chunks[0]) == 0
+
+
+def test_reader_columns(tmp_path):
+    path, arr = write_particles(tmp_path, 100)
+    reader = csio.CsReader(path)
+    assert len(reader) == 100 and 'uid' in reader and 'no/such' not in reader
+    assert np.array_equal(reader['ctf/df1_A'], arr['ctf/df1_A'])
+    assert not isinstance(reader['ctf/df1_A'], np.memmap)
+    with pytest.raises(KeyError):
+        reader['no/such']
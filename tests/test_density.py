@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+from csutil_lib import csio, density, synthetic
+
+
+def test_viewing_directions_are_the_third_row_of_the_rotation():
+    rotation = pytest.importorskip('scipy.spatial.transform').Rotation
+    pose = np.random.default_rng(0).normal(0, 1.5, (1000, 3))
+    pose[0] = 0.0
+    azimuth, elevation = density.viewing_directions(pose)
+    view = rotation.from_rotvec(pose).as_matrix()[:, 2, :]
+    assert np.allclose(np.radians(elevation), np.arcsin(np.clip(view[:, 2], -1, 1)))
+    assert np.allclose(np.radians(azimuth), np.arctan2(view[:, 1], view[:, 0]))
+    assert (azimuth[0], elevation[0]) == (0.0, 90.0)
+
+
+def test_chunked_densities_of_several_files_match_histogram2d(tmp_path):
+    arrays = [synthetic.make_particles(n, 5, seed=i) for i, n in enumerate((700, 1300))]
+    paths = []
+    for i, arr in enumerate(arrays):
+        paths.append(str(tmp_path / f'{i}.cs'))
+        csio.save_cs(paths[-1], arr)
+    specs = ['ctf/df1_A:alignments3D/pose/2', density.VIEWING]
+    ranges = density.merge_ranges([density.file_ranges(path, specs, 300) for path in paths])
+    hists = density.merge_densities([density.file_densities(path, specs, ranges, 20, 300) for path in paths])
+    both = np.concatenate(arrays)
+    for spec in specs:
+        x, y = density.spec_values(both, spec)
+        expected, _, _ = np.histogram2d(x, y, bins=(hists[spec].xedges, hists[spec].yedges))
+        assert np.array_equal(hists[spec].counts, expected)
+        assert hists[spec].counts.sum() == len(both)
+    assert ranges['ctf/df1_A:alignments3D/pose/2'][0] == (both['ctf/df1_A'].min(), both['ctf/df1_A'].max())
+
+
+@pytest.mark.parametrize('spec', ['ctf/df1_A', 'ctf/df1_A:', 'ctf/df1_A:no/such', 'alignments3D/pose/7x:ctf/df1_A'])
+def test_invalid_specs(spec):
+    names = ('uid', 'ctf/df1_A', 'alignments3D/pose')
+    with pytest.raises(ValueError):
+        density.check_specs([spec], names, 'particles.cs')
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from csutil_lib import filterexpr
+
+
+def test_parse_clauses():
+    clauses = filterexpr.parse_filter('alignments3D/error < 1e4 & 0.1 < ctf/cross_corr_ctffind4 & sigma(alignments2D/alpha, 3) & range(ctf/df1_A, 1000, 2e4)')
+    assert [(c.field, c.kind) for c in clauses] == [
+        ('alignments3D/error', 'compare'), ('ctf/cross_corr_ctffind4', 'compare'), ('alignments2D/alpha', 'sigma'), ('ctf/df1_A', 'range')
+    ]
+    assert (clauses[0].op, clauses[0].value) == ('<', 1e4)
+    # A number on the left flips the operator.
+    assert (clauses[1].op, clauses[1].value) == ('>', 0.1)
+    assert clauses[2].sigma == 3
+    assert (clauses[3].minval, clauses[3].maxval) == (1000, 2e4)
+
+
+@pytest.mark.parametrize('expr', [
+    'ctf/df1_A <',
+    'ctf/df1_A < 1 &',
+    'sigma(ctf/df1_A, 1, 2)',
+    'range(ctf/df1_A, 1)',
+    'sigma((ctf/df1_A, 1)',
+    'ctf/df1_A => 1',
+])
+def test_parse_errors(expr):
+    with pytest.raises(filterexpr.FilterSyntaxError):
+        filterexpr.parse_filter(expr)
+
+
+def test_resolved_sigma_matches_evaluated_sigma():
+    col = np.random.default_rng(0).normal(5.0, 2.0, 10000)
+    clause, = filterexpr.parse_filter('sigma(x, 1.5)')
+    mask, rejected = filterexpr.evaluate([clause], {'x': col}.__getitem__, len(col))
+    resolved, = filterexpr.resolve_sigma([clause], {'x': (col.mean(), col.std(ddof=1))})
+    assert resolved.kind == 'range'
+    assert np.isclose(resolved.minval, col.mean() - 1.5 * col.std(ddof=1))
+    resolved_mask, resolved_rejected = filterexpr.evaluate([resolved], {'x': col}.__getitem__, len(col))
+    assert np.array_equal(mask, resolved_mask)
+    assert rejected == resolved_rejected == {'sigma(x, 1.5)': int(np.count_nonzero(~mask))}
+
+
+def test_rejections_are_counted_per_clause():
+    columns = {'a': np.arange(10.0), 'b': np.arange(10.0)[::-1]}
+    mask, rejected = filterexpr.evaluate(filterexpr.parse_filter('a >= 3 & b >= 3'), columns.__getitem__, 10)
+    assert mask.tolist() == [False] * 3 + [True] * 4 + [False] * 3
+    assert rejected == {'a >= 3': 3, 'b >= 3': 3}
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+from csutil_lib import groupby
+
+
+def test_aggregate_matches_pandas_groupby():
+    pd = pytest.importorskip('pandas')
+    rng = np.random.default_rng(0)
+    labels = rng.choice(np.array(['mic_a', 'mic_b', 'mic_c', 'mic_d']), 3000)
+    values = rng.normal(10.0, 3.0, len(labels))
+    values[rng.random(len(values)) < 0.05] = np.nan
+    # One group with a single particle and one with only NaNs
+    labels = np.concatenate([labels, ['single', 'all_nan', 'all_nan']])
+    values = np.concatenate([values, [1.5, np.nan, np.nan]])
+    groups = groupby.Groups(labels)
+    out = groups.aggregate(values, quantiles=[0.1, 0.9])
+    expected = pd.Series(values).groupby(labels).agg(
+        count='count', mean='mean', stdev='std', min='min', max='max', median='median',
+        q10=lambda s: s.quantile(0.1), q90=lambda s: s.quantile(0.9)
+    ).reindex(groups.labels)
+    assert groups.labels.tolist() == sorted(set(labels.tolist()))
+    assert groups.counts.tolist() == [int(np.count_nonzero(labels == label)) for label in groups.labels]
+    assert out['count'].tolist() == expected['count'].tolist()
+    for stat, column in (('mean', 'mean'), ('stdev', 'stdev'), ('min', 'min'), ('max', 'max'), ('median', 'median'), ('q0.1', 'q10'), ('q0.9', 'q90')):
+        assert np.allclose(out[stat], expected[column].to_numpy(dtype=np.float64), equal_nan=True), stat
+
+
+def test_flag_outliers_by_robust_zscore():
+    table = {'count': np.array([100, 98, 103, 101, 99, 5]), 'x_mean': np.array([1.0, 1.1, 0.9, 1.0, 25.0, 1.0])}
+    flagged, reasons = groupby.flag_outliers(table, ['count', 'x_mean'], 3.5)
+    assert flagged.tolist() == [False, False, False, False, True, True]
+    assert reasons[4].startswith('x_mean') and reasons[5].startswith('count')
+
+
+def test_blob_groups_are_basenames():
+    paths = np.array([b'J1/extract/0001_a.mrc', b'J2/extract/0001_a.mrc', b'J1/extract/0002_b.mrc'])
+    assert groupby.group_labels('blob', paths).tolist() == ['0001_a', '0001_a', '0002_b']
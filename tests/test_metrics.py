@@ -0,0 +1,17 @@
+import json
+import pytest
+from csutil_lib import metrics
+
+
+def test_failed_phase_is_recorded(tmp_path):
+    metrics_json = tmp_path / 'metrics.json'
+    run_metrics = metrics.Metrics('test', str(metrics_json), verbose=False)
+    with run_metrics.phase('load', rows=10):
+        pass
+    with pytest.raises(ValueError):
+        with run_metrics.phase('filter', rows=10):
+            raise ValueError('bad column')
+    assert [phase.error for phase in run_metrics.phases] == [None, "ValueError('bad column')"]
+    assert 'FAILED' in run_metrics.phases[1].text()
+    phases = json.loads(metrics_json.read_text())['phases']
+    assert [phase['error'] for phase in phases] == [None, "ValueError('bad column')"]
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+import csutil_particle_filtering
+from csutil_lib import csio
+
+
+@pytest.mark.parametrize('chunk_size', [None, 3000])
+def test_retained_histograms_are_exact(tmp_path, chunk_size):
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(2):
+        arr = np.zeros(10000, dtype=[('uid', '<u8'), ('ctf/exp_group_id', '<u4')])
+        arr['uid'] = np.arange(10000) + i * 10000
+        arr['ctf/exp_group_id'] = rng.integers(0, 8, len(arr))
+        paths.append(str(tmp_path / f'{i}.cs'))
+        csio.save_cs(paths[-1], arr)
+    clauses = csutil_particle_filtering.build_clauses('ctf/exp_group_id', None, 0, 3, None)
+    results = [csutil_particle_filtering.filter_file(path, None, clauses, None, chunk_size) for path in paths]
+    column_stats, = csutil_particle_filtering.retained_field_stats(paths, None, ['ctf/exp_group_id'], chunk_size, results, 1)
+    retained = np.concatenate([result[5]['ctf/exp_group_id'] for result in results])
+    assert sum(column_stats.hist_counts) == len(retained) == sum(result[1] for result in results)
+    assert column_stats.hist_counts == np.histogram(retained, bins=column_stats.hist_edges)[0].tolist()
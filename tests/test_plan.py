@@ -0,0 +1,44 @@
+from csutil_lib import filterexpr, plan, synthetic
+
+
+def test_transfer_plan_correct_uuid_settings_have_no_warnings(tmp_path):
+    paths = synthetic.write_transfer_set(str(tmp_path), 5000, num_micrographs=50, orig_num_uuid=1, imported_num_uuid=1)
+    # The imported basenames carry the original UUID prefix and one more.
+    transfer_plan = plan.transfer_plan(paths['orig_cs_file'], paths['orig_passthrough_file'], paths['imported_cs_file'], 1, 2, use_cache=False)
+    assert transfer_plan.warnings == []
+
+
+def test_transfer_plan_suggests_correct_uuid_settings(tmp_path):
+    paths = synthetic.write_transfer_set(str(tmp_path), 5000, num_micrographs=50, orig_num_uuid=1, imported_num_uuid=1)
+    transfer_plan = plan.transfer_plan(paths['orig_cs_file'], paths['orig_passthrough_file'], paths['imported_cs_file'], 1, 1, use_cache=False)
+    assert any('--orig_num_remove_blobpath_uuid 1 --imported_num_remove_blobpath_uuid 2' in warning for warning in transfer_plan.warnings)
+
+
+def phase_memory(plan_of_size, small, large):
+    return [(p.name, p.memory) for p in plan_of_size(small).phases], [(p.name, p.memory) for p in plan_of_size(large).phases]
+
+
+def test_transfer_memory_grows_with_the_input(tmp_path):
+    def plan_of_size(num_particles):
+        paths = synthetic.write_transfer_set(str(tmp_path / str(num_particles)), num_particles, num_micrographs=20)
+        return plan.transfer_plan(paths['orig_cs_file'], paths['orig_passthrough_file'], paths['imported_cs_file'], 1, 1, use_cache=False)
+    small, large = phase_memory(plan_of_size, 4000, 16000)
+    assert [name for name, _ in small] == [name for name, _ in large]
+    # Every phase holds arrays of a size per row, so memory is proportional to the number of particles.
+    for (name, small_memory), (_, large_memory) in zip(small, large):
+        assert 3.5 < large_memory / small_memory < 4.5, name
+
+
+def test_filter_memory_grows_with_the_input(tmp_path):
+    def plan_of_size(num_particles):
+        paths = synthetic.write_transfer_set(str(tmp_path / str(num_particles)), num_particles, num_micrographs=20)
+        return plan.filter_plan([paths['orig_cs_file']], [paths['orig_passthrough_file']], filterexpr.parse_filter('sigma(ctf/df1_A, 2)'), None)
+    small, large = phase_memory(plan_of_size, 4000, 16000)
+    for (name, small_memory), (_, large_memory) in zip(small, large):
+        assert 3.5 < large_memory / small_memory < 4.5, name
+
+
+def test_filter_plan_without_enough_sampled_rows_for_sigma(tmp_path):
+    paths = synthetic.write_transfer_set(str(tmp_path), 1000, num_micrographs=10)
+    filter_plan = plan.filter_plan([paths['orig_cs_file']], [paths['orig_passthrough_file']], filterexpr.parse_filter('sigma(ctf/df1_A, 2)'), None, sample_size=1)
+    assert any('Not enough sampled rows' in warning for warning in filter_plan.warnings)
@@ -0,0 +1,43 @@
+import os
+import numpy as np
+import pytest
+import csutil_replace_metafile
+from csutil_lib import csg, csio, synthetic
+
+
+@pytest.fixture
+def csg_dir(tmp_path):
+    indir = tmp_path / 'in'
+    indir.mkdir()
+    for name, num_items in (('J1', 10), ('J2', 20)):
+        csg.save_csg(str(indir / f'{name}_particles.csg'), synthetic.make_csg(f'{name}_particles.cs', num_items, ['blob', 'ctf']))
+    metadir = tmp_path / 'meta'
+    metadir.mkdir()
+    for name, num_items in (('J1', 11), ('J2', 22)):
+        csio.save_cs(str(metadir / f'{name}_particles.cs'), np.zeros(num_items, dtype=[('uid', '<u8')]))
+    return tmp_path
+
+
+def test_batch_repoints_metafiles_to_a_directory(csg_dir):
+    outdir = str(csg_dir / 'out')
+    csutil_replace_metafile.main([str(csg_dir / 'in')], None, None, False, outdir=outdir, metafile_dir=str(csg_dir / 'meta'), num_workers=2)
+    for name, num_items in (('J1', 11), ('J2', 22)):
+        doc = csg.CsgDocument.read(os.path.join(outdir, f'{name}_particles.csg'))
+        for result in doc.results.values():
+            assert result['metafile'] == f'>{csg_dir / "meta" / f"{name}_particles.cs"}'
+            assert result['num_items'] == num_items
+        # Everything but the results entries is kept as is.
+        with open(csg_dir / 'in' / f'{name}_particles.csg') as f:
+            assert csg.loads(f.read())['group'] == doc.data['group']
+
+
+def test_outfile_needs_a_single_input(csg_dir):
+    with pytest.raises(SystemExit):
+        csutil_replace_metafile.main([str(csg_dir / 'in')], str(csg_dir / 'out.csg'), str(csg_dir / 'meta' / 'J1_particles.cs'), False)
+
+
+def test_existing_outputs_are_kept_without_overwrite(csg_dir):
+    outdir = str(csg_dir / 'out')
+    csutil_replace_metafile.main([str(csg_dir / 'in')], None, None, False, outdir=outdir, metafile_dir=str(csg_dir / 'meta'))
+    with pytest.raises(SystemExit):
+        csutil_replace_metafile.main([str(csg_dir / 'in')], None, None, False, outdir=outdir, metafile_dir=str(csg_dir / 'meta'))
@@ -0,0 +1,82 @@
+import sys
+import numpy as np
+import pytest
+import csutil_transfer_alignments3d
+from csutil_lib import blobkey, csio, rowmap, synthetic
+
+
+@pytest.fixture
+def transfer_set(tmp_path):
+    return synthetic.write_transfer_set(str(tmp_path), 3000, num_micrographs=20)
+
+
+def match_rows(paths):
+    # Copies, as the tests rewrite the files
+    orig = np.array(csio.open_cs(paths['orig_cs_file']))
+    imported = np.array(csio.open_cs(paths['imported_cs_file']))
+    index = blobkey.KeyIndex.from_blobpaths(orig['blob/path'], orig['blob/idx'], 1)
+    match = blobkey.match_blob_keys(index, blobkey.get_blobpath_basename(imported['blob/path'], 2), imported['blob/idx'])
+    assert match.ok
+    return orig, imported, match
+
+
+def test_rowmap_save_load_and_staleness(tmp_path, transfer_set):
+    _, imported, match = match_rows(transfer_set)
+    files = {'orig': transfer_set['orig_cs_file'], 'passthrough': transfer_set['orig_passthrough_file']}
+    settings = {'orig_num_remove_uuid': 1, 'imported_num_remove_uuid': 2}
+    path = str(tmp_path / 'out.cs.rowmap.npz')
+    columns = ['alignments3D/pose', 'alignments3D/shift']
+    rowmap.RowMap(match.ref_idx, match.query_idx, len(imported), columns, {name: rowmap.file_source(p) for name, p in files.items()}, settings).save(path)
+    mapping = rowmap.RowMap.load(path)
+    assert np.array_equal(mapping.orig_idx, match.ref_idx) and np.array_equal(mapping.imported_idx, match.query_idx)
+    assert mapping.columns == columns and mapping.num_imported == len(imported)
+    assert mapping.stale(files, settings) == []
+    assert len(mapping.stale(files, dict(settings, imported_num_remove_uuid=1))) == 1
+    passthrough = np.array(csio.open_cs(transfer_set['orig_passthrough_file']))
+    csio.save_cs(transfer_set['orig_passthrough_file'], passthrough[:-1])
+    assert len(mapping.stale(files, settings)) == 1
+    assert rowmap.RowMap.load(str(tmp_path / 'missing.npz')) is None
+
+
+def test_check_and_scatter_modified_poses(tmp_path, transfer_set):
+    orig, imported, match = match_rows(transfer_set)
+    columns = [name for name in imported.dtype.names if name.startswith('alignments3D/')]
+    out = np.array(orig[match.ref_idx])
+    mapping = rowmap.RowMap(match.ref_idx, match.query_idx, len(imported), columns)
+    # Another refinement round: same particles in the same order with new poses.
+    reimported = np.array(imported)
+    reimported['alignments3D/pose'] = np.random.default_rng(5).normal(size=reimported['alignments3D/pose'].shape)
+    reimported_path = str(tmp_path / 'reimported.cs')
+    csio.save_cs(reimported_path, reimported)
+    assert rowmap.check_imported(mapping, out, reimported_path, columns, 1, 2) == []
+    rowmap.scatter_columns(out, csio.open_cs(reimported_path), mapping.imported_idx, columns)
+    assert np.array_equal(out['alignments3D/pose'], reimported['alignments3D/pose'][match.query_idx])
+    assert np.array_equal(out['uid'], orig['uid'][match.ref_idx])
+    # Reordered particles do not fit the mapping.
+    csio.save_cs(reimported_path, reimported[::-1])
+    assert len(rowmap.check_imported(mapping, out, reimported_path, columns, 1, 2)) == 1
+    csio.save_cs(reimported_path, reimported[:-1])
+    assert len(rowmap.check_imported(mapping, out, reimported_path, columns, 1, 2)) == 1
+
+
+def test_incremental_transfer_round_trip(tmp_path, transfer_set, monkeypatch, capsys):
+    pytest.importorskip('cryosparc_compute')
+    output = str(tmp_path / 'out' / 'transferred.cs')
+    (tmp_path / 'out').mkdir()
+    argv = ['csutil_transfer_alignments3d.py', '--incremental', '--no_index_cache', '--output_cs_file', output] + [
+        f'--{name}={path}' for name, path in transfer_set.items()
+    ]
+    monkeypatch.setattr(sys, 'argv', argv)
+    csutil_transfer_alignments3d.main()
+    full = np.array(csio.open_cs(output))
+    imported = np.array(csio.open_cs(transfer_set['imported_cs_file']))
+    imported['alignments3D/pose'] *= 2.0
+    csio.save_cs(transfer_set['imported_cs_file'], imported)
+    capsys.readouterr()
+    csutil_transfer_alignments3d.main()
+    assert f'alignments3D columns of {len(imported)} particles are updated' in capsys.readouterr().out
+    updated = csio.open_cs(output)
+    mapping = rowmap.RowMap.load(rowmap.rowmap_path(output))
+    assert np.array_equal(updated['alignments3D/pose'], imported['alignments3D/pose'][mapping.imported_idx])
+    assert np.allclose(updated['alignments3D/pose'], 2.0 * full['alignments3D/pose'])
+    assert np.array_equal(updated['uid'], full['uid'])
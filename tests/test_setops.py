@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+import csutil_particle_sets
+from csutil_lib import csg, csio, setops, synthetic
+
+
+def random_keys(seed):
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0, 300, size) for size in (200, 150, 100)]
+
+
+def test_union_takes_every_key_once_from_the_first_dataset_with_it():
+    key_arrays = random_keys(0)
+    rows = setops.union(key_arrays)
+    seen = {}
+    for i, keys in enumerate(key_arrays):
+        for row, key in enumerate(keys.tolist()):
+            seen.setdefault(key, (i, row))
+    assert sorted((i, row) for i, r in enumerate(rows) for row in r.tolist()) == sorted(seen.values())
+
+
+def test_intersect_and_difference_follow_python_sets():
+    key_arrays = random_keys(1)
+    others = [set(keys.tolist()) for keys in key_arrays[1:]]
+    first = key_arrays[0].tolist()
+    assert setops.intersect(key_arrays).tolist() == [row for row, key in enumerate(first) if all(key in other for other in others)]
+    assert setops.difference(key_arrays).tolist() == [row for row, key in enumerate(first) if not any(key in other for other in others)]
+    assert setops.num_duplicates(key_arrays[0]) == len(first) - len(set(first))
+
+
+def test_empty_other_dataset():
+    keys = np.array([3, 1, 2])
+    assert setops.intersect([keys, np.zeros(0, dtype=np.int64)]).tolist() == []
+    assert setops.difference([keys, np.zeros(0, dtype=np.int64)]).tolist() == [0, 1, 2]
+
+
+@pytest.mark.parametrize('match_by', ['uid', 'blob'])
+def test_keys_of_files_match_across_uuid_prefixes(tmp_path, match_by):
+    arr = synthetic.make_particles(600, 6)
+    # The second file holds every other particle of the first one under new uids and an extra UUID prefix.
+    other = synthetic.make_imported(arr, 0.5, 1, seed=3)
+    if match_by == 'uid':
+        other['uid'] = arr['uid'][:len(other)]
+    paths = [str(tmp_path / 'a.cs'), str(tmp_path / 'b.cs')]
+    csio.save_cs(paths[0], arr)
+    csio.save_cs(paths[1], other)
+    keys = csutil_particle_sets.load_keys(paths, match_by, [1, 2], None, use_cache=False)
+    if match_by == 'uid':
+        expected = set(arr['uid'][:len(other)].tolist())
+    else:
+        a_keys = list(zip([p.decode().rsplit('/', 1)[-1].split('_', 1)[1] for p in arr['blob/path']], arr['blob/idx'].tolist()))
+        b_keys = set(zip([p.decode().rsplit('/', 1)[-1].split('_', 2)[2] for p in other['blob/path']], other['blob/idx'].tolist()))
+        expected = {arr['uid'][row] for row, key in enumerate(a_keys) if key in b_keys}
+    assert set(arr['uid'][setops.intersect(keys)].tolist()) == expected
+    assert len(setops.intersect(keys)) == len(other)
+    assert len(setops.difference(keys)) == len(arr) - len(other)
+
+
+def test_union_writes_each_particle_once(tmp_path):
+    pytest.importorskip('cryosparc_compute')
+    arr = synthetic.make_particles(300, 3)
+    paths = [str(tmp_path / 'a.cs'), str(tmp_path / 'b.cs')]
+    csio.save_cs(paths[0], arr[:200])
+    csio.save_cs(paths[1], arr[100:])
+    outfile = str(tmp_path / 'union.cs')
+    csutil_particle_sets.main('union', paths, outfile)
+    assert np.array_equal(csio.open_cs(outfile)['uid'], arr['uid'])
+    assert csg.load_csg(str(tmp_path / 'union.csg'))['results']['blob']['num_items'] == len(arr)
@@ -0,0 +1,23 @@
+import json
+import numpy as np
+import csutil_stat
+from csutil_lib import csio
+
+
+def test_combined_histograms_are_exact(tmp_path):
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(3):
+        arr = np.zeros(5000, dtype=[('uid', '<u8'), ('ctf/exp_group_id', '<u4')])
+        arr['ctf/exp_group_id'] = rng.integers(0, 5, len(arr))
+        paths.append(str(tmp_path / f'{i}.cs'))
+        csio.save_cs(paths[-1], arr)
+    rootname = str(tmp_path / 'out')
+    csutil_stat.main(paths, rootname, False, 'auto', ['ctf/exp_group_id'], num_workers=1)
+    with open(f'{rootname}_stats.json') as f:
+        summary = json.load(f)
+    assert summary['quantiles_approximate']
+    column, = summary['columns']
+    values = np.concatenate([csio.open_cs(path)['ctf/exp_group_id'] for path in paths])
+    assert column['nobs'] == len(values) == sum(column['hist_counts'])
+    assert column['hist_counts'] == np.histogram(values, bins=column['hist_edges'])[0].tolist()
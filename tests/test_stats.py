@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from csutil_lib import stats
+
+
+def test_describe_columns_matches_scipy_and_numpy():
+    scipy_stats = pytest.importorskip('scipy.stats')
+    rng = np.random.default_rng(0)
+    pose = rng.normal(0, 1, (5000, 3)).astype(np.float32)
+    columns = {'ctf/df1_A': rng.gamma(5.0, 3000.0, 5000)}
+    columns.update(stats.expand_columns('alignments3D/pose', pose))
+    assert list(columns) == ['ctf/df1_A', 'alignments3D/pose/0', 'alignments3D/pose/1', 'alignments3D/pose/2']
+    quantiles = [0.05, 0.5, 0.95]
+    # block_size 2 splits the columns over several blocks.
+    for column_stats, (name, col) in zip(stats.describe_columns(columns, quantiles, block_size=2), columns.items()):
+        col = col.astype(np.float64)
+        expected = scipy_stats.describe(col)
+        assert column_stats.name == name
+        assert column_stats.nobs == expected.nobs
+        assert np.isclose(column_stats.mean, expected.mean)
+        assert np.isclose(column_stats.variance, expected.variance)
+        assert (column_stats.min, column_stats.max) == tuple(expected.minmax)
+        assert np.isclose(column_stats.skewness, expected.skewness)
+        assert np.isclose(column_stats.kurtosis, expected.kurtosis)
+        assert np.allclose(list(column_stats.quantiles.values()), np.quantile(col, quantiles))
+        counts, edges = np.histogram(col, bins='auto')
+        assert column_stats.hist_counts == counts.tolist()
+        assert np.allclose(column_stats.hist_edges, edges)
+
+
+def test_describe_empty_column():
+    column_stats, = stats.describe_columns({'x': np.zeros(0)}, quantiles=[0.5])
+    assert column_stats.nobs == 0
+    assert np.isnan(column_stats.mean) and np.isnan(column_stats.quantiles['0.5'])
+    assert column_stats.hist_counts == [0]
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from csutil_lib import csio, streaming
+
+
+def split_stats(values, num_parts):
+    parts = []
+    for part in np.array_split(values, num_parts):
+        acc = streaming.StreamingStats()
+        acc.update(part)
+        parts.append({'x': acc})
+    return streaming.merge_stats(parts)['x']
+
+
+def test_merged_moments_match_numpy():
+    values = np.random.default_rng(0).gamma(2.0, 3.0, 100000)
+    m = split_stats(values, 7).moments
+    assert m.n == len(values)
+    assert np.isclose(m.mean, values.mean())
+    assert np.isclose(m.variance, values.var(ddof=1))
+    assert (m.min, m.max) == (values.min(), values.max())
+    centered = values - values.mean()
+    assert np.isclose(m.skewness, np.mean(centered ** 3) / np.mean(centered ** 2) ** 1.5)
+
+
+def test_merged_sketch_quantiles_are_close():
+    values = np.random.default_rng(3).normal(0, 1, 200000)
+    acc = split_stats(values, 5)
+    q = [0.01, 0.25, 0.5, 0.75, 0.99]
+    assert np.allclose(acc.sketch.quantile(q), np.quantile(values, q), atol=0.01)
+
+
+def test_histogram_needs_second_pass():
+    acc = split_stats(np.arange(10.0), 2)
+    with pytest.raises(ValueError):
+        acc.histogram()
+
+
+def test_second_pass_histogram_is_exact_for_integer_values(tmp_path):
+    values = np.random.default_rng(1).integers(0, 5, 100000).astype(np.float32)
+    path = str(tmp_path / 'ints.cs')
+    arr = np.zeros(len(values), dtype=[('uid', '<u8'), ('x', '<f4')])
+    arr['x'] = values
+    csio.save_cs(path, arr)
+    accumulators = streaming.file_stats(path, ['x'], 30000)
+    streaming.set_histograms(accumulators, [streaming.file_histograms(path, ['x'], 30000, streaming.pending_histogram_ranges(accumulators))])
+    counts, edges = accumulators['x'].histogram()
+    assert counts.sum() == len(values)
+    assert np.array_equal(counts, np.histogram(values, bins=edges)[0])
+
+
+def test_chunked_describe_file_histogram_matches_numpy(tmp_path):
+    rng = np.random.default_rng(2)
+    values = np.concatenate([rng.normal(-3, 0.5, 40000), rng.normal(4, 1, 60000)]).astype(np.float32)
+    path = str(tmp_path / 'bimodal.cs')
+    arr = np.zeros(len(values), dtype=[('uid', '<u8'), ('x', '<f4')])
+    arr['x'] = values
+    csio.save_cs(path, arr)
+    column_stats, = streaming.describe_file(path, ['x'], quantiles=[0.5], chunk_size=25000)
+    assert sum(column_stats.hist_counts) == len(values)
+    assert column_stats.hist_counts == np.histogram(values, bins=column_stats.hist_edges)[0].tolist()